@@ -0,0 +1,30 @@
+"""add fulltext index
+
+Revision ID: 4b1f0c9d7a3e
+Revises: e7caa9dc2b22
+Create Date: 2026-10-17 06:02:11.318245
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b1f0c9d7a3e'
+down_revision: Union[str, None] = 'e7caa9dc2b22'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # FULLTEXT with the ngram parser is MySQL only (5.7.6+), other databases use the in-process text index
+    if op.get_bind().dialect.name == 'mysql':
+        op.create_index('ix_cuisine_details_fulltext', 'cuisine_details', ['name', 'description'], unique=False,
+                        mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'mysql':
+        op.drop_index('ix_cuisine_details_fulltext', table_name='cuisine_details')
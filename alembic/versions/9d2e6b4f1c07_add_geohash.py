@@ -0,0 +1,52 @@
+"""add geohash
+
+Revision ID: 9d2e6b4f1c07
+Revises: 4b1f0c9d7a3e
+Create Date: 2026-10-17 09:41:27.502113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.geo import encode_geohash
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2e6b4f1c07'
+down_revision: Union[str, None] = '4b1f0c9d7a3e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    op.add_column('cuisine_details', sa.Column('geohash', sa.String(length=12), nullable=True))
+
+    # Backfill the geohash from the numeric coordinates BATCH_SIZE rows at a time by primary key, rows without coordinates are left NULL
+    cuisine_details = sa.table('cuisine_details', sa.column('id', sa.String), sa.column('lat', sa.Float), sa.column('lng', sa.Float),
+                               sa.column('geohash', sa.String))
+    connection = op.get_bind()
+    statement = cuisine_details.update().where(cuisine_details.c.id == sa.bindparam("row_id")).values(geohash=sa.bindparam("geohash"))
+    last_id = ""
+    while True:
+        rows = connection.execute(sa.select(cuisine_details.c.id, cuisine_details.c.lat, cuisine_details.c.lng)
+                                  .where(cuisine_details.c.id > last_id).order_by(cuisine_details.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        updates = [{"row_id": row_id, "geohash": encode_geohash(lat, lng)} for row_id, lat, lng in rows if lat is not None and lng is not None]
+        if updates:
+            connection.execute(statement, updates)
+        last_id = rows[-1][0]
+
+    # The geohash index replaces the (lat, lng) index, which could only narrow the proximity search by latitude
+    op.create_index('ix_cuisine_details_geohash', 'cuisine_details', ['geohash'], unique=False)
+    op.drop_index('ix_cuisine_details_lat_lng', table_name='cuisine_details')
+
+
+def downgrade() -> None:
+    op.create_index('ix_cuisine_details_lat_lng', 'cuisine_details', ['lat', 'lng'], unique=False)
+    op.drop_index('ix_cuisine_details_geohash', table_name='cuisine_details')
+    op.drop_column('cuisine_details', 'geohash')
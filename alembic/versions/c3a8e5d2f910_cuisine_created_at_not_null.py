@@ -0,0 +1,36 @@
+"""cuisine created_at not null
+
+Revision ID: c3a8e5d2f910
+Revises: 9d2e6b4f1c07
+Create Date: 2026-10-17 15:12:48.206731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a8e5d2f910'
+down_revision: Union[str, None] = '9d2e6b4f1c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The keyset pagination cursor holds created_at, rows without one get their updated_at, or the oldest creation time so
+    # they stay at the end of the newest first order
+    cuisine_details = sa.table('cuisine_details', sa.column('created_at', sa.DateTime), sa.column('updated_at', sa.DateTime))
+    connection = op.get_bind()
+    oldest = connection.execute(sa.select(sa.func.min(cuisine_details.c.created_at))).scalar()
+    connection.execute(cuisine_details.update().where(cuisine_details.c.created_at.is_(None))
+                       .values(created_at=sa.func.coalesce(cuisine_details.c.updated_at, oldest or sa.func.now())))
+
+    with op.batch_alter_table('cuisine_details') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('cuisine_details') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
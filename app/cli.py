@@ -0,0 +1,56 @@
+"""
+Command line tools.
+
+Usage:
+        python -m app.cli import-cuisines cuisines.csv --user-id <user id>
+        python -m app.cli import-cuisines cuisines.parquet --user-id <user id> --chunk-size 2000
+
+Progress is printed as JSON lines, the same events as the POST /cuisine-crud/import-cuisines route. The exit status is 1
+when some rows were not imported and 2 when the user does not exist.
+"""
+import argparse
+import asyncio
+import sys
+
+import orjson
+
+from app.database import AsyncSessionLocal
+from app.models.cuisine_images import CuisineImages  # noqa: F401  (registers the relationship target of CuisineDetails)
+from app.models.users import Users
+from app.utils.bulk_import import DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, SUPPORTED_FORMATS, detect_format, read_records, import_cuisines
+
+
+async def import_cuisines_command(args):
+        file_format = detect_format(args.path, args.format)
+        async with AsyncSessionLocal() as db:
+                if await Users.get_user_by_ID(db, args.user_id) is None:
+                        print(f"User {args.user_id} not found", file=sys.stderr)
+                        return 2
+
+                event = {}
+                with open(args.path, "rb") as file:
+                        async for event in import_cuisines(db, args.user_id, read_records(file, file_format), args.chunk_size):
+                                print(orjson.dumps(event).decode(), flush=True)
+                return 0 if event.get("event") == "done" and not event.get("failed") else 1
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(prog="python -m app.cli", description="CuisineIQ command line tools")
+        commands = parser.add_subparsers(dest="command", required=True)
+
+        import_parser = commands.add_parser("import-cuisines", help="Add the cuisines of a CSV, JSONL or Parquet file for a user")
+        import_parser.add_argument("path", help="File with name, description, latitude and longitude columns")
+        import_parser.add_argument("--user-id", required=True, help="ID of the user the cuisines are added for")
+        import_parser.add_argument("--format", choices=SUPPORTED_FORMATS, help="Detected from the file extension by default")
+        import_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, choices=range(1, MAX_CHUNK_SIZE + 1), metavar=f"1-{MAX_CHUNK_SIZE}")
+        import_parser.set_defaults(handler=import_cuisines_command)
+
+        args = parser.parse_args(argv)
+        try:
+                return asyncio.run(args.handler(args))
+        except ValueError as error:
+                parser.error(str(error))
+
+
+if __name__ == "__main__":
+        sys.exit(main())
@@ -1,13 +1,88 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
         DATABASE_URL: str
+        # Derived from DATABASE_URL with an async driver (aiomysql, aiosqlite) when not set
+        ASYNC_DATABASE_URL: Optional[str] = None
+        # Optional read replica used by the GET routes
+        READ_DATABASE_URL: Optional[str] = None
+
+        # Connection pool
+        DB_POOL_SIZE: int = 10
+        DB_MAX_OVERFLOW: int = 20
+        DB_POOL_TIMEOUT: float = 30
+        DB_POOL_RECYCLE: int = 1800
+        DB_POOL_PRE_PING: bool = True
         S3_BUCKET: str
         AWS_ACCESS_KEY_ID: str
         AWS_SECRET_ACCESS_KEY: str
         SECRET_KEY: str
 
+        # Users validated from an access token are trusted for this long without another database lookup. A change to a user clears the
+        # cache of the worker that made it only, the other workers (and any worker after a change made outside the app) may accept the
+        # tokens of a deleted user this long
+        USER_CACHE_TTL_SECONDS: int = 60
+        USER_CACHE_MAX_SIZE: int = 100000
+
+        # S3 uploads
+        S3_UPLOAD_CONCURRENCY: int = 8
+        S3_MULTIPART_THRESHOLD_MB: int = 8
+        S3_MULTIPART_CHUNKSIZE_MB: int = 8
+        S3_PRESIGNED_EXPIRES_SECONDS: int = 900
+        S3_MAX_IMAGE_SIZE_MB: int = 10
+
+        # Image variants
+        IMAGE_PROCESSING_WORKERS: int = 2
+        IMAGE_THUMBNAIL_SIZE: int = 320
+        IMAGE_WEBP_MAX_SIZE: int = 1600
+        IMAGE_WEBP_QUALITY: int = 80
+
+        # QR codes of the OTP route, rendered on a bounded thread pool and cached per provisioning URI
+        QR_RENDER_WORKERS: int = 2
+        QR_CACHE_MAX_SIZE: int = 10000
+        QR_CACHE_TTL_SECONDS: int = 3600
+
+        # Tag generation model
+        TAG_MODEL_PATH: str = "app/utils/cuisine_generation.joblib"
+        TAG_MODEL_RELOAD_INTERVAL: float = 5.0
+        TAG_BATCH_MAX_SIZE: int = 64
+        TAG_BATCH_MAX_WAIT_MS: float = 5.0
+        TAG_CACHE_MAX_SIZE: int = 10000
+        TAG_CACHE_TTL_SECONDS: int = 3600
+
+        # Ranked search index, rows written by other workers are picked up at most this many seconds later. The segment files
+        # live next to the tag model unless SEARCH_INDEX_DIR is set. SEARCH_INDEX_MERGE_FACTOR segments of similar size are merged
+        # in the background, and the smallest ones also once there are more than SEARCH_INDEX_MAX_SEGMENTS
+        SEARCH_INDEX_SYNC_INTERVAL: float = 10.0
+        SEARCH_INDEX_DIR: Optional[str] = None
+        SEARCH_INDEX_MAX_SEGMENTS: int = 32
+        SEARCH_INDEX_MERGE_FACTOR: int = 8
+
+        # Cached responses of the cuisine read routes, without a shared cache backend other workers may serve a stale response this long
+        RESPONSE_CACHE_TTL_SECONDS: int = 30
+        RESPONSE_CACHE_MAX_SIZE: int = 10000
+
+        # Requests taking at least this many seconds are logged with their slowest statements, the log is off when not set
+        SLOW_REQUEST_LOG_SECONDS: Optional[float] = None
+        SLOW_REQUEST_LOG_STATEMENTS: int = 5
+
+        # Operator routes (/diagnostics/*, /metrics), called with "Authorization: Bearer ADMIN_TOKEN" (the authorization block of a Prometheus
+        # scrape config). They are not served at all when it is not set
+        ADMIN_TOKEN: Optional[str] = None
+
+        # Opt-in request profiler, requires the optional pyinstrument package. A request is profiled when it sends the X-Profile header with
+        # PROFILER_ADMIN_TOKEN, or at random for PROFILER_SAMPLE_RATE (0 to 1) of the requests. The middleware is not installed when neither is set
+        PROFILER_ADMIN_TOKEN: Optional[str] = None
+        PROFILER_SAMPLE_RATE: float = 0.0
+        PROFILER_INTERVAL_MS: float = 1.0
+        PROFILER_OUTPUT_DIR: str = "profiles"
+
+        # Shared cache between worker processes, e.g. redis://localhost:6379/0 (memory:// keeps it in process)
+        CACHE_BACKEND_URL: Optional[str] = None
+
         class Config:
                 env_file = ".env"
 
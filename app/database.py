@@ -1,24 +1,118 @@
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
+from app.utils.metrics import db_pool_wait_duration, instrument_engine
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-# create sqlalchemy engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# async drivers used in place of the sync ones when ASYNC_DATABASE_URL is not set explicitly
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def get_async_database_url(database_url):
+        url = make_url(database_url)
+        backend = url.get_backend_name()
+        if backend not in ASYNC_DRIVERS:
+                raise ValueError(f"No async driver known for database backend: {backend}")
+        return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def get_engine_options(database_url):
+        # pre-ping and recycle keep MySQL's wait_timeout from handing out dead connections
+        options = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+        if make_url(database_url).get_backend_name() != "sqlite":
+                # SQLite uses a single file or in-memory connection, sizing the pool does not apply to it
+                options.update(pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW, pool_timeout=settings.DB_POOL_TIMEOUT)
+        return options
+
+
+ASYNC_SQLALCHEMY_DATABASE_URL = settings.ASYNC_DATABASE_URL or get_async_database_url(SQLALCHEMY_DATABASE_URL)
+ASYNC_READ_DATABASE_URL = get_async_database_url(settings.READ_DATABASE_URL) if settings.READ_DATABASE_URL else None
+
+# create sqlalchemy engine, the sync engine is kept for Alembic migrations and scripts
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **get_engine_options(SQLALCHEMY_DATABASE_URL))
 
 # creating session local class, each instance of this session local class will be a database session in itself
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async engine and session class used by the API so database calls do not block the event loop
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **get_engine_options(ASYNC_SQLALCHEMY_DATABASE_URL))
+
+# objects are not expired on commit, lazy loading them again afterwards is not possible with an AsyncSession
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# read-only routes use the replica when READ_DATABASE_URL is set and the primary otherwise
+read_async_engine = create_async_engine(ASYNC_READ_DATABASE_URL, **get_engine_options(ASYNC_READ_DATABASE_URL)) if ASYNC_READ_DATABASE_URL else async_engine
+ReadAsyncSessionLocal = async_sessionmaker(bind=read_async_engine, autoflush=False, expire_on_commit=False) if ASYNC_READ_DATABASE_URL else AsyncSessionLocal
+
+# time spent waiting for a pooled connection, per engine
+pool_wait_histograms = {"primary": db_pool_wait_duration.labels("primary")}
+if ASYNC_READ_DATABASE_URL:
+        pool_wait_histograms["replica"] = db_pool_wait_duration.labels("replica")
+
+# every statement is timed and counted against the request that ran it
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "primary")
+if ASYNC_READ_DATABASE_URL:
+        instrument_engine(read_async_engine.sync_engine, "replica")
+
 # create a base class
 Base = declarative_base()
 
 
-def get_db():
+async def _checkout_connection(db, pool_name):
+        # Check the connection out up front so the time spent waiting on the pool can be measured
+        started = time.perf_counter()
+        await db.connection()
+        pool_wait_histograms[pool_name].observe(time.perf_counter() - started)
+
+
+async def get_db():
+        async with AsyncSessionLocal() as db:
+                await _checkout_connection(db, "primary")
+                yield db
+
+
+async def get_read_db():
+        async with ReadAsyncSessionLocal() as db:
+                await _checkout_connection(db, "replica" if ASYNC_READ_DATABASE_URL else "primary")
+                yield db
+
+
+async def get_lazy_read_db():
+        # Connects on first use only, so requests answered from the response cache never check out a connection
+        async with ReadAsyncSessionLocal() as db:
+                yield db
+
+
+def get_sync_db():
         db = SessionLocal()
         try:
                 yield db
         finally:
                 db.close()
+
+
+def get_pool_stats():
+        engines = {"primary": async_engine}
+        if ASYNC_READ_DATABASE_URL:
+                engines["replica"] = read_async_engine
+
+        stats = {}
+        for name, pool_engine in engines.items():
+                pool = pool_engine.pool
+                stats[name] = {
+                        "pool_class": type(pool).__name__,
+                        "size": pool.size() if hasattr(pool, "size") else None,
+                        "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+                        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+                        "wait_seconds": pool_wait_histograms[name].snapshot(),
+                }
+        return stats
@@ -1,13 +1,39 @@
+import logging
 import uuid
+from datetime import datetime
 
-from sqlalchemy import Column, String, DateTime
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, String, DateTime, Float, Index, select, or_, and_, insert
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import relationship, selectinload, load_only, lazyload, validates
 
 from app.database import Base
-from app.utils.helper_functions import get_current_time, generate_tags
+from app.models.cuisine_images import CuisineImages
+from app.utils.helper_functions import get_current_time, predict_prompt_tags
+from app.utils.geo import parse_coordinate, bounding_box, haversine_km, encode_geohash, geohash_cover, geohash_range, coordinate_columns
+from app.utils.pagination import keyset_paginate
+from app.utils.response_cache import response_cache
+from app.utils.search_index import cuisine_search_index, get_search_text
+from app.utils.text_search import cuisine_text_index
+
+logger = logging.getLogger(__name__)
 
 
 class CuisineDetails(Base):
         __tablename__ = "cuisine_details"
+        __table_args__ = (
+                # Equality filters on the predicted tags followed by the keyset order. The tag columns are prefixed on MySQL to stay under
+                # InnoDB's 3072 byte key limit, tag values are far shorter than the prefix
+                Index("ix_cuisine_details_tags", "cuisine", "budget", "ambience", "dietary_options", "created_at", "id",
+                      mysql_length={"cuisine": 64, "budget": 64, "ambience": 64, "dietary_options": 64}),
+                Index("ix_cuisine_details_user_id", "user_id", "created_at", "id"),
+                Index("ix_cuisine_details_created_at", "created_at", "id"),
+                # Proximity search: the cells around the search circle are ranges of this index, unlike (lat, lng) which is only a range on lat
+                Index("ix_cuisine_details_geohash", "geohash"),
+                # Full-text search over the name and description, the ngram parser also matches prefixes and near spellings
+                Index("ix_cuisine_details_fulltext", "name", "description", mysql_prefix="FULLTEXT", mysql_with_parser="ngram").ddl_if(dialect="mysql"),
+        )
 
         id = Column(String(36), primary_key=True, default=str(uuid.uuid4()), unique=True, nullable=False)
         user_id = Column(String(36), nullable=False)
@@ -15,21 +41,48 @@ class CuisineDetails(Base):
         description = Column(String(255), nullable=False)
         latitude = Column(String(255), nullable=False)
         longitude = Column(String(255), nullable=False)
+        # Numeric copies of latitude/longitude and their geohash kept in sync on write, used by the proximity search. The geohash is only
+        # compared with the bounds of geohash_range, which hold under the default collation of the database
+        lat = Column(Float, nullable=True)
+        lng = Column(Float, nullable=True)
+        geohash = Column(String(12), nullable=True)
         cuisine = Column(String(255), nullable=False)
         budget = Column(String(255), nullable=False)
         ambience = Column(String(255), nullable=False)
         dietary_options = Column(String(255), nullable=False)
-        created_at = Column(DateTime, default=get_current_time())
-        updated_at = Column(DateTime, default=get_current_time(), onupdate=get_current_time())
+        # Not null, the keyset pagination cursor is (created_at, id)
+        created_at = Column(DateTime, nullable=False, default=get_current_time)
+        updated_at = Column(DateTime, default=get_current_time, onupdate=get_current_time)
+
+        # Images are fetched for all the loaded cuisines in one extra SELECT ... WHERE cuisine_id IN (...) statement
+        images = relationship("CuisineImages", back_populates="cuisine", lazy="selectin", cascade="all, delete-orphan", order_by="CuisineImages.created_at")
 
         def __init__(self, *args, **kwargs):
                 super().__init__(*args, **kwargs)
                 self.id = self.id or str(uuid.uuid4())
 
+        @validates("latitude", "longitude")
+        def validate_coordinates(self, key, value):
+                if key == "latitude":
+                        self.lat = parse_coordinate(value, 90)
+                else:
+                        self.lng = parse_coordinate(value, 180)
+                self.geohash = encode_geohash(self.lat, self.lng) if self.lat is not None and self.lng is not None else None
+                return value
+
+        @classmethod
+        def _listing_query(cls, fields=None):
+                query = select(cls)
+                if fields is None:
+                        return query.options(selectinload(cls.images))
+
+                # Only load the requested columns, id and created_at are always needed for the pagination cursor
+                columns = {"id", "created_at", *(field for field in fields if field != "images")}
+                query = query.options(load_only(*(getattr(cls, column) for column in columns)))
+                return query.options(selectinload(cls.images) if "images" in fields else lazyload(cls.images))
+
         @classmethod
-        def get_all_cuisines(cls, db, prompt=None):
-                tags = generate_tags(prompt) if prompt else None
-                query = db.query(cls)
+        def _filter_by_tags(cls, query, tags):
                 if tags:
                         if 'cuisine' in tags:
                                 query = query.filter(cls.cuisine == tags['cuisine'])
@@ -39,37 +92,189 @@ class CuisineDetails(Base):
                                 query = query.filter(cls.ambience == tags['ambience'])
                         if 'dietary_options' in tags:
                                 query = query.filter(cls.dietary_options == tags['dietary_options'])
-                return query.all()
+                return query
+
+        @classmethod
+        async def get_all_cuisines(cls, db, prompt=None, tags=None, limit=None, cursor=None, fields=None):
+                if tags is None and prompt:
+                        tags = await predict_prompt_tags(prompt)
+                query = cls._filter_by_tags(cls._listing_query(fields), tags)
+                if limit is not None:
+                        query = keyset_paginate(query, cls, limit, cursor)
+                result = await db.execute(query)
+                return result.scalars().all()
+
+        @classmethod
+        def geohash_filter(cls, cells):
+                # One range of the geohash index per cell, bounded by the next cell so the ranges hold under any collation
+                ranges = []
+                for cell in cells:
+                        low, high = geohash_range(cell)
+                        ranges.append(and_(cls.geohash >= low, cls.geohash < high) if high else cls.geohash >= low)
+                return or_(*ranges)
+
+        @classmethod
+        async def get_cuisines_near(cls, db, lat, lng, radius_km, tags=None, limit=50, fields=None):
+                # Step 1: Fetch only the id and coordinates of the cuisines inside the bounding box of the search circle. The geohash cells
+                # covering the box are read as ranges of the geohash index
+                (min_lat, max_lat), lng_ranges = bounding_box(lat, lng, radius_km)
+                query = select(cls.id, cls.lat, cls.lng).filter(cls.lat.between(min_lat, max_lat), or_(*(cls.lng.between(min_lng, max_lng) for min_lng, max_lng in lng_ranges)))
+                cells = geohash_cover((min_lat, max_lat), lng_ranges)
+                if cells:
+                        query = query.filter(cls.geohash_filter(cells))
+                rows = (await db.execute(cls._filter_by_tags(query, tags))).all()
+                if not rows:
+                        return []
+
+                # Step 2: Compute all the distances at once and keep the nearest cuisines inside the radius
+                ids, lats, lngs = zip(*rows)
+                distances = haversine_km(lat, lng, lats, lngs)
+                within = np.flatnonzero(distances <= radius_km)
+                if len(within) > limit:
+                        within = within[np.argpartition(distances[within], limit)[:limit]]
+                nearest = within[np.argsort(distances[within], kind="stable")]
+
+                # Step 3: Load the nearest cuisines and return them ordered by distance
+                result = await db.execute(cls._listing_query(fields).filter(cls.id.in_([ids[index] for index in nearest])))
+                cuisines = {cuisine.id: cuisine for cuisine in result.scalars().all()}
+                return [(cuisines[ids[index]], float(distances[index])) for index in nearest if ids[index] in cuisines]
+
+        @classmethod
+        async def search_cuisines(cls, db, prompt, tags=None, limit=50, fields=None):
+                # Step 1: Make sure the search index is built and has the rows written by other workers
+                await cuisine_search_index.ensure_ready(db, cls)
+
+                # Step 2: Restrict the search to the cuisines matching the tag filters, the ids come straight from the tag index
+                candidate_ids = None
+                if tags:
+                        candidate_ids = (await db.execute(cls._filter_by_tags(select(cls.id), tags))).scalars().all()
+
+                # Step 3: Rank by cosine similarity between the prompt and the name + description of the cuisines
+                matches = await run_in_threadpool(cuisine_search_index.search, prompt, limit, candidate_ids)
+                if not matches:
+                        return []
+
+                # Step 4: Load the best matches and return them ordered by score, cuisines deleted in the meantime are skipped
+                result = await db.execute(cls._listing_query(fields).filter(cls.id.in_([cuisine_id for cuisine_id, _ in matches])))
+                cuisines = {cuisine.id: cuisine for cuisine in result.scalars().all()}
+                return [(cuisines[cuisine_id], score) for cuisine_id, score in matches if cuisine_id in cuisines]
+
+        @classmethod
+        async def search_by_text(cls, db, q, tags=None, limit=50, fields=None):
+                # MySQL: natural language match on the FULLTEXT ngram index, along with the tag filters
+                if db.bind.dialect.name == "mysql":
+                        relevance = match(cls.name, cls.description, against=q).in_natural_language_mode()
+                        query = cls._filter_by_tags(cls._listing_query(fields), tags).add_columns(relevance).filter(relevance > 0)
+                        result = await db.execute(query.order_by(relevance.desc()).limit(limit))
+                        return [(cuisine, float(score)) for cuisine, score in result.all()]
+
+                # Step 1: Other databases use the in-process inverted index, make sure it is built and has the rows written by other workers
+                await cuisine_text_index.ensure_ready(db, cls)
+
+                # Step 2: Restrict the search to the cuisines matching the tag filters
+                candidate_ids = None
+                if tags:
+                        candidate_ids = (await db.execute(cls._filter_by_tags(select(cls.id), tags))).scalars().all()
+
+                # Step 3: Load the best matches and return them ordered by score, cuisines deleted in the meantime are skipped
+                matches = await run_in_threadpool(cuisine_text_index.search, q, limit, candidate_ids)
+                if not matches:
+                        return []
+                result = await db.execute(cls._listing_query(fields).filter(cls.id.in_([cuisine_id for cuisine_id, _ in matches])))
+                cuisines = {cuisine.id: cuisine for cuisine in result.scalars().all()}
+                return [(cuisines[cuisine_id], score) for cuisine_id, score in matches if cuisine_id in cuisines]
+
+        @classmethod
+        async def stream_catalog(cls, db, columns, batch_size=1000):
+                # Yields every cuisine as a dict of the given columns plus the URLs of its images, in lists of at most batch_size cuisines. The rows of
+                # the LEFT JOIN come from a server side cursor in primary key order, so the rows of one cuisine are consecutive and are merged here
+                query = select(*(getattr(cls, column) for column in columns), CuisineImages.image_url, CuisineImages.created_at.label("image_created_at"))
+                query = query.outerjoin(CuisineImages, CuisineImages.cuisine_id == cls.id).order_by(cls.id)
+                result = await db.stream(query.execution_options(yield_per=batch_size))
+
+                batch, current, images = [], None, []
+                async for row in result:
+                        if current is None or row.id != current["id"]:
+                                if current is not None:
+                                        # Images are ordered here rather than in SQL so the database can walk the primary key without sorting the join
+                                        current["images"] = [image_url for _, image_url in sorted(images, key=lambda image: image[0] or datetime.min)]
+                                        batch.append(current)
+                                        if len(batch) >= batch_size:
+                                                yield batch
+                                                batch = []
+                                current, images = {column: getattr(row, column) for column in columns}, []
+                        if row.image_url is not None:
+                                images.append((row.image_created_at, row.image_url))
+                if current is not None:
+                        current["images"] = [image_url for _, image_url in sorted(images, key=lambda image: image[0] or datetime.min)]
+                        batch.append(current)
+                if batch:
+                        yield batch
 
         @classmethod
-        def get_cuisine_by_ID(cls, db, cuisine_id):
-                return db.query(cls).filter(cls.id == cuisine_id).first()
+        async def get_cuisine_by_ID(cls, db, cuisine_id):
+                result = await db.execute(select(cls).options(selectinload(cls.images)).filter(cls.id == cuisine_id))
+                return result.scalars().first()
 
         @classmethod
-        def get_cuisine_by_user_ID(cls, db, user_id):
-                return db.query(cls).filter(cls.user_id == user_id).all()
+        async def get_cuisine_by_user_ID(cls, db, user_id, limit=None, cursor=None, fields=None):
+                query = cls._listing_query(fields).filter(cls.user_id == user_id)
+                if limit is not None:
+                        query = keyset_paginate(query, cls, limit, cursor)
+                result = await db.execute(query)
+                return result.scalars().all()
 
         @classmethod
-        def create_cuisine(cls, db, user_id, **kwargs):
-                cuisine = cls(user_id=user_id, **kwargs)
+        async def create_cuisine(cls, db, user_id, **kwargs):
+                cuisine = cls(user_id=user_id, images=[], **kwargs)
                 db.add(cuisine)
-                db.commit()
-                db.refresh(cuisine)
+                await db.commit()
+                await db.refresh(cuisine)
+                await run_in_threadpool(cuisine_search_index.upsert, cuisine.id, get_search_text(cuisine.name, cuisine.description))
+                cuisine_text_index.upsert(cuisine.id, cuisine.name, cuisine.description)
+                await response_cache.invalidate()
                 return cuisine
 
         @classmethod
-        def update_cuisine(cls, db, **kwargs):
-                cuisine_to_update = db.query(cls).filter(cls.id == kwargs['id']).first()
+        async def bulk_create_cuisines(cls, db, user_id, cuisines):
+                # cuisines: list of dicts of column values, written with one multi-row INSERT in a single transaction. Bulk inserts skip the
+                # ORM validators and column defaults, so the id, numeric coordinates, geohash and timestamps are filled in here
+                now = get_current_time()
+                rows = [{**cuisine, "id": str(uuid.uuid4()), "user_id": user_id, **coordinate_columns(cuisine["latitude"], cuisine["longitude"]),
+                         "created_at": now, "updated_at": now} for cuisine in cuisines]
+                await db.execute(insert(cls), rows)
+                await db.commit()
+
+                # The rows are committed at this point, a failure below must not be reported as a failed insert. The search indexes pick the rows
+                # up on their next sync (by updated_at) and cached responses expire after RESPONSE_CACHE_TTL_SECONDS
+                try:
+                        search_rows = [(row["id"], get_search_text(row["name"], row["description"])) for row in rows]
+                        await run_in_threadpool(cuisine_search_index.upsert_many, search_rows)
+                        await run_in_threadpool(cuisine_text_index.upsert_many, [(row["id"], row["name"], row["description"]) for row in rows])
+                        await response_cache.invalidate()
+                except Exception:
+                        logger.exception("Indexing %d imported cuisines failed, they are picked up by the next index sync", len(rows))
+                return [row["id"] for row in rows]
+
+        @classmethod
+        async def update_cuisine(cls, db, **kwargs):
+                cuisine_to_update = await cls.get_cuisine_by_ID(db, kwargs['id'])
                 for key, value in kwargs.items():
                         if value is not None:
                                 setattr(cuisine_to_update, key, value)
-                db.commit()
-                db.refresh(cuisine_to_update)
+                await db.commit()
+                await db.refresh(cuisine_to_update)
+                await run_in_threadpool(cuisine_search_index.upsert, cuisine_to_update.id, get_search_text(cuisine_to_update.name, cuisine_to_update.description))
+                cuisine_text_index.upsert(cuisine_to_update.id, cuisine_to_update.name, cuisine_to_update.description)
+                await response_cache.invalidate()
                 return cuisine_to_update
 
         @classmethod
-        def delete_cuisine(cls, db, cuisine_id):
-                cuisine_to_delete = db.query(cls).filter(cls.id == cuisine_id).first()
-                db.delete(cuisine_to_delete)
-                db.commit()
+        async def delete_cuisine(cls, db, cuisine_id):
+                cuisine_to_delete = await cls.get_cuisine_by_ID(db, cuisine_id)
+                await db.delete(cuisine_to_delete)
+                await db.commit()
+                await run_in_threadpool(cuisine_search_index.remove, cuisine_id)
+                cuisine_text_index.remove(cuisine_id)
+                await response_cache.invalidate()
                 return True
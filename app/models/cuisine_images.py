@@ -1,43 +1,93 @@
 import uuid
 
-from sqlalchemy import Column, String, ForeignKey, DateTime
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, String, ForeignKey, DateTime, select, func
+from sqlalchemy.orm import relationship
 
 from app.database import Base
-from app.utils.helper_functions import get_current_time
+from app.utils.helper_functions import get_current_time, delete_files_from_s3, delete_file_from_s3, get_s3_object_key
+from app.utils.response_cache import response_cache
 
 
 class CuisineImages(Base):
         __tablename__ = "cuisine_images"
 
         id = Column(String(36), primary_key=True, default=str(uuid.uuid4()), unique=True, nullable=False)
-        cuisine_id = Column(String(36), ForeignKey('cuisine_details.id', onupdate='CASCADE'), nullable=False)
+        cuisine_id = Column(String(36), ForeignKey('cuisine_details.id', onupdate='CASCADE'), nullable=False, index=True)
         image_url = Column(String(255), nullable=False)
-        created_at = Column(DateTime, default=get_current_time())
-        updated_at = Column(DateTime, default=get_current_time(), onupdate=get_current_time())
+        # sha256 of the original upload, identical uploads share the same S3 objects
+        content_hash = Column(String(64), nullable=True, index=True)
+        thumbnail_url = Column(String(255), nullable=True)
+        webp_url = Column(String(255), nullable=True)
+        created_at = Column(DateTime, default=get_current_time)
+        updated_at = Column(DateTime, default=get_current_time, onupdate=get_current_time)
+
+        cuisine = relationship("CuisineDetails", back_populates="images", lazy="raise")
 
         def __init__(self, *args, **kwargs):
                 super().__init__(*args, **kwargs)
                 self.id = self.id or str(uuid.uuid4())
 
         @classmethod
-        def get_cuisine_images(cls, db, cuisine_id):
-                return db.query(cls).filter(cls.cuisine_id == cuisine_id).all()
+        async def get_cuisine_images(cls, db, cuisine_id):
+                result = await db.execute(select(cls).filter(cls.cuisine_id == cuisine_id))
+                return result.scalars().all()
+
+        @classmethod
+        async def get_cuisine_image_by_ID(cls, db, image_id):
+                result = await db.execute(select(cls).filter(cls.id == image_id))
+                return result.scalars().first()
+
+        @classmethod
+        async def count_images_by_content_hash(cls, db, content_hash):
+                result = await db.execute(select(func.count(cls.id)).filter(cls.content_hash == content_hash))
+                return result.scalar_one()
 
         @classmethod
-        def get_cuisine_image_by_ID(cls, db, image_id):
-                return db.query(cls).filter(cls.id == image_id).first()
+        async def lock_content(cls, db, content_hash):
+                # Locks the images of a content until the transaction ends. On MySQL (REPEATABLE READ) the lock also covers the gap of the
+                # content_hash index, an insert of the same content waits, SQLite serialises the writing transactions anyway
+                await db.execute(select(cls.id).filter(cls.content_hash == content_hash).with_for_update())
 
         @classmethod
-        def add_cuisine_images(cls, db, cuisine_id, image_url):
-                cuisine_image = cls(cuisine_id=cuisine_id, image_url=image_url)
+        async def delete_unreferenced_uploads(cls, db, uploaded_keys, bucket):
+                # uploaded_keys: {content_hash: object keys} written by a request whose images could not be saved. Objects of a content that
+                # an image refers to by now, uploaded again by a concurrent request, are kept
+                for content_hash, keys in uploaded_keys.items():
+                        await cls.lock_content(db, content_hash)
+                        if await cls.count_images_by_content_hash(db, content_hash) == 0:
+                                await delete_files_from_s3(keys, bucket)
+                        await db.commit()
+
+        @classmethod
+        async def add_cuisine_images(cls, db, cuisine_id, image_url, **variants):
+                cuisine_image = cls(cuisine_id=cuisine_id, image_url=image_url, **variants)
                 db.add(cuisine_image)
-                db.commit()
-                db.refresh(cuisine_image)
+                await db.commit()
+                await db.refresh(cuisine_image)
+                await response_cache.invalidate()
                 return cuisine_image
 
         @classmethod
-        def delete_image(cls, db, image_id):
-                cuisine_image = cls.get_cuisine_image_by_ID(db, image_id)
-                db.delete(cuisine_image)
-                db.commit()
+        async def add_cuisine_images_bulk(cls, db, cuisine_id, images):
+                cuisine_images = [cls(cuisine_id=cuisine_id, **image) for image in images]
+                db.add_all(cuisine_images)
+                await db.commit()
+                await response_cache.invalidate()
+                return cuisine_images
+
+        @classmethod
+        async def delete_image(cls, db, image_id, bucket):
+                # The objects are deleted inside the transaction, with the images of the content locked, unless other images share the content.
+                # An upload that reused them waits for the commit to insert its row and then stores them again (StoredImages.restore_reused)
+                cuisine_image = await cls.get_cuisine_image_by_ID(db, image_id)
+                if cuisine_image.content_hash:
+                        await cls.lock_content(db, cuisine_image.content_hash)
+                await db.delete(cuisine_image)
+                await db.flush()
+                if not cuisine_image.content_hash or await cls.count_images_by_content_hash(db, cuisine_image.content_hash) == 0:
+                        for image_url in filter(None, (cuisine_image.image_url, cuisine_image.thumbnail_url, cuisine_image.webp_url)):
+                                await run_in_threadpool(delete_file_from_s3, get_s3_object_key(image_url), bucket)
+                await db.commit()
+                await response_cache.invalidate()
                 return True
@@ -2,19 +2,23 @@ import uuid
 from datetime import datetime, timedelta
 
 import jwt
-from sqlalchemy import Column, String, DateTime
+from sqlalchemy import Column, String, DateTime, select, event
 
 from app.config import settings
 from app.database import Base
+from app.utils.cache import TTLCache
 from app.utils.helper_functions import get_current_time
 
+# IDs of users known to exist, so validating a token does not need a primary key lookup on every request
+validated_user_cache = TTLCache(max_size=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
 
 class Users(Base):
         __tablename__ = "users"
 
         id = Column(String(36), primary_key=True, default=str(uuid.uuid4()), unique=True, nullable=False)
         name = Column(String(255), nullable=False)
-        phone_number = Column(String(15), nullable=False)
+        phone_number = Column(String(15), nullable=False, unique=True, index=True)
         email = Column(String(255), nullable=True)
         otp_secret = Column(String(255), nullable=False)
         created_at = Column(DateTime, nullable=False, default=get_current_time)
@@ -25,25 +29,48 @@ class Users(Base):
                 self.id = self.id or str(uuid.uuid4())
 
         @classmethod
-        def get_user_by_phone_number(cls, db, phone_number):
-                return db.query(cls).filter(cls.phone_number == phone_number).first()
+        async def get_user_by_phone_number(cls, db, phone_number):
+                result = await db.execute(select(cls).filter(cls.phone_number == phone_number))
+                return result.scalars().first()
+
+        @classmethod
+        async def get_user_by_ID(cls, db, user_id):
+                result = await db.execute(select(cls).filter(cls.id == user_id))
+                return result.scalars().first()
 
         @classmethod
-        def get_user_by_ID(cls, db, user_id):
-                return db.query(cls).filter(cls.id == user_id).first()
+        async def user_exists(cls, db, user_id):
+                if validated_user_cache.get(user_id):
+                        return True
+                user = await cls.get_user_by_ID(db, user_id)
+                if user is None:
+                        return False
+                validated_user_cache.set(user_id, True)
+                return True
 
         @classmethod
-        def create_user(cls, db, **kwargs):
+        def invalidate_cached_user(cls, user_id):
+                validated_user_cache.delete(user_id)
+
+        @classmethod
+        async def create_user(cls, db, **kwargs):
                 user = cls(**kwargs)
                 db.add(user)
-                db.commit()
-                db.refresh(user)
+                await db.commit()
+                await db.refresh(user)
                 return user
 
         @classmethod
-        def generate_access_token(cls, db, phone_number):
-                user = cls.get_user_by_phone_number(db, phone_number)
+        async def generate_access_token(cls, db, phone_number):
+                user = await cls.get_user_by_phone_number(db, phone_number)
                 access_token_expires = datetime.utcnow() + timedelta(minutes=60)
                 access_token_payload = {"user_id": user.id, "name": user.name, "email": user.email, "exp": access_token_expires}
                 access_token = jwt.encode(access_token_payload, settings.SECRET_KEY, algorithm="HS256")
                 return access_token
+
+
+@event.listens_for(Users, "after_update")
+@event.listens_for(Users, "after_delete")
+def invalidate_cached_user(mapper, connection, user):
+        # Any change to a user forces the next request with their token to check the database again
+        Users.invalidate_cached_user(user.id)
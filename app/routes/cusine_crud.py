@@ -1,94 +1,213 @@
+import asyncio
+import shutil
+import tempfile
+import uuid
 from typing import List
 
-from fastapi import HTTPException, Depends, status, APIRouter, UploadFile, File, Query
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import HTTPException, Depends, status, APIRouter, UploadFile, File, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.database import get_db
+from app.database import AsyncSessionLocal, ReadAsyncSessionLocal, get_db, get_read_db, get_lazy_read_db
 from app.models.cuisine_details import CuisineDetails
 from app.models.cuisine_images import CuisineImages
-from app.schemas.cuisine_details import CuisineBase, CuisineUpdate
+from app.schemas.cuisine_details import CuisineBase, CuisineUpdate, CuisineListOut, CuisineDetailOut, CuisineUpdateOut
+from app.schemas.cuisine_images import ImageUploadRequest, ImageUploadConfirm
 from app.schemas.users import User
 from app.utils.dependencies import validate_token
-from app.utils.helper_functions import validate_image_type, upload_file_to_s3, generate_tags, delete_file_from_s3
+from app.utils.helper_functions import validate_image_type, upload_images_to_s3, predict_tags, predict_prompt_tags, delete_file_from_s3, serialize_cuisine, CUISINE_FIELDS, \
+        ALLOWED_IMAGE_CONTENT_TYPES, generate_presigned_upload, get_s3_object_metadata, validate_s3_image_type, get_s3_object_url
+from app.utils.bulk_import import DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, detect_format, read_records, import_cuisines
+from app.utils.export import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_FORMATS, encode_export
+from app.utils.geo import MAX_RADIUS_KM, parse_near
+from app.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, build_page, parse_fields
+from app.utils.response_cache import response_cache
 
 router = APIRouter()
 
 
-@router.get("/my-cuisines", status_code=status.HTTP_200_OK)
-async def get_my_cuisines(db: Session = Depends(get_db), current_user: User = Depends(validate_token)):
+@router.get("/my-cuisines", status_code=status.HTTP_200_OK, response_model=CuisineListOut, response_model_exclude_unset=True)
+async def get_my_cuisines(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: str = Query(None), fields: str = Query(None), db: AsyncSession = Depends(get_read_db),
+                          current_user: User = Depends(validate_token)):
         """
-        This route is used to get all the cuisines added by the user. It takes the user ID from the token and returns a list of all the cuisines added by the user.
+        This route is used to get the cuisines added by the user, newest first. It takes the user ID from the token and returns one page of the cuisines added by the user.
 
+        :param limit:  Maximum number of cuisines in the page. \n
+        :param cursor:  Opaque cursor returned as next_cursor by the previous page. \n
+        :param fields:  Comma separated list of fields to return, e.g. id,name,images. All fields are returned by default. \n
         :param db:  Database session. \n
         :param current_user:  User details extracted from the token. \n
 
-        :return:  List of all the cuisines added by the user. \n
+        :return:  Page of the cuisines added by the user along with the cursor of the next page (null on the last page). \n
+
+        :raises HTTPException 400:  Invalid cursor or unknown field. \n
+        :raises HTTPException 500:  Internal Server Error. \n
         """
         try:
-                # Step 1: Get the user ID from the token
+                # Step 1: Get the user ID from the token and the requested fields
                 user_id = current_user.get('user_id')
+                selected_fields = parse_fields(fields, CUISINE_FIELDS)
 
-                # Step 2: Get all the cuisines added by the user
-                cuisines = CuisineDetails.get_cuisine_by_user_ID(db, user_id)
-                cuisines_arr = [{**cuisine.__dict__, "images": [image.image_url for image in CuisineImages.get_cuisine_images(db, cuisine.id)]} for cuisine in cuisines]
+                # Step 2: Get one page of the cuisines added by the user
+                cuisines = await CuisineDetails.get_cuisine_by_user_ID(db, user_id, limit=limit, cursor=cursor, fields=selected_fields)
+                cuisines, next_cursor = build_page(cuisines, limit)
+                cuisines_arr = [serialize_cuisine(cuisine, selected_fields, thumbnails=True) for cuisine in cuisines]
 
                 # Step 3: Return the response
-                return {"message": "Cuisines fetched successfully", "cuisines": cuisines_arr}
+                return {"message": "Cuisines fetched successfully", "cuisines": cuisines_arr, "next_cursor": next_cursor}
 
         # Step 4: Handle exceptions
+        except HTTPException as error:
+                raise error
+
+        except Exception as error:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
+
+
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_cuisines(file_format: str = Query("ndjson", alias="format", pattern="^(ndjson|arrow|parquet)$")):
+        """
+        This route is used to download the whole cuisine catalog, with the image URLs of every cuisine, for analytics. Rows are read from a server side cursor and
+        written to the response batch by batch, so memory use does not grow with the size of the catalog.
+
+        :param file_format:  ndjson (default, one cuisine per line), arrow (Arrow IPC stream) or parquet. \n
+
+        :return:  Stream of the cuisines in the requested format. \n
+
+        :raises HTTPException 500:  Internal Server Error. \n
+        """
+        try:
+                # Step 1: Stream the catalog. Request scoped dependencies are closed before a streaming response is sent, so the stream opens its own session
+                async def stream_catalog():
+                        async with ReadAsyncSessionLocal() as db:
+                                async for chunk in encode_export(CuisineDetails.stream_catalog(db, EXPORT_COLUMNS, EXPORT_BATCH_SIZE), file_format):
+                                        yield chunk
+
+                # Step 2: Return the response
+                media_type, extension = EXPORT_FORMATS[file_format]
+                return StreamingResponse(stream_catalog(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="cuisines.{extension}"'})
+
+        # Step 3: Handle exceptions
+        except HTTPException as error:
+                raise error
+
         except Exception as error:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
 
 
-@router.get("/", status_code=status.HTTP_200_OK)
-async def get_cuisines(prompt: str = Query(None), db: Session = Depends(get_db)):
+@router.get("/", status_code=status.HTTP_200_OK, response_model=CuisineListOut, response_model_exclude_unset=True)
+async def get_cuisines(request: Request, prompt: str = Query(None), q: str = Query(None, min_length=1, max_length=255), mode: str = Query("tags", pattern="^(tags|ranked)$"), filter_tags: bool = Query(False), near: str = Query(None), radius_km: float = Query(5, gt=0, le=MAX_RADIUS_KM), limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       cursor: str = Query(None), fields: str = Query(None), db: AsyncSession = Depends(get_lazy_read_db)):
         """
-        This route is used to get all the cuisines from the database. It returns a list of all the cuisines.
+        This route is used to get the cuisines from the database, newest first. It returns one page of the cuisines, optionally filtered by the tags predicted from the prompt.
+        When near is given, the cuisines within radius_km of that point are returned instead, nearest first with their distance_km, and there is no next page.
+        With mode=ranked, the cuisines whose name and description are most similar to the prompt are returned instead, best first with their score, and there is no next page.
+        When q is given, the cuisines whose name or description match q, also by prefix or with typos, are returned instead, best first with their score, and there is no next page.
+        Responses are cached until a cuisine or image changes and carry an ETag, a request whose If-None-Match matches it gets a 304 Not Modified.
 
+        :param request:  Incoming request, its path and query parameters are the cache key. \n
         :param prompt:  Prompt to search for a cuisine. \n
+        :param q:  Text to search in the name and description of the cuisines, combined with the tags predicted from the prompt. \n
+        :param mode:  tags (default) filters on the tags predicted from the prompt, ranked orders the cuisines by similarity to the prompt. \n
+        :param filter_tags:  In ranked mode, only rank the cuisines matching the tags predicted from the prompt. \n
+        :param near:  Point to search around, formatted as lat,lng. \n
+        :param radius_km:  Search radius around near, in kilometres. \n
+        :param limit:  Maximum number of cuisines in the page. \n
+        :param cursor:  Opaque cursor returned as next_cursor by the previous page. \n
+        :param fields:  Comma separated list of fields to return, e.g. id,name,images. All fields are returned by default. \n
         :param db:  Database session. \n
 
-        :return:  List of all the cuisines. \n
+        :return:  Page of the cuisines along with the cursor of the next page (null on the last page), or 304 Not Modified. \n
+
+        :raises HTTPException 400:  Invalid cursor, point or unknown field, ranked mode without a prompt, or q combined with ranked mode, near or cursor. \n
+        :raises HTTPException 500:  Internal Server Error. \n
         """
         try:
-                # Step 1: Get all the cuisines from the database
-                cuisines = CuisineDetails.get_all_cuisines(db, prompt)
+                # Step 0: Serve the response from the cache when nothing changed since it was built, without touching the database
+                cache_key = await response_cache.key(request)
+                cached = await response_cache.get(cache_key)
+                if cached is not None:
+                        return response_cache.respond(request, cached)
+
+                # Step 1: Generate tags from the prompt
+                selected_fields = parse_fields(fields, CUISINE_FIELDS)
+                tags = await predict_prompt_tags(prompt) if prompt and (mode == "tags" or filter_tags) else None
+
+                # Step 1.1: Rank the cuisines by similarity to the prompt, optionally restricted to the predicted tags
+                if mode == "ranked":
+                        if not prompt or q is not None or near is not None or cursor:
+                                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ranked mode requires a prompt and cannot be combined with q, near or cursor")
+                        cuisines = await CuisineDetails.search_cuisines(db, prompt, tags=tags, limit=limit, fields=selected_fields)
+                        cuisines_arr = [{**serialize_cuisine(cuisine, selected_fields, thumbnails=True), "score": round(score, 4)} for cuisine, score in cuisines]
+                        return await response_cache.store(request, cache_key, CuisineListOut(message="Cuisines fetched successfully", cuisines=cuisines_arr, next_cursor=None))
+
+                # Step 1.2: Search the text in the name and description of the cuisines matching the predicted tags
+                if q is not None:
+                        if near is not None or cursor:
+                                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="q cannot be combined with near or cursor")
+                        cuisines = await CuisineDetails.search_by_text(db, q, tags=tags, limit=limit, fields=selected_fields)
+                        cuisines_arr = [{**serialize_cuisine(cuisine, selected_fields, thumbnails=True), "score": round(score, 4)} for cuisine, score in cuisines]
+                        return await response_cache.store(request, cache_key, CuisineListOut(message="Cuisines fetched successfully", cuisines=cuisines_arr, next_cursor=None))
+
+                # Step 2: Get the matching cuisines around the given point sorted by distance
+                if near is not None:
+                        if cursor:
+                                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cursor cannot be combined with near")
+                        lat, lng = parse_near(near)
+                        cuisines = await CuisineDetails.get_cuisines_near(db, lat, lng, radius_km, tags=tags, limit=limit, fields=selected_fields)
+                        cuisines_arr = [{**serialize_cuisine(cuisine, selected_fields, thumbnails=True), "distance_km": round(distance, 3)} for cuisine, distance in cuisines]
+                        return await response_cache.store(request, cache_key, CuisineListOut(message="Cuisines fetched successfully", cuisines=cuisines_arr, next_cursor=None))
+
+                # Step 3: Otherwise get one page of the matching cuisines from the database, the images are eager loaded along with the cuisines
+                cuisines = await CuisineDetails.get_all_cuisines(db, prompt, tags=tags, limit=limit, cursor=cursor, fields=selected_fields)
+                cuisines, next_cursor = build_page(cuisines, limit)
+                cuisines_arr = [serialize_cuisine(cuisine, selected_fields, thumbnails=True) for cuisine in cuisines]
+
+                # Step 4: Cache and return the response
+                return await response_cache.store(request, cache_key, CuisineListOut(message="Cuisines fetched successfully", cuisines=cuisines_arr, next_cursor=next_cursor))
 
-                # Step 2: Fetch all the images of the cuisines
-                cuisines_arr = [{**cuisine.__dict__, "images": [image.image_url for image in CuisineImages.get_cuisine_images(db, cuisine.id)]} for cuisine in cuisines]
-
-                # Step 3: Return the response
-                return {"message": "Cuisines fetched successfully", "cuisines": cuisines_arr}
+        # Step 5: Handle exceptions
+        except HTTPException as error:
+                raise error
 
-        # Step 4: Handle exceptions
         except Exception as error:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
 
 
-@router.get("/{cuisine_id}", status_code=status.HTTP_200_OK)
-async def get_cuisine_by_ID(cuisine_id: str, db: Session = Depends(get_db)):
+@router.get("/{cuisine_id}", status_code=status.HTTP_200_OK, response_model=CuisineDetailOut, response_model_exclude_unset=True)
+async def get_cuisine_by_ID(cuisine_id: str, request: Request, db: AsyncSession = Depends(get_lazy_read_db)):
         """
         This route is used to get the details of a cuisine. It takes the cuisine ID as input and returns the details of the cuisine.
+        Responses are cached until a cuisine or image changes and carry an ETag, a request whose If-None-Match matches it gets a 304 Not Modified.
 
         :param cuisine_id:  ID of the cuisine meant to be fetched. \n
+        :param request:  Incoming request, its path is the cache key. \n
         :param db:  Database session. \n
 
-        :return:  Details of the cuisine. \n
+        :return:  Details of the cuisine, or 304 Not Modified. \n
 
         :raises HTTPException 404:  Cuisine is not found. \n
         :raises HTTPException 500:  Internal Server Error. \n
         """
         try:
+                # Step 0: Serve the response from the cache when nothing changed since it was built, without touching the database
+                cache_key = await response_cache.key(request)
+                cached = await response_cache.get(cache_key)
+                if cached is not None:
+                        return response_cache.respond(request, cached)
+
                 # Step 1: Get the cuisine details from the database
-                cuisine = CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
 
                 # Step 2: Check if the cuisine exists if no raises an HTTPException with status code 404 Not Found
                 if cuisine is None:
                         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cuisine not found")
 
-                # Step 3: Return the response
-                return {"message": "Cuisine fetched successfully", "cuisine": {**cuisine.__dict__, "images": [image.image_url for image in CuisineImages.get_cuisine_images(db, cuisine.id)]}}
+                # Step 3: Cache and return the response
+                return await response_cache.store(request, cache_key, CuisineDetailOut(message="Cuisine fetched successfully", cuisine=serialize_cuisine(cuisine)))
 
         # Step 4: Handle exceptions
         except HTTPException as error:
@@ -99,7 +218,7 @@ async def get_cuisine_by_ID(cuisine_id: str, db: Session = Depends(get_db)):
 
 
 @router.post("/add-cuisine", status_code=status.HTTP_201_CREATED)
-async def add_cuisine(cuisine_details: CuisineBase, images: List[UploadFile] = File(...), db: Session = Depends(get_db), current_user: User = Depends(validate_token)):
+async def add_cuisine(cuisine_details: CuisineBase, images: List[UploadFile] = File(...), db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
         """
          This route is used to add a new cuisine to the database. It takes the cuisine details and images as input and returns a success message.
 
@@ -117,20 +236,78 @@ async def add_cuisine(cuisine_details: CuisineBase, images: List[UploadFile] = F
                 # Step 1: Get the user ID from the token
                 user_id = current_user.get('user_id')
 
-                # Step 2: Generate tags from the description of the cuisine and create a new cuisine
-                cuisine_tags = generate_tags(cuisine_details.description)
-                cuisine = CuisineDetails.create_cuisine(db, user_id, **cuisine_details.model_dump(), **cuisine_tags)
-
-                # Step 3: Upload the images to S3 and add the image URLs to the database
+                # Step 2: Validate all the images before anything is created or uploaded
                 for image in images:
                         if not validate_image_type(image.file):
                                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image type")
-                        image_url = upload_file_to_s3(image, settings.S3_BUCKET)
-                        CuisineImages.add_cuisine_images(db, cuisine.id, image_url)
 
-                # Step 4: Return the response
+                # Step 3: Generate tags from the description of the cuisine while all the images and their variants are uploaded to S3 concurrently
+                cuisine_tags, stored_images = await asyncio.gather(predict_tags(cuisine_details.description), upload_images_to_s3(images, settings.S3_BUCKET))
+
+                # Step 4: Create the new cuisine and add all the images to the database in one insert. When that fails the objects this request
+                # uploaded are removed again, the ones reused from earlier uploads belong to other images
+                try:
+                        cuisine = await CuisineDetails.create_cuisine(db, user_id, **cuisine_details.model_dump(), **cuisine_tags)
+                        await CuisineImages.add_cuisine_images_bulk(db, cuisine.id, stored_images.images)
+                except Exception:
+                        await db.rollback()
+                        await CuisineImages.delete_unreferenced_uploads(db, stored_images.uploaded_keys, settings.S3_BUCKET)
+                        raise
+                await stored_images.restore_reused(settings.S3_BUCKET)
+
+                # Step 5: Return the response
                 return {"message": "Cuisine added successfully"}
 
+        # Step 6: Handle exceptions
+        except HTTPException as error:
+                raise error
+
+        except Exception as error:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
+
+
+@router.post("/import-cuisines", status_code=status.HTTP_200_OK)
+async def import_cuisines_from_file(file: UploadFile = File(...), file_format: str = Query(None, alias="format", pattern="^(csv|jsonl|parquet)$"),
+                                    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=MAX_CHUNK_SIZE), current_user: User = Depends(validate_token)):
+        """
+        This route is used to add many cuisines at once from a CSV, JSONL or Parquet file with name, description, latitude and longitude columns. The file is
+        streamed in chunks: the tags of a chunk are predicted in one batch and its rows are inserted in one transaction. The response is a stream of JSON lines
+        reporting every row that could not be imported, the progress after each chunk and a final summary.
+
+        :param file:  File with one cuisine per row. \n
+        :param file_format:  csv, jsonl or parquet, detected from the file extension by default. \n
+        :param chunk_size:  Number of rows predicted and inserted together. \n
+        :param current_user:  User details extracted from the token, the cuisines are added for this user. \n
+
+        :return:  Stream of progress events (application/x-ndjson). \n
+
+        :raises HTTPException 400:  Unsupported file format. \n
+        :raises HTTPException 500:  Internal Server Error. \n
+        """
+        try:
+                # Step 1: Get the user ID from the token and the format of the file
+                user_id = current_user.get('user_id')
+                try:
+                        file_format = detect_format(file.filename, file_format)
+                except ValueError as error:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+                # Step 2: The uploaded file and the request scoped dependencies are closed before a streaming response is sent, so the upload is
+                # copied to a temporary file and the session is opened by the stream itself
+                import_file = tempfile.TemporaryFile()
+                await run_in_threadpool(shutil.copyfileobj, file.file, import_file)
+                import_file.seek(0)
+
+                # Step 3: Import the file while streaming the progress
+                async def stream_progress():
+                        with import_file:
+                                async with AsyncSessionLocal() as db:
+                                        async for event in import_cuisines(db, user_id, read_records(import_file, file_format), chunk_size):
+                                                yield orjson.dumps(event) + b"\n"
+
+                # Step 4: Return the response
+                return StreamingResponse(stream_progress(), media_type="application/x-ndjson")
+
         # Step 5: Handle exceptions
         except HTTPException as error:
                 raise error
@@ -139,8 +316,8 @@ async def add_cuisine(cuisine_details: CuisineBase, images: List[UploadFile] = F
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
 
 
-@router.put("/update-cuisine/{cuisine_id}", status_code=status.HTTP_200_OK)
-async def update_cuisine(cuisine_id: str, cuisine_details: CuisineUpdate, db: Session = Depends(get_db), current_user: User = Depends(validate_token)):
+@router.put("/update-cuisine/{cuisine_id}", status_code=status.HTTP_200_OK, response_model=CuisineUpdateOut, response_model_exclude_unset=True)
+async def update_cuisine(cuisine_id: str, cuisine_details: CuisineUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
         """
         This route is used to update the details of a cuisine. It takes the cuisine ID and the updated cuisine details as input and returns a success message.
         The request body should not be passed as an empty JSON object. If you want to update only the description of the cuisine, pass the description in the request body.
@@ -150,7 +327,7 @@ async def update_cuisine(cuisine_id: str, cuisine_details: CuisineUpdate, db: Se
         :param db:  Database session. \n
         :param current_user:  User details extracted from the token. \n
 
-        :return:  Success message. \n
+        :return:  Success message along with the updated cuisine. \n
 
         :raises HTTPException 404:  Cuisine is not found. \n
         :raises HTTPException 403:  You are not the owner of this cuisine. \n
@@ -161,7 +338,7 @@ async def update_cuisine(cuisine_id: str, cuisine_details: CuisineUpdate, db: Se
                 user_id = current_user.get('user_id')
 
                 # Step 2: Check if the cuisine exists if no raises an HTTPException with status code 404 Not Found
-                cuisine = CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
                 if cuisine is None:
                         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cuisine not found")
 
@@ -173,14 +350,14 @@ async def update_cuisine(cuisine_id: str, cuisine_details: CuisineUpdate, db: Se
                 updated_description = cuisine_details.description
                 if updated_description is not None:
                         # Step 4.1: Generate tags from the updated description
-                        cuisine_tags = generate_tags(cuisine_details.description)
-                        cuisine.update_cuisine(db, **cuisine_details.model_dump(), **cuisine_tags)
+                        cuisine_tags = await predict_tags(cuisine_details.description)
+                        cuisine = await CuisineDetails.update_cuisine(db, id=cuisine_id, **cuisine_details.model_dump(), **cuisine_tags)
                 else:
                         # Step 4.2: Update the cuisine details without generating tags
-                        cuisine.update_cuisine(db, **cuisine_details.model_dump())
+                        cuisine = await CuisineDetails.update_cuisine(db, id=cuisine_id, **cuisine_details.model_dump())
 
-                # Step 5: Return the response
-                return {"message": "Cuisine updated successfully", "updated_cuisine": cuisine}
+                # Step 5: Return the updated cuisine, serialized from its columns rather than the ORM object
+                return {"message": "Cuisine updated successfully", "updated_cuisine": serialize_cuisine(cuisine)}
 
         # Step 6: Handle exceptions
         except HTTPException as error:
@@ -191,7 +368,7 @@ async def update_cuisine(cuisine_id: str, cuisine_details: CuisineUpdate, db: Se
 
 
 @router.delete("/delete_image/{image_id}", status_code=status.HTTP_200_OK)
-async def delete_image(image_id: str, db: Session = Depends(get_db), current_user: User = Depends(validate_token)):
+async def delete_image(image_id: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
         """
         This route is used to delete an image of a cuisine. It takes the image ID as input and returns a success message.
 
@@ -210,19 +387,17 @@ async def delete_image(image_id: str, db: Session = Depends(get_db), current_use
                 user_id = current_user.get('user_id')
 
                 # Step 2: Check if the image exists if no raises an HTTPException with status code 404 Not Found
-                image = CuisineImages.get_cuisine_image_by_ID(db, image_id)
+                image = await CuisineImages.get_cuisine_image_by_ID(db, image_id)
                 if image is None:
                         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
 
                 # Step 3: Check if the user is the owner of the cuisine if no raises an HTTPException with status code 403 Forbidden
-                cuisine = CuisineDetails.get_cuisine_by_ID(db, image.cuisine_id)
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, image.cuisine_id)
                 if cuisine.user_id != user_id:
                         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not the owner of this cuisine")
 
-                # Step 4: Delete the image from S3 and the database
-                image_url = image.image_url.split('/')[-1]
-                delete_file_from_s3(image_url, settings.S3_BUCKET)
-                CuisineImages.delete_image(db, image_id)
+                # Step 4: Delete the image from the database, and its variants from S3 unless other images share the same content
+                await CuisineImages.delete_image(db, image_id, settings.S3_BUCKET)
 
                 # Step 5: Return the response
                 return {"message": "Image deleted successfully"}
@@ -236,7 +411,7 @@ async def delete_image(image_id: str, db: Session = Depends(get_db), current_use
 
 
 @router.post("/add-images/{cuisine_id}", status_code=status.HTTP_201_CREATED)
-async def add_images(cuisine_id: str, image: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(validate_token)):
+async def add_images(cuisine_id: str, image: UploadFile = File(...), db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
         """
         This route is used to add images to a cuisine. It takes the cuisine ID and the image as input and returns a success message.
 
@@ -245,7 +420,7 @@ async def add_images(cuisine_id: str, image: UploadFile = File(...), db: Session
         :param db:  Database session. \n
         :param current_user:  User details extracted from the token. \n
 
-        :return:  Success message. \n
+        :return:  Success message along with the updated cuisine. \n
 
         :raises HTTPException 404:  Cuisine is not found. \n
         :raises HTTPException 403:  You are not the owner of this cuisine. \n
@@ -257,7 +432,7 @@ async def add_images(cuisine_id: str, image: UploadFile = File(...), db: Session
                 user_id = current_user.get('user_id')
 
                 # Step 2: Check if the cuisine exists if no raises an HTTPException with status code 404 Not Found
-                cuisine = CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
                 if cuisine is None:
                         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cuisine not found")
 
@@ -268,8 +443,15 @@ async def add_images(cuisine_id: str, image: UploadFile = File(...), db: Session
                 # Step 4: Upload the images to S3 and add the image URLs to the database
                 if not validate_image_type(image.file):
                         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image type")
-                image_url = upload_file_to_s3(image, settings.S3_BUCKET)
-                CuisineImages.add_cuisine_images(db, cuisine_id, image_url)
+                stored_images = await upload_images_to_s3([image], settings.S3_BUCKET)
+                try:
+                        await CuisineImages.add_cuisine_images(db, cuisine_id, **stored_images.images[0])
+                except Exception:
+                        # The image is not saved, remove the objects this request uploaded
+                        await db.rollback()
+                        await CuisineImages.delete_unreferenced_uploads(db, stored_images.uploaded_keys, settings.S3_BUCKET)
+                        raise
+                await stored_images.restore_reused(settings.S3_BUCKET)
 
                 # Step 5: Return the response
                 return {"message": "Images added successfully"}
@@ -282,8 +464,119 @@ async def add_images(cuisine_id: str, image: UploadFile = File(...), db: Session
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
 
 
+@router.post("/upload-url/{cuisine_id}", status_code=status.HTTP_201_CREATED)
+async def get_image_upload_url(cuisine_id: str, upload_request: ImageUploadRequest, db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
+        """
+        This route is used to upload an image of a cuisine directly to S3. It takes the cuisine ID, the content type and the size of the image as input and returns a
+        presigned POST (url and form fields) and a presigned PUT URL. Once the upload succeeds the object key must be sent to /confirm-upload/{cuisine_id}.
+
+        :param cuisine_id:  ID of the cuisine to which the image will be added. \n
+        :param upload_request:  Content type (image/jpeg or image/png) and size in bytes of the image. \n
+        :param db:  Database session. \n
+        :param current_user:  User details extracted from the token. \n
+
+        :return:  Object key and the presigned upload details. \n
+
+        :raises HTTPException 404:  Cuisine is not found. \n
+        :raises HTTPException 403:  You are not the owner of this cuisine. \n
+        :raises HTTPException 400:  Invalid image type or size. \n
+        :raises HTTPException 500:  Internal Server Error. \n
+        """
+        try:
+                # Step 1: Get the user ID from the token
+                user_id = current_user.get('user_id')
+
+                # Step 2: Check if the cuisine exists if no raises an HTTPException with status code 404 Not Found
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
+                if cuisine is None:
+                        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cuisine not found")
+
+                # Step 3: Check if the user is the owner of the cuisine if no raises an HTTPException with status code 403 Forbidden
+                if cuisine.user_id != user_id:
+                        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not the owner of this cuisine")
+
+                # Step 4: Check the declared content type and size of the image
+                extension = ALLOWED_IMAGE_CONTENT_TYPES.get(upload_request.content_type)
+                if extension is None:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image type")
+                if not 0 < upload_request.content_length <= settings.S3_MAX_IMAGE_SIZE_MB * 1024 * 1024:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image size")
+
+                # Step 5: Generate the presigned upload for a new object under the prefix of the cuisine
+                object_key = f"uploads/{cuisine_id}/{uuid.uuid4()}.{extension}"
+                presigned_upload = await run_in_threadpool(generate_presigned_upload, settings.S3_BUCKET, object_key, upload_request.content_type, upload_request.content_length)
+
+                # Step 6: Return the response
+                return {"message": "Upload URL generated successfully", **presigned_upload}
+
+        # Step 7: Handle exceptions
+        except HTTPException as error:
+                raise error
+
+        except Exception as error:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
+
+
+@router.post("/confirm-upload/{cuisine_id}", status_code=status.HTTP_201_CREATED)
+async def confirm_image_upload(cuisine_id: str, upload_confirm: ImageUploadConfirm, db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
+        """
+        This route is used to register an image uploaded directly to S3 with the URL returned by /upload-url/{cuisine_id}. It takes the cuisine ID and the object key as input,
+        checks the uploaded object and adds it to the images of the cuisine.
+
+        :param cuisine_id:  ID of the cuisine to which the image is added. \n
+        :param upload_confirm:  Object key returned by /upload-url/{cuisine_id}. \n
+        :param db:  Database session. \n
+        :param current_user:  User details extracted from the token. \n
+
+        :return:  Success message along with the image ID and URL. \n
+
+        :raises HTTPException 404:  Cuisine or uploaded image is not found. \n
+        :raises HTTPException 403:  You are not the owner of this cuisine. \n
+        :raises HTTPException 400:  Invalid object key, image type or size. \n
+        :raises HTTPException 500:  Internal Server Error. \n
+        """
+        try:
+                # Step 1: Get the user ID from the token
+                user_id = current_user.get('user_id')
+                object_key = upload_confirm.object_key
+
+                # Step 2: Check if the cuisine exists if no raises an HTTPException with status code 404 Not Found
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
+                if cuisine is None:
+                        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cuisine not found")
+
+                # Step 3: Check if the user is the owner of the cuisine if no raises an HTTPException with status code 403 Forbidden
+                if cuisine.user_id != user_id:
+                        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not the owner of this cuisine")
+
+                # Step 4: Only objects uploaded under the prefix of this cuisine can be registered
+                if not object_key.startswith(f"uploads/{cuisine_id}/") or ".." in object_key:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid object key")
+
+                # Step 5: Check that the object exists and is a valid image, invalid uploads are removed from S3
+                metadata = await run_in_threadpool(get_s3_object_metadata, settings.S3_BUCKET, object_key)
+                if metadata is None:
+                        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Uploaded image not found")
+                if metadata["content_length"] > settings.S3_MAX_IMAGE_SIZE_MB * 1024 * 1024 or not await run_in_threadpool(validate_s3_image_type, settings.S3_BUCKET, object_key):
+                        await run_in_threadpool(delete_file_from_s3, object_key, settings.S3_BUCKET)
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image type")
+
+                # Step 6: Add the image URL to the database
+                cuisine_image = await CuisineImages.add_cuisine_images(db, cuisine_id, get_s3_object_url(settings.S3_BUCKET, object_key))
+
+                # Step 7: Return the response
+                return {"message": "Image added successfully", "image_id": cuisine_image.id, "image_url": cuisine_image.image_url}
+
+        # Step 8: Handle exceptions
+        except HTTPException as error:
+                raise error
+
+        except Exception as error:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
+
+
 @router.delete("/delete-cuisine/{cuisine_id}", status_code=status.HTTP_200_OK)
-async def delete_cuisine(cuisine_id: str, db: Session = Depends(get_db), current_user: User = Depends(validate_token)):
+async def delete_cuisine(cuisine_id: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(validate_token)):
         """
         This route is used to delete a cuisine. It takes the cuisine ID as input and returns a success message.
 
@@ -297,7 +590,7 @@ async def delete_cuisine(cuisine_id: str, db: Session = Depends(get_db), current
                 user_id = current_user.get('user_id')
 
                 # Step 2: Check if the cuisine exists if no raises an HTTPException with status code 404 Not Found
-                cuisine = CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
+                cuisine = await CuisineDetails.get_cuisine_by_ID(db, cuisine_id)
                 if cuisine is None:
                         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cuisine not found")
 
@@ -306,7 +599,7 @@ async def delete_cuisine(cuisine_id: str, db: Session = Depends(get_db), current
                         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not the owner of this cuisine")
 
                 # Step 4: Delete the cuisine from the database
-                CuisineDetails.delete_cuisine(db, cuisine_id)
+                await CuisineDetails.delete_cuisine(db, cuisine_id)
 
                 # Step 5: Return the response
                 return {"message": "Cuisine deleted successfully"}
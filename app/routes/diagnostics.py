@@ -0,0 +1,41 @@
+from fastapi import APIRouter, status
+
+from app.database import get_pool_stats
+from app.utils.response_cache import response_cache
+from app.utils.search_index import cuisine_search_index
+from app.utils.tag_model import tag_model_registry, prompt_tag_cache
+
+router = APIRouter()
+
+
+@router.get("/tag-model", status_code=status.HTTP_200_OK)
+async def get_tag_model_stats():
+        """
+        This route returns the state of the tag generation model loaded in this worker process, along with how long the last load took, the prediction latency,
+        the hit/miss counters of the prompt tag cache and the size of the ranked search index.
+
+        :return:  Tag model statistics. \n
+        """
+        return {"message": "Tag model statistics fetched successfully", "tag_model": tag_model_registry.stats(), "prompt_cache": prompt_tag_cache.stats(), "search_index": cuisine_search_index.stats()}
+
+
+@router.get("/db-pool", status_code=status.HTTP_200_OK)
+async def get_db_pool_stats():
+        """
+        This route returns the live state of the database connection pools of this worker process: connections checked out, overflow in use and a histogram of the
+        time spent waiting for a connection.
+
+        :return:  Connection pool statistics for the primary database and the read replica (if configured). \n
+        """
+        return {"message": "Connection pool statistics fetched successfully", "pools": get_pool_stats()}
+
+
+@router.get("/response-cache", status_code=status.HTTP_200_OK)
+async def get_response_cache_stats():
+        """
+        This route returns the hit/miss counters of the response cache of the cuisine read routes in this worker process, along with the number of 304 Not Modified
+        responses and of invalidations.
+
+        :return:  Response cache statistics. \n
+        """
+        return {"message": "Response cache statistics fetched successfully", "response_cache": response_cache.stats()}
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+
+from app.utils.metrics import metrics_registry
+
+router = APIRouter()
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+async def get_metrics():
+        """
+        This route returns the metrics of this worker process in the Prometheus text format: request latency per route, database statements per request and their
+        duration, time spent waiting for a pooled connection, S3 call latency per operation and tag model prediction latency.
+
+        :return:  Metrics in the Prometheus text exposition format. \n
+        """
+        return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,32 +1,35 @@
 import pyotp
-from fastapi import HTTPException, Depends, status, APIRouter
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, Depends, Query, status, APIRouter
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
 from app.database import get_db
 from app.models.users import Users
 from app.schemas.users import User
-from app.utils.helper_functions import generate_qr
+from app.utils.helper_functions import render_qr
 
 router = APIRouter()
 
 
 @router.get("/otp", status_code=status.HTTP_200_OK)
-async def generate_qr_code(phone_number: str, db: Session = Depends(get_db)):
+async def generate_qr_code(phone_number: str, image_format: str = Query("png", alias="format", pattern="^(png|svg)$"), db: AsyncSession = Depends(get_db)):
         """
         This route generates a QR code for the user based on the phone number, the QR code generated is in base64 format and needs to be decoded before displaying it to the user.
         The user can scan the QR code using any authenticator app like Google Authenticator, Microsoft Authenticator, etc.
+        With format=svg the QR code is returned as an SVG document instead, which is much cheaper to render and can be displayed as is.
 
         :param phone_number:  Phone number of the user \n
+        :param image_format:  png (base64 encoded, the default) or svg \n
         :param db:  Database session \n
 
-        :return:  Base64 encoded QR code
+        :return:  Base64 encoded QR code, or the SVG document
 
         :raises HTTPException(500):  In case of unexpected errors
         """
         try:
                 # Step 1: Fetch the user from the database based on name and phone number
-                user = Users.get_user_by_phone_number(db, phone_number)
+                user = await Users.get_user_by_phone_number(db, phone_number)
 
                 # Step 2: Use candidate's OTP secret or fallback to universal secret
                 otp_secret = str(user.otp_secret) if user else settings.SECRET_KEY
@@ -34,18 +37,22 @@ async def generate_qr_code(phone_number: str, db: Session = Depends(get_db)):
                 # Step 3: Generate OTP using PyOTP TOTP with a time interval of 60 seconds
                 totp = pyotp.TOTP(otp_secret)
                 data = totp.provisioning_uri(phone_number, issuer_name="mechXsteam")
-                base64_qr_code = generate_qr(data)
 
-                # Step 4: Return the generated OTP code
-                return base64_qr_code
+                # Step 4: Render the QR code off the event loop, the same provisioning URI is served from the cache
+                qr_code = await render_qr(data, image_format)
 
-        # Step 5: Raise HTTPException in case of unexpected errors
+                # Step 5: Return the generated OTP code
+                if image_format == "svg":
+                        return Response(content=qr_code, media_type="image/svg+xml")
+                return qr_code
+
+        # Step 6: Raise HTTPException in case of unexpected errors
         except Exception as error:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(error)) from error
 
 
 @router.post("/register-candidate", status_code=status.HTTP_200_OK)
-async def register_user(user: User, otp_code: int, db: Session = Depends(get_db)):
+async def register_user(user: User, otp_code: int, db: AsyncSession = Depends(get_db)):
         """
         This route registers a new user in the database, the user needs to provide the OTP code generated by the authenticator app along with the necessary
          user details specified in the schema to complete the registration process.
@@ -61,7 +68,7 @@ async def register_user(user: User, otp_code: int, db: Session = Depends(get_db)
         """
         try:
                 # Step 1: Check if the user already exists in the database
-                existing_user = Users.get_user_by_phone_number(db, user.phone_number)
+                existing_user = await Users.get_user_by_phone_number(db, user.phone_number)
 
                 # Step 2: If the user already exists, raise HTTPException with status code 400
                 if existing_user:
@@ -77,10 +84,10 @@ async def register_user(user: User, otp_code: int, db: Session = Depends(get_db)
 
                 # Step 4: If the OTP code is valid, create a new user in the database and generate an access token for the user
                 new_user = {"name": user.name, "phone_number": user.phone_number, "email": user.email, "otp_secret": pyotp.random_base32()}
-                user = Users.create_user(db, **new_user)
+                user = await Users.create_user(db, **new_user)
 
                 # Step 5: Generate an access token for the user
-                access_token = Users.generate_access_token(db, user.phone_number)
+                access_token = await Users.generate_access_token(db, user.phone_number)
 
                 # Step 6: Return the success message along with the access token
                 return {"message": "User created successfully", "token_type": "Bearer", "access_token": access_token}
@@ -94,7 +101,7 @@ async def register_user(user: User, otp_code: int, db: Session = Depends(get_db)
 
 
 @router.post("/login", status_code=status.HTTP_200_OK)
-async def login(phone_number: str, otp_code: int, db: Session = Depends(get_db)):
+async def login(phone_number: str, otp_code: int, db: AsyncSession = Depends(get_db)):
         """
         This route logs in the user, the user needs to provide the OTP code generated by the authenticator app along with the phone number to complete the login process.
 
@@ -109,7 +116,7 @@ async def login(phone_number: str, otp_code: int, db: Session = Depends(get_db))
         """
         try:
                 # Step 1: Fetch the user from the database based on name and phone number
-                user = Users.get_user_by_phone_number(db, phone_number)
+                user = await Users.get_user_by_phone_number(db, phone_number)
 
                 # Step 2: Use candidate's OTP secret or fallback to universal secret
                 otp_secret = str(user.otp_secret)
@@ -122,7 +129,7 @@ async def login(phone_number: str, otp_code: int, db: Session = Depends(get_db))
                         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid OTP code")
 
                 # Step 5: Generate an access token for the user
-                access_token = Users.generate_access_token(db, phone_number)
+                access_token = await Users.generate_access_token(db, phone_number)
 
                 # Step 6: Return the success message along with the access token
                 return {"message": "User logged in successfully", "token_type": "Bearer", "access_token": access_token}
@@ -1,7 +1,10 @@
 import json
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from app.utils.geo import parse_coordinate
 
 
 class CuisineBase(BaseModel):
@@ -23,3 +26,55 @@ class CuisineUpdate(BaseModel):
         description: Optional[str] = None
         latitude: Optional[str] = None
         longitude: Optional[str] = None
+
+
+class CuisineImportRow(BaseModel):
+        # One row of a bulk import file, coordinates may come in as numbers from JSONL or Parquet and are stored as text like the API does
+        name: str = Field(min_length=1, max_length=255)
+        description: str = Field(min_length=1, max_length=255)
+        latitude: str
+        longitude: str
+
+        @field_validator("latitude", "longitude", mode="before")
+        @classmethod
+        def validate_coordinate(cls, value, info):
+                if parse_coordinate(value, 90 if info.field_name == "latitude" else 180) is None:
+                        raise ValueError(f"{info.field_name} must be a number within range")
+                return str(value).strip()
+
+
+class CuisineOut(BaseModel):
+        # Every field is optional because listings can project a subset of them with ?fields=, unset fields are left out of the response
+        id: Optional[str] = None
+        user_id: Optional[str] = None
+        name: Optional[str] = None
+        description: Optional[str] = None
+        latitude: Optional[str] = None
+        longitude: Optional[str] = None
+        cuisine: Optional[str] = None
+        budget: Optional[str] = None
+        ambience: Optional[str] = None
+        dietary_options: Optional[str] = None
+        created_at: Optional[datetime] = None
+        updated_at: Optional[datetime] = None
+        # Image URLs, thumbnails in the listings
+        images: Optional[List[str]] = None
+        # Search specific: similarity or text match score, distance from the near point
+        score: Optional[float] = None
+        distance_km: Optional[float] = None
+
+
+class CuisineListOut(BaseModel):
+        message: str
+        cuisines: List[CuisineOut]
+        next_cursor: Optional[str] = None
+
+
+class CuisineDetailOut(BaseModel):
+        message: str
+        cuisine: CuisineOut
+
+
+class CuisineUpdateOut(BaseModel):
+        message: str
+        updated_cuisine: CuisineOut
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+
+class ImageUploadRequest(BaseModel):
+        content_type: str
+        content_length: int
+
+
+class ImageUploadConfirm(BaseModel):
+        object_key: str
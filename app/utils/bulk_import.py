@@ -0,0 +1,102 @@
+import csv
+import io
+import itertools
+import json
+import os
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+
+from app.models.cuisine_details import CuisineDetails
+from app.schemas.cuisine_details import CuisineImportRow
+from app.utils.helper_functions import generate_tags_batch
+
+SUPPORTED_FORMATS = ("csv", "jsonl", "parquet")
+FORMAT_ALIASES = {"ndjson": "jsonl", "pq": "parquet"}
+DEFAULT_CHUNK_SIZE = 500
+MAX_CHUNK_SIZE = 5000
+
+
+def detect_format(filename, file_format=None):
+        if file_format is None:
+                extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+                file_format = FORMAT_ALIASES.get(extension, extension)
+        if file_format not in SUPPORTED_FORMATS:
+                raise ValueError(f"Unsupported import format, expected one of: {', '.join(SUPPORTED_FORMATS)}")
+        return file_format
+
+
+def read_records(file, file_format):
+        # Streams (row number, record) pairs from a binary file, a line that cannot be parsed is yielded as the exception
+        if file_format == "csv":
+                yield from enumerate(csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline="")), 1)
+        elif file_format == "jsonl":
+                for number, line in enumerate(io.TextIOWrapper(file, encoding="utf-8"), 1):
+                        if line.strip():
+                                try:
+                                        yield number, json.loads(line)
+                                except ValueError as error:
+                                        yield number, error
+        else:
+                import pyarrow.parquet
+
+                numbers = itertools.count(1)
+                for batch in pyarrow.parquet.ParquetFile(file).iter_batches(batch_size=DEFAULT_CHUNK_SIZE):
+                        for record in batch.to_pylist():
+                                yield next(numbers), record
+
+
+def describe_error(error):
+        if isinstance(error, ValidationError):
+                return "; ".join(f"{'.'.join(str(part) for part in item['loc']) or 'row'}: {item['msg']}" for item in error.errors())
+        return str(error)
+
+
+async def import_cuisines(db, user_id, records, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Imports the cuisines from ``records`` (as produced by ``read_records``) for the given user, one chunk at a time.
+
+        Every chunk is validated, its tags are predicted in one batch and the valid rows are written with a single INSERT
+        in their own transaction. Yields an ``error`` event for each row that is not imported, a ``progress`` event after
+        each chunk and a final ``done`` event (or ``aborted`` if the file itself cannot be read any further).
+        """
+        processed = imported = failed = 0
+        while True:
+                # Step 1: Read the next chunk off the event loop, parsing CSV or decoding Parquet is CPU bound
+                try:
+                        chunk = await run_in_threadpool(list, itertools.islice(records, chunk_size))
+                except Exception as error:
+                        yield {"event": "aborted", "processed": processed, "imported": imported, "failed": failed, "detail": describe_error(error)}
+                        return
+                if not chunk:
+                        break
+
+                # Step 2: Validate the rows of the chunk
+                valid, errors = [], []
+                for number, record in chunk:
+                        try:
+                                if isinstance(record, Exception):
+                                        raise record
+                                valid.append((number, CuisineImportRow.model_validate(record).model_dump()))
+                        except (ValidationError, ValueError) as error:
+                                errors.append({"row": number, "detail": describe_error(error)})
+
+                # Step 3: Predict the tags of the whole chunk at once and insert it in one transaction, the rows are only reported as failed when
+                # the prediction or the INSERT itself failed (the index and cache updates after the commit do not raise)
+                if valid:
+                        try:
+                                cuisines_tags = await run_in_threadpool(generate_tags_batch, [cuisine["description"] for _, cuisine in valid])
+                                await CuisineDetails.bulk_create_cuisines(db, user_id, [{**cuisine, **cuisine_tags} for (_, cuisine), cuisine_tags in zip(valid, cuisines_tags)])
+                                imported += len(valid)
+                        except Exception as error:
+                                await db.rollback()
+                                errors.extend({"row": number, "detail": f"Chunk not imported: {describe_error(error)}"} for number, _ in valid)
+
+                # Step 4: Report the rows that were not imported and the progress so far
+                processed += len(chunk)
+                failed += len(errors)
+                for error in sorted(errors, key=lambda item: item["row"]):
+                        yield {"event": "error", **error}
+                yield {"event": "progress", "processed": processed, "imported": imported, "failed": failed}
+
+        yield {"event": "done", "processed": processed, "imported": imported, "failed": failed}
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+
+class TTLCache:
+        """
+        Bounded in-process cache with LRU eviction and an optional time to live per entry.
+        """
+
+        def __init__(self, max_size=1024, ttl=None):
+                self.max_size = max_size
+                self.ttl = ttl
+                self._data = OrderedDict()
+                self._lock = threading.Lock()
+                self.hits = 0
+                self.misses = 0
+                self.evictions = 0
+
+        def get(self, key, default=None):
+                with self._lock:
+                        entry = self._data.get(key)
+                        if entry is None:
+                                self.misses += 1
+                                return default
+                        value, expires_at = entry
+                        if expires_at is not None and expires_at <= time.monotonic():
+                                del self._data[key]
+                                self.misses += 1
+                                return default
+                        self._data.move_to_end(key)
+                        self.hits += 1
+                        return value
+
+        def set(self, key, value, ttl=None):
+                ttl = self.ttl if ttl is None else ttl
+                expires_at = time.monotonic() + ttl if ttl else None
+                with self._lock:
+                        self._data[key] = (value, expires_at)
+                        self._data.move_to_end(key)
+                        while len(self._data) > self.max_size:
+                                self._data.popitem(last=False)
+                                self.evictions += 1
+
+        def delete(self, key):
+                with self._lock:
+                        self._data.pop(key, None)
+
+        def clear(self):
+                with self._lock:
+                        self._data.clear()
+
+        def __len__(self):
+                return len(self._data)
+
+        def stats(self):
+                return {"size": len(self._data), "max_size": self.max_size, "ttl": self.ttl, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class InMemoryCacheBackend:
+        """
+        Shared cache backend stand-in that keeps JSON serialised values in a plain dict. Only shared within one process.
+        """
+
+        def __init__(self):
+                self._data = {}
+
+        async def get(self, key):
+                entry = self._data.get(key)
+                if entry is None:
+                        return None
+                value, expires_at = entry
+                if expires_at is not None and expires_at <= time.monotonic():
+                        self._data.pop(key, None)
+                        return None
+                return json.loads(value)
+
+        async def set(self, key, value, ttl=None):
+                self._data[key] = (json.dumps(value), time.monotonic() + ttl if ttl else None)
+
+        async def delete(self, key):
+                self._data.pop(key, None)
+
+        async def incr(self, key):
+                value = (await self.get(key) or 0) + 1
+                self._data[key] = (json.dumps(value), None)
+                return value
+
+
+class RedisCacheBackend:
+        """
+        Shared cache backend on Redis, so every uvicorn worker sees the same entries. Requires the optional ``redis`` package.
+        """
+
+        def __init__(self, url):
+                import redis.asyncio
+
+                self._client = redis.asyncio.from_url(url)
+
+        async def get(self, key):
+                value = await self._client.get(key)
+                return json.loads(value) if value is not None else None
+
+        async def set(self, key, value, ttl=None):
+                await self._client.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+        async def delete(self, key):
+                await self._client.delete(key)
+
+        async def incr(self, key):
+                return await self._client.incr(key)
+
+
+def get_cache_backend(url):
+        if not url:
+                return None
+        if url == "memory://":
+                return InMemoryCacheBackend()
+        if url.startswith(("redis://", "rediss://", "unix://")):
+                return RedisCacheBackend(url)
+        raise ValueError(f"Unsupported cache backend URL: {url}")
+
+
+# Optional cache shared between worker processes, ``None`` when CACHE_BACKEND_URL is not set
+cache_backend = get_cache_backend(settings.CACHE_BACKEND_URL)
@@ -1,23 +1,26 @@
+import hmac
+
 import jwt
-from fastapi import HTTPException, status, Depends, Header
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, status, Header
 
 from app.config import settings
-from app.database import get_db
+from app.database import AsyncSessionLocal
 from app.models.users import Users
 
 
-def validate_token(token: str = Header(...), db: Session = Depends(get_db)):
+async def validate_token(token: str = Header(...)):
         try:
                 # Step 1: Decode the token
                 user_details = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
 
-                # Step 2: Extract user ID and email from the decoded token
+                # Step 2: Extract user ID from the decoded token and check that the user exists, recently validated users are served from the cache
+                # without opening a database session
                 user_id = user_details.get('user_id')
-                user = Users.get_user_by_ID(db, user_id)
+                async with AsyncSessionLocal() as db:
+                        user_exists = await Users.user_exists(db, user_id)
 
                 # Step 3: Check if the user exists, if no raises an HTTPException with status code 401 Unauthorized else return the token for further processing
-                if user is None:
+                if not user_exists:
                         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
                 return user_details
@@ -34,3 +37,10 @@ def validate_token(token: str = Header(...), db: Session = Depends(get_db)):
 
         except Exception as e:
                 raise e
+
+
+async def validate_admin_token(authorization: str = Header(None)):
+        # Step 1: The operator routes are only mounted with an ADMIN_TOKEN, compare in constant time against the bearer token sent
+        scheme, _, credentials = (authorization or "").partition(" ")
+        if not settings.ADMIN_TOKEN or scheme.lower() != "bearer" or not hmac.compare_digest(credentials.encode(), settings.ADMIN_TOKEN.encode()):
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
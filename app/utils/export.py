@@ -0,0 +1,100 @@
+from functools import cache
+
+import orjson
+
+EXPORT_FORMATS = {
+        "ndjson": ("application/x-ndjson", "ndjson"),
+        "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+        "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+# Cuisines fetched per server side cursor round trip, and held in memory at once
+EXPORT_BATCH_SIZE = 1000
+# Parquet readers work best with row groups far bigger than one batch
+PARQUET_ROW_GROUP_SIZE = 20000
+
+EXPORT_COLUMNS = ["id", "user_id", "name", "description", "latitude", "longitude", "lat", "lng", "cuisine", "budget", "ambience", "dietary_options", "created_at", "updated_at"]
+
+
+@cache
+def get_export_schema():
+        # pyarrow is imported by the first Arrow or Parquet export, not with the app
+        import pyarrow
+
+        column_types = {"lat": pyarrow.float64(), "lng": pyarrow.float64(), "created_at": pyarrow.timestamp("us"), "updated_at": pyarrow.timestamp("us")}
+        return pyarrow.schema([*((column, column_types.get(column, pyarrow.string())) for column in EXPORT_COLUMNS), ("images", pyarrow.list_(pyarrow.string()))])
+
+
+class _ChunkSink:
+        """
+        Write-only file object collecting the bytes pyarrow writes, drained into the response after every batch.
+        """
+
+        def __init__(self):
+                self._chunks = []
+                self._position = 0
+                self.closed = False
+
+        def write(self, data):
+                data = bytes(data)
+                self._chunks.append(data)
+                self._position += len(data)
+                return len(data)
+
+        def tell(self):
+                return self._position
+
+        def flush(self):
+                pass
+
+        def close(self):
+                self.closed = True
+
+        def drain(self):
+                data = b"".join(self._chunks)
+                self._chunks = []
+                return data
+
+
+async def encode_ndjson(batches):
+        async for batch in batches:
+                yield b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+
+async def encode_arrow(batches, file_format):
+        # Arrow IPC stream or Parquet, written batch by batch to a sink that is emptied into the response every time
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        schema = get_export_schema()
+        sink = _ChunkSink()
+        output = pyarrow.PythonFile(sink, mode="w")
+        if file_format == "arrow":
+                writer = pyarrow.ipc.new_stream(output, schema)
+        else:
+                writer = pyarrow.parquet.ParquetWriter(output, schema)
+
+        pending, pending_rows = [], 0
+        async for batch in batches:
+                record_batch = pyarrow.RecordBatch.from_pylist(batch, schema=schema)
+                if file_format == "arrow":
+                        writer.write_batch(record_batch)
+                else:
+                        pending.append(record_batch)
+                        pending_rows += record_batch.num_rows
+                        if pending_rows < PARQUET_ROW_GROUP_SIZE:
+                                continue
+                        writer.write_table(pyarrow.Table.from_batches(pending), row_group_size=pending_rows)
+                        pending, pending_rows = [], 0
+                data = sink.drain()
+                if data:
+                        yield data
+
+        if pending:
+                writer.write_table(pyarrow.Table.from_batches(pending), row_group_size=pending_rows)
+        writer.close()
+        yield sink.drain()
+
+
+def encode_export(batches, file_format):
+        return encode_ndjson(batches) if file_format == "ndjson" else encode_arrow(batches, file_format)
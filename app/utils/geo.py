@@ -0,0 +1,125 @@
+import math
+
+import numpy as np
+from fastapi import HTTPException, status
+
+EARTH_RADIUS_KM = 6371.0088
+MAX_RADIUS_KM = 500
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+# Most geohash prefixes a proximity search filters on, each one is a range scan of the geohash index
+GEOHASH_MAX_CELLS = 16
+
+
+def parse_coordinate(value, limit):
+        try:
+                coordinate = float(value)
+        except (TypeError, ValueError):
+                return None
+        if math.isnan(coordinate) or abs(coordinate) > limit:
+                return None
+        return coordinate
+
+
+def coordinate_columns(latitude, longitude):
+        # Numeric coordinates and geohash stored along with the latitude and longitude strings, all None when they do not parse
+        lat, lng = parse_coordinate(latitude, 90), parse_coordinate(longitude, 180)
+        return {"lat": lat, "lng": lng, "geohash": encode_geohash(lat, lng) if lat is not None and lng is not None else None}
+
+
+def parse_near(near):
+        parts = near.split(",")
+        lat = parse_coordinate(parts[0], 90) if len(parts) == 2 else None
+        lng = parse_coordinate(parts[1], 180) if len(parts) == 2 else None
+        if lat is None or lng is None:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="near must be formatted as lat,lng")
+        return lat, lng
+
+
+def bounding_box(lat, lng, radius_km):
+        # Returns the latitude range and one or two longitude ranges (two when the box crosses the antimeridian)
+        lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+        min_lat, max_lat = max(lat - lat_delta, -90.0), min(lat + lat_delta, 90.0)
+        if min_lat <= -90.0 or max_lat >= 90.0:
+                return (min_lat, max_lat), [(-180.0, 180.0)]
+
+        # Widest longitude difference on the circle, reached north or south of the centre rather than at its latitude
+        angular_radius = radius_km / EARTH_RADIUS_KM
+        if math.sin(angular_radius) >= math.cos(math.radians(lat)):
+                return (min_lat, max_lat), [(-180.0, 180.0)]
+        lng_delta = math.degrees(math.asin(math.sin(angular_radius) / math.cos(math.radians(lat))))
+        min_lng, max_lng = lng - lng_delta, lng + lng_delta
+        if min_lng < -180.0:
+                return (min_lat, max_lat), [(min_lng + 360.0, 180.0), (-180.0, max_lng)]
+        if max_lng > 180.0:
+                return (min_lat, max_lat), [(min_lng, 180.0), (-180.0, max_lng - 360.0)]
+        return (min_lat, max_lat), [(min_lng, max_lng)]
+
+
+def haversine_km(lat, lng, lats, lngs):
+        # Vectorised great circle distance from one point to arrays of points
+        lat1, lng1 = math.radians(lat), math.radians(lng)
+        lat2, lng2 = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lngs, dtype=np.float64))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+        # Interleaves the bisections of the longitude (even bits) and the latitude (odd bits), five bits per character
+        lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+        characters, bits, value, even = [], 0, 0, True
+        while len(characters) < precision:
+                interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+                middle = (interval[0] + interval[1]) / 2
+                value <<= 1
+                if coordinate >= middle:
+                        value |= 1
+                        interval[0] = middle
+                else:
+                        interval[1] = middle
+                even = not even
+                bits += 1
+                if bits == 5:
+                        characters.append(GEOHASH_ALPHABET[value])
+                        bits, value = 0, 0
+        return "".join(characters)
+
+
+def geohash_cell_size(precision):
+        # Height and width in degrees of the cells of a geohash precision
+        lng_bits = (5 * precision + 1) // 2
+        return 180.0 / 2 ** (5 * precision - lng_bits), 360.0 / 2 ** lng_bits
+
+
+def geohash_range(cell):
+        """
+        Returns the ``(low, high)`` bounds of the geohashes starting with ``cell``: ``low <= geohash < high``, high is None for
+        the last cell. High is the next cell of the alphabet rather than the cell followed by a sorting character, digits sort
+        before letters in every collation but punctuation does not (MySQL's default utf8mb4_0900_ai_ci puts it first).
+        """
+        prefix = cell.rstrip(GEOHASH_ALPHABET[-1])
+        if not prefix:
+                return cell, None
+        return cell, prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+
+def geohash_cover(lat_range, lng_ranges, max_cells=GEOHASH_MAX_CELLS):
+        """
+        Returns the geohash prefixes of the cells covering the bounding box returned by ``bounding_box``, at the finest
+        precision needing at most ``max_cells`` of them, or None when even single character cells are too many (a box
+        around a pole or spanning every longitude), the box is then only filtered on lat and lng.
+        """
+        min_lat, max_lat = lat_range
+        cover = None
+        for precision in range(1, GEOHASH_PRECISION + 1):
+                cell_lat, cell_lng = geohash_cell_size(precision)
+                lat_cells = range(int((min_lat + 90.0) // cell_lat), min(int((max_lat + 90.0) // cell_lat), round(180.0 / cell_lat) - 1) + 1)
+                lng_cells = [cell for min_lng, max_lng in lng_ranges
+                             for cell in range(int((min_lng + 180.0) // cell_lng), min(int((max_lng + 180.0) // cell_lng), round(360.0 / cell_lng) - 1) + 1)]
+                if len(lat_cells) * len(lng_cells) > max_cells:
+                        break
+                # The centre of a cell of the grid encodes to the geohash of that cell
+                cover = sorted({encode_geohash(-90.0 + (lat_cell + 0.5) * cell_lat, -180.0 + (lng_cell + 0.5) * cell_lng, precision)
+                                for lat_cell in lat_cells for lng_cell in lng_cells})
+        return cover
@@ -1,27 +1,83 @@
+import asyncio
 import base64
 import imghdr
-from datetime import datetime
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
 from io import BytesIO
+from zoneinfo import ZoneInfo
 
-import boto3
-import joblib
-import pytz
-import qrcode
-from botocore.exceptions import NoCredentialsError
+from botocore.exceptions import NoCredentialsError, ClientError
 from fastapi import HTTPException, status
 
 from app.config import settings
+from app.utils.cache import TTLCache
+from app.utils.metrics import instrument_s3_client
+from app.utils.tag_model import tag_model_registry, tag_prediction_batcher, prompt_tag_cache
 
-s3_client = boto3.client(
-        "s3",
-        region_name="ap-south-1",
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-)
+# Importing boto3 and building the client is a large share of the worker start up, both happen on first use through
+# get_s3_client (the lifespan hook warms it up in the background)
+s3_client = None
+s3_transfer_config = None
+s3_client_lock = threading.Lock()
+
+INDIA_TIMEZONE = ZoneInfo("Asia/Kolkata")
+
+# boto3 is blocking, uploads run on this bounded pool instead of the event loop
+s3_upload_executor = ThreadPoolExecutor(max_workers=settings.S3_UPLOAD_CONCURRENCY, thread_name_prefix="s3-upload")
+
+# Thumbnails and WebP variants are CPU bound, they are rendered in a process pool created on first use
+image_process_pool = None
+
+# QR codes are rendered off the event loop on a small pool, the same provisioning URI is served from the cache afterwards
+qr_render_executor = ThreadPoolExecutor(max_workers=settings.QR_RENDER_WORKERS, thread_name_prefix="qr-render")
+qr_code_cache = TTLCache(max_size=settings.QR_CACHE_MAX_SIZE, ttl=settings.QR_CACHE_TTL_SECONDS)
 
 
 def get_current_time():
-        return datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(pytz.timezone('Asia/Kolkata'))
+        return datetime.now(timezone.utc).astimezone(INDIA_TIMEZONE)
+
+
+def get_s3_client():
+        global s3_client, s3_transfer_config
+        if s3_client is None:
+                with s3_client_lock:
+                        if s3_client is None:
+                                import boto3
+                                from boto3.s3.transfer import TransferConfig
+
+                                # Files above the threshold are uploaded in parts, in parallel
+                                s3_transfer_config = TransferConfig(
+                                        multipart_threshold=settings.S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+                                        multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE_MB * 1024 * 1024,
+                                )
+                                client = boto3.client(
+                                        "s3",
+                                        region_name="ap-south-1",
+                                        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                                )
+                                instrument_s3_client(client)
+                                s3_client = client
+        return s3_client
+
+
+CUISINE_FIELDS = ("id", "user_id", "name", "description", "latitude", "longitude", "cuisine", "budget", "ambience", "dietary_options", "created_at", "updated_at", "images")
+
+
+def serialize_cuisine(cuisine, fields=None, thumbnails=False):
+        # Build the response from the mapped columns only, so ORM internals such as _sa_instance_state never leak out
+        fields = fields or CUISINE_FIELDS
+        cuisine_dict = {field: getattr(cuisine, field) for field in fields if field != "images"}
+        if "images" in fields:
+                # Listings use the small thumbnails, images stored before variants existed fall back to the original
+                cuisine_dict["images"] = [(image.thumbnail_url or image.image_url) if thumbnails else image.image_url for image in cuisine.images]
+        return cuisine_dict
+
+
+ALLOWED_IMAGE_CONTENT_TYPES = {"image/jpeg": "jpg", "image/png": "png"}
 
 
 def validate_image_type(image):
@@ -30,20 +86,120 @@ def validate_image_type(image):
         return True
 
 
+def get_s3_object_url(bucket, object_name):
+        return f"https://{bucket}.s3.amazonaws.com/{object_name}"
+
+
+def get_s3_object_key(image_url):
+        return image_url.split(".amazonaws.com/", 1)[-1]
+
+
 def upload_file_to_s3(file, bucket, object_name=None):
         if object_name is None:
                 object_name = file.filename
         try:
-                s3_client.upload_fileobj(file.file, bucket, object_name)
+                get_s3_client().upload_fileobj(file.file, bucket, object_name, Config=s3_transfer_config)
         except NoCredentialsError:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not connect to AWS with provided credentials")
-        return f"https://{bucket}.s3.amazonaws.com/{object_name}"
+        return get_s3_object_url(bucket, object_name)
+
+
+def upload_bytes_to_s3(data, bucket, object_name, content_type):
+        try:
+                get_s3_client().upload_fileobj(BytesIO(data), bucket, object_name, ExtraArgs={"ContentType": content_type}, Config=s3_transfer_config)
+        except NoCredentialsError:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not connect to AWS with provided credentials")
+        return get_s3_object_url(bucket, object_name)
+
+
+def get_image_process_pool():
+        # Created on first use, spawned processes do not inherit the S3 and database clients of the worker
+        global image_process_pool
+        if image_process_pool is None:
+                image_process_pool = ProcessPoolExecutor(max_workers=settings.IMAGE_PROCESSING_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return image_process_pool
+
+
+def shutdown_image_process_pool():
+        global image_process_pool
+        if image_process_pool is not None:
+                image_process_pool.shutdown(wait=False, cancel_futures=True)
+                image_process_pool = None
+
+
+def store_processed_image(data, processed_image, bucket):
+        # Objects are content addressed, bytes that were uploaded before reuse the existing objects
+        content_hash = processed_image["content_hash"]
+        original_key = f"{content_hash}.{processed_image['extension']}"
+        thumbnail_key = f"{content_hash}_thumb.webp"
+        webp_key = f"{content_hash}.webp"
+        image = {
+                "image_url": get_s3_object_url(bucket, original_key),
+                "thumbnail_url": get_s3_object_url(bucket, thumbnail_key),
+                "webp_url": get_s3_object_url(bucket, webp_key),
+                "content_hash": content_hash,
+        }
+        if get_s3_object_metadata(bucket, original_key) is not None:
+                return image, []
+
+        # The original is uploaded last, its presence marks the variants as complete
+        upload_bytes_to_s3(processed_image["thumbnail"], bucket, thumbnail_key, "image/webp")
+        upload_bytes_to_s3(processed_image["webp"], bucket, webp_key, "image/webp")
+        upload_bytes_to_s3(data, bucket, original_key, processed_image["content_type"])
+        return image, [thumbnail_key, webp_key, original_key]
+
 
+class StoredImages:
+        """
+        Result of ``upload_images_to_s3``: the image columns in the order of the files, the keys written by the request by
+        content hash, and the images whose objects were reused from an earlier upload. Deleting the last image of a content
+        may remove the reused objects before the rows referring to them are saved, ``restore_reused`` stores them again.
+        """
+
+        def __init__(self, images, uploaded_keys, reused):
+                self.images = images
+                self.uploaded_keys = uploaded_keys
+                self._reused = reused
+
+        async def restore_reused(self, bucket):
+                # Called once the image rows are committed, a deletion of the same content either saw them or finished removing the objects by then
+                loop = asyncio.get_running_loop()
+                await asyncio.gather(*(loop.run_in_executor(s3_upload_executor, store_processed_image, data, processed_image, bucket) for data, processed_image in self._reused))
+
+
+async def upload_images_to_s3(images, bucket):
+        # Step 1: Hash and resize all the images in the process pool. Imported here, PIL is only loaded by the first upload
+        from app.utils.image_processing import process_image
+
+        loop = asyncio.get_running_loop()
+        image_data = [await image.read() for image in images]
+        process_image_with_settings = partial(process_image, thumbnail_size=settings.IMAGE_THUMBNAIL_SIZE, webp_max_size=settings.IMAGE_WEBP_MAX_SIZE, webp_quality=settings.IMAGE_WEBP_QUALITY)
+        processed_images = await asyncio.gather(*(loop.run_in_executor(get_image_process_pool(), process_image_with_settings, data) for data in image_data))
+
+        # Step 2: Upload the originals and their variants concurrently on the upload pool, the images are returned in the order of the files
+        results = await asyncio.gather(*(loop.run_in_executor(s3_upload_executor, store_processed_image, data, processed_image, bucket)
+                                         for data, processed_image in zip(image_data, processed_images)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+                # Do not leave the objects this request uploaded behind when it fails
+                await delete_files_from_s3([key for result in results if not isinstance(result, BaseException) for key in result[1]], bucket)
+                raise errors[0]
+
+        # Step 3: Return the images and, by content hash, the keys written by this request (none for the objects reused from earlier uploads)
+        return StoredImages([image for image, _ in results], {image["content_hash"]: keys for image, keys in results if keys},
+                            [(data, processed_image) for data, processed_image, (_, keys) in zip(image_data, processed_images, results) if not keys])
+
+
+def generate_qr(data, image_format="png"):
+        # SVG is written as a path without PIL, PNG is rendered by PIL and returned base64 encoded. Imported here, only the OTP route needs it
+        import qrcode
+        import qrcode.image.svg
 
-def generate_qr(data):
         qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
         qr.add_data(data)
         qr.make(fit=True)
+        if image_format == "svg":
+                return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string(encoding="unicode")
         img = qr.make_image(fill_color="black", back_color="white")
         img_bytesio = BytesIO()
         img.save(img_bytesio)
@@ -51,29 +207,86 @@ def generate_qr(data):
         return img_base64
 
 
+async def render_qr(data, image_format="png"):
+        key = (image_format, data)
+        qr_code = qr_code_cache.get(key)
+        if qr_code is None:
+                qr_code = await asyncio.get_running_loop().run_in_executor(qr_render_executor, generate_qr, data, image_format)
+                qr_code_cache.set(key, qr_code)
+        return qr_code
+
+
 def generate_tags(description: str):
-        # Load the dictionary of models
-        saved_dict = joblib.load("app/utils/cuisine_generation.joblib")
+        # The vectorizer and models are loaded once per process and shared across requests
+        return tag_model_registry.predict(description)
+
 
-        # Convert the description to TF-IDF features
-        tfidf_vectorizer = saved_dict['vectorizer']
-        models = saved_dict['models']
+def generate_tags_batch(descriptions):
+        # One TF-IDF transform and one predict call per tag model for the whole batch
+        return tag_model_registry.predict_batch(descriptions)
 
-        # Create an empty dictionary to store predictions for each tag
-        predictions_dict = {}
-        new_description_tfidf = tfidf_vectorizer.transform([description])
-        # Make predictions for each tag using the respective models
-        for tag, model in models.items():
-                tag_prediction = model.predict(new_description_tfidf)
-                predictions_dict[tag] = tag_prediction[0]
 
-        # Return the predictions
-        return predictions_dict
+async def predict_tags(description: str):
+        # Concurrent requests arriving within a few milliseconds share a single batched prediction
+        return await tag_prediction_batcher.predict(description)
+
+
+async def predict_prompt_tags(prompt: str):
+        # Search prompts repeat a lot, so they are served from the prompt cache before reaching the model
+        return await prompt_tag_cache.get_tags(prompt)
 
 
 def delete_file_from_s3(file_name, bucket):
         try:
-                s3_client.delete_object(Bucket=bucket, Key=file_name)
+                get_s3_client().delete_object(Bucket=bucket, Key=file_name)
         except NoCredentialsError:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not connect to AWS with provided credentials")
         return True
+
+
+async def delete_files_from_s3(keys, bucket):
+        # Best effort clean up on the upload pool, every key is tried even when some of the deletes fail
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(s3_upload_executor, delete_file_from_s3, key, bucket) for key in keys), return_exceptions=True)
+
+
+def generate_presigned_upload(bucket, object_name, content_type, content_length):
+        # The client uploads the bytes straight to S3, the signature pins the key, the content type and the size
+        try:
+                expires_in = settings.S3_PRESIGNED_EXPIRES_SECONDS
+                post = get_s3_client().generate_presigned_post(
+                        Bucket=bucket,
+                        Key=object_name,
+                        Fields={"Content-Type": content_type},
+                        Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, settings.S3_MAX_IMAGE_SIZE_MB * 1024 * 1024]],
+                        ExpiresIn=expires_in,
+                )
+                put_url = get_s3_client().generate_presigned_url(
+                        "put_object",
+                        Params={"Bucket": bucket, "Key": object_name, "ContentType": content_type, "ContentLength": content_length},
+                        ExpiresIn=expires_in,
+                )
+        except NoCredentialsError:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not connect to AWS with provided credentials")
+        return {"object_key": object_name, "post": post, "put_url": put_url, "expires_in": expires_in}
+
+
+def get_s3_object_metadata(bucket, object_name):
+        try:
+                response = get_s3_client().head_object(Bucket=bucket, Key=object_name)
+        except ClientError as error:
+                if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                        return None
+                raise error
+        except NoCredentialsError:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not connect to AWS with provided credentials")
+        return {"content_length": response["ContentLength"], "content_type": response.get("ContentType")}
+
+
+def validate_s3_image_type(bucket, object_name):
+        # Only the first bytes are needed to recognise the image format
+        try:
+                response = get_s3_client().get_object(Bucket=bucket, Key=object_name, Range="bytes=0-31")
+        except NoCredentialsError:
+                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not connect to AWS with provided credentials")
+        return validate_image_type(BytesIO(response["Body"].read()))
@@ -0,0 +1,34 @@
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Runs in worker processes, so this module only depends on Pillow and never on the application settings
+IMAGE_FORMATS = {"JPEG": ("jpg", "image/jpeg"), "PNG": ("png", "image/png")}
+
+
+def _encode_webp(image, max_size, quality):
+        variant = image.copy()
+        variant.thumbnail((max_size, max_size))
+        buffer = BytesIO()
+        variant.save(buffer, "WEBP", quality=quality, method=4)
+        return buffer.getvalue()
+
+
+def process_image(data: bytes, thumbnail_size=320, webp_max_size=1600, webp_quality=80):
+        content_hash = hashlib.sha256(data).hexdigest()
+        with Image.open(BytesIO(data)) as image:
+                extension, content_type = IMAGE_FORMATS.get(image.format, ("jpg", "image/jpeg"))
+
+                # Apply the EXIF orientation so the variants are not rotated, and drop palette/CMYK modes WebP cannot store as is
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ("RGB", "RGBA"):
+                        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+
+                return {
+                        "content_hash": content_hash,
+                        "extension": extension,
+                        "content_type": content_type,
+                        "thumbnail": _encode_webp(image, thumbnail_size, webp_quality),
+                        "webp": _encode_webp(image, webp_max_size, webp_quality),
+                }
@@ -0,0 +1,238 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Statements are cut to this length in the slow request log
+SLOW_STATEMENT_MAX_LENGTH = 1000
+
+slow_request_logger = logging.getLogger("cuisineiq.slow_requests")
+
+
+class Histogram:
+        """
+        Thread safe cumulative histogram with fixed upper bounds, in the same shape as a Prometheus histogram.
+        """
+
+        def __init__(self, buckets=DEFAULT_BUCKETS):
+                self.buckets = tuple(sorted(buckets))
+                self._counts = [0] * (len(self.buckets) + 1)
+                self._sum = 0.0
+                self._count = 0
+                self._lock = threading.Lock()
+
+        def observe(self, value):
+                index = bisect.bisect_left(self.buckets, value)
+                with self._lock:
+                        self._counts[index] += 1
+                        self._sum += value
+                        self._count += 1
+
+        def snapshot(self):
+                with self._lock:
+                        counts = list(self._counts)
+                        total, count = self._sum, self._count
+                cumulative, buckets = 0, {}
+                for upper_bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                        cumulative += bucket_count
+                        buckets["+Inf" if upper_bound == float("inf") else str(upper_bound)] = cumulative
+                return {"buckets": buckets, "sum": total, "count": count}
+
+
+def _escape_label_value(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class LabeledHistogram:
+        """
+        Family of histograms sharing a metric name and buckets, one child per combination of label values.
+        """
+
+        def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+                self.name = name
+                self.documentation = documentation
+                self.label_names = tuple(label_names)
+                self.buckets = buckets
+                self._children = {}
+                self._lock = threading.Lock()
+
+        def labels(self, *label_values):
+                child = self._children.get(label_values)
+                if child is None:
+                        with self._lock:
+                                child = self._children.setdefault(label_values, Histogram(self.buckets))
+                return child
+
+        def render(self):
+                lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+                for label_values, child in sorted(self._children.items()):
+                        labels = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(self.label_names, label_values)]
+                        snapshot = child.snapshot()
+                        for upper_bound, count in snapshot["buckets"].items():
+                                bucket_labels = ",".join([*labels, f'le="{upper_bound}"'])
+                                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {count}")
+                        suffix = "{" + ",".join(labels) + "}" if labels else ""
+                        lines.append(f"{self.name}_sum{suffix} {snapshot['sum']}")
+                        lines.append(f"{self.name}_count{suffix} {snapshot['count']}")
+                return lines
+
+
+class MetricsRegistry:
+        def __init__(self):
+                self._metrics = {}
+
+        def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+                if name not in self._metrics:
+                        self._metrics[name] = LabeledHistogram(name, documentation, label_names, buckets)
+                return self._metrics[name]
+
+        def render(self):
+                # Prometheus text exposition format 0.0.4
+                lines = []
+                for metric in self._metrics.values():
+                        lines.extend(metric.render())
+                return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+http_request_duration = metrics_registry.histogram("cuisineiq_http_request_duration_seconds", "Time to serve a request, including a streamed body.", ("method", "route", "status"))
+request_query_count = metrics_registry.histogram("cuisineiq_http_request_db_queries", "Database statements executed per request.", ("method", "route"), QUERY_COUNT_BUCKETS)
+request_query_duration = metrics_registry.histogram("cuisineiq_http_request_db_seconds", "Time spent in database statements per request.", ("method", "route"))
+db_query_duration = metrics_registry.histogram("cuisineiq_db_query_duration_seconds", "Time to execute a single database statement.", ("engine",))
+db_pool_wait_duration = metrics_registry.histogram("cuisineiq_db_pool_wait_seconds", "Time spent waiting for a pooled database connection.", ("pool",))
+s3_request_duration = metrics_registry.histogram("cuisineiq_s3_request_duration_seconds", "Time of an S3 API call, by operation.", ("operation", "outcome"))
+tag_prediction_duration = metrics_registry.histogram("cuisineiq_tag_prediction_duration_seconds", "Time of one tag model prediction batch.")
+
+
+class RequestMetrics:
+        """
+        Per request accumulator of the database statements, reached through ``current_request_metrics`` by the engine
+        event listeners. When ``slow_statements`` is set, the slowest statements are kept for the slow request log.
+        """
+
+        __slots__ = ("query_count", "query_seconds", "slow_statements", "_slowest", "_sequence")
+
+        def __init__(self, slow_statements=0):
+                self.query_count = 0
+                self.query_seconds = 0.0
+                self.slow_statements = slow_statements
+                self._slowest = []
+                self._sequence = 0
+
+        def record_query(self, statement, elapsed):
+                self.query_count += 1
+                self.query_seconds += elapsed
+                if self.slow_statements:
+                        # Min-heap of the N slowest, the sequence number breaks ties without comparing statements
+                        self._sequence += 1
+                        entry = (elapsed, self._sequence, statement)
+                        if len(self._slowest) < self.slow_statements:
+                                heapq.heappush(self._slowest, entry)
+                        elif entry > self._slowest[0]:
+                                heapq.heapreplace(self._slowest, entry)
+
+        def slowest(self):
+                return [(elapsed, statement) for elapsed, _, statement in sorted(self._slowest, reverse=True)]
+
+
+current_request_metrics: ContextVar = ContextVar("current_request_metrics", default=None)
+
+
+def record_query(engine_name, statement, elapsed):
+        db_query_duration.labels(engine_name).observe(elapsed)
+        request_metrics = current_request_metrics.get()
+        if request_metrics is not None:
+                request_metrics.record_query(statement, elapsed)
+
+
+def instrument_engine(engine, engine_name):
+        # Times every statement on the connection it runs on, statements of one connection never overlap
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+                conn.info["query_started"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+                started = conn.info.pop("query_started", None)
+                if started is not None:
+                        record_query(engine_name, statement, time.perf_counter() - started)
+
+
+def instrument_s3_client(client):
+        # botocore emits these events around every API call, including each part of a multipart upload
+        def before_call(model, context, **kwargs):
+                context["metrics_started"] = time.perf_counter()
+
+        def record_call(model, context, outcome):
+                started = context.pop("metrics_started", None)
+                if started is not None:
+                        s3_request_duration.labels(model.name, outcome).observe(time.perf_counter() - started)
+
+        def after_call(model, context, http_response, **kwargs):
+                record_call(model, context, "error" if http_response.status_code >= 400 else "success")
+
+        def after_call_error(model, context, **kwargs):
+                record_call(model, context, "error")
+
+        client.meta.events.register("before-call.s3", before_call)
+        client.meta.events.register("after-call.s3", after_call)
+        client.meta.events.register("after-call-error.s3", after_call_error)
+
+
+class MetricsMiddleware:
+        """
+        ASGI middleware recording the latency of every request, labelled with its route template, along with the number
+        of database statements it ran and the time spent in them.
+
+        With ``slow_request_seconds`` set, requests taking at least that long are logged with their ``slow_statements``
+        slowest statements on the ``cuisineiq.slow_requests`` logger.
+        """
+
+        def __init__(self, app, slow_request_seconds=None, slow_statements=5):
+                self.app = app
+                self.slow_request_seconds = slow_request_seconds
+                self.slow_statements = slow_statements if slow_request_seconds is not None else 0
+
+        async def __call__(self, scope, receive, send):
+                if scope["type"] != "http":
+                        await self.app(scope, receive, send)
+                        return
+
+                request_metrics = RequestMetrics(self.slow_statements)
+                token = current_request_metrics.set(request_metrics)
+                status_code = 500
+
+                async def send_with_status(message):
+                        nonlocal status_code
+                        if message["type"] == "http.response.start":
+                                status_code = message["status"]
+                        await send(message)
+
+                started = time.perf_counter()
+                try:
+                        await self.app(scope, receive, send_with_status)
+                finally:
+                        elapsed = time.perf_counter() - started
+                        current_request_metrics.reset(token)
+                        # The route template keeps the label set bounded, unmatched paths are counted together
+                        route = scope.get("route")
+                        route_path = getattr(route, "path", None) or "unmatched"
+                        method = scope["method"]
+                        http_request_duration.labels(method, route_path, str(status_code)).observe(elapsed)
+                        request_query_count.labels(method, route_path).observe(request_metrics.query_count)
+                        request_query_duration.labels(method, route_path).observe(request_metrics.query_seconds)
+                        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+                                self._log_slow_request(scope, status_code, elapsed, request_metrics)
+
+        def _log_slow_request(self, scope, status_code, elapsed, request_metrics):
+                statements = "".join(f"\n  {seconds * 1000:.1f} ms  {' '.join(statement.split())[:SLOW_STATEMENT_MAX_LENGTH]}" for seconds, statement in request_metrics.slowest())
+                slow_request_logger.warning("%s %s %s took %.1f ms, %d queries in %.1f ms%s", scope["method"], scope["path"], status_code, elapsed * 1000,
+                                            request_metrics.query_count, request_metrics.query_seconds * 1000, statements)
@@ -0,0 +1,52 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at, row_id):
+        payload = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+        try:
+                padded = cursor + "=" * (-len(cursor) % 4)
+                created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+                return datetime.fromisoformat(created_at).replace(tzinfo=None), str(row_id)
+        except (ValueError, TypeError, binascii.Error, UnicodeError):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def keyset_paginate(query, model, limit, cursor=None):
+        # Newest first, ties on created_at are broken by id so the order is total and stable between pages. created_at must be
+        # NOT NULL, a NULL neither compares in the cursor filter nor sorts at the same end on every database
+        if cursor:
+                created_at, row_id = decode_cursor(cursor)
+                query = query.filter(or_(model.created_at < created_at, and_(model.created_at == created_at, model.id < row_id)))
+
+        # Fetch one extra row to know whether there is a next page without a COUNT query
+        return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+
+def build_page(rows, limit):
+        if len(rows) <= limit:
+                return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def parse_fields(fields, allowed):
+        if not fields:
+                return None
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in allowed]
+        if unknown:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+        return requested
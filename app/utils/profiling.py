@@ -0,0 +1,90 @@
+import hmac
+import os
+import random
+import re
+from datetime import datetime
+
+from fastapi.concurrency import run_in_threadpool
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+
+def collapsed_stacks(root_frame):
+        # One "outer;...;inner microseconds" line per stack, with the time spent in the innermost frame itself, as read by flamegraph.pl and speedscope
+        lines = []
+
+        def walk(frame, path):
+                path = f"{path};{frame.function} ({frame.file_path_short}:{frame.line_no})" if path else f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+                self_time = frame.time - sum(child.time for child in frame.children)
+                if self_time > 0:
+                        lines.append(f"{path} {round(self_time * 1e6)}")
+                for child in frame.children:
+                        walk(child, path)
+
+        if root_frame is not None:
+                walk(root_frame, "")
+        return "\n".join(lines) + "\n"
+
+
+def write_profile(session, directory, name):
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{name}.speedscope.json"), "w") as file:
+                file.write(SpeedscopeRenderer().render(session))
+        with open(os.path.join(directory, f"{name}.collapsed.txt"), "w") as file:
+                file.write(collapsed_stacks(session.root_frame()))
+
+
+class ProfilerMiddleware:
+        """
+        ASGI middleware running a request under the pyinstrument sampling profiler when the request sends the
+        ``X-Profile`` header with ``admin_token``, or at random for ``sample_rate`` of the requests.
+
+        The profile is written to ``output_dir`` as speedscope JSON and as collapsed stacks once the response is sent, its
+        file name is returned in the ``X-Profile-Id`` response header. One request is profiled at a time per worker, the
+        others run as usual. Requires the optional ``pyinstrument`` package.
+        """
+
+        def __init__(self, app, admin_token=None, sample_rate=0.0, interval_ms=1.0, output_dir="profiles"):
+                from pyinstrument import Profiler
+
+                self.app = app
+                self.admin_token = admin_token.encode() if admin_token else None
+                self.sample_rate = sample_rate
+                self.interval = interval_ms / 1000
+                self.output_dir = output_dir
+                self._profiler_class = Profiler
+                self._busy = False
+
+        def _wants_profile(self, scope):
+                if self.admin_token is not None:
+                        for key, value in scope["headers"]:
+                                if key == PROFILE_HEADER:
+                                        return hmac.compare_digest(value, self.admin_token)
+                return self.sample_rate > 0 and random.random() < self.sample_rate
+
+        async def __call__(self, scope, receive, send):
+                if scope["type"] != "http" or self._busy or not self._wants_profile(scope):
+                        await self.app(scope, receive, send)
+                        return
+
+                slug = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+                name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{scope['method']}-{slug[:80]}"
+
+                async def send_with_profile_id(message):
+                        if message["type"] == "http.response.start":
+                                message["headers"] = [*message.get("headers", []), (PROFILE_ID_HEADER, name.encode())]
+                        await send(message)
+
+                # Only the coroutines of this request are sampled, the other requests on the event loop are left out
+                self._busy = True
+                profiler = self._profiler_class(interval=self.interval, async_mode="enabled")
+                profiler.start()
+                try:
+                        await self.app(scope, receive, send_with_profile_id)
+                finally:
+                        session = profiler.stop()
+                        self._busy = False
+                        await run_in_threadpool(write_profile, session, self.output_dir, name)
@@ -0,0 +1,101 @@
+import hashlib
+from urllib.parse import urlencode
+
+import orjson
+from fastapi import Request, status
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+
+from app.config import settings
+from app.utils.cache import TTLCache, cache_backend
+
+GENERATION_KEY = "responses:generation"
+
+
+def compute_etag(body):
+        # Strong validator: the hash of the canonical JSON body, which changes with the updated_at and images of the cuisines it holds
+        canonical = orjson.dumps(body, option=orjson.OPT_SORT_KEYS)
+        return '"' + hashlib.sha256(canonical).hexdigest()[:32] + '"'
+
+
+class ResponseCache:
+        """
+        Cache of the JSON responses of the cuisine read routes, keyed on the route path and query parameters.
+
+        Entries live in a bounded in-process LRU and, when a shared backend is configured, in the backend as well. Every
+        key includes a generation number that writes bump through ``invalidate``, so a change to any cuisine or image
+        makes all the cached responses unreachable at once. The generation is kept in the shared backend when there is
+        one, so every worker sees the invalidation; otherwise other workers serve their entries for at most ``ttl``.
+        """
+
+        def __init__(self, max_size=10000, ttl=30, backend=None):
+                self.ttl = ttl
+                self.local = TTLCache(max_size=max_size, ttl=ttl)
+                self.backend = backend
+                self._generation = 0
+                self.backend_hits = 0
+                self.misses = 0
+                self.not_modified = 0
+
+        async def _get_generation(self):
+                if self.backend is None:
+                        return self._generation
+                return await self.backend.get(GENERATION_KEY) or 0
+
+        async def key(self, request: Request):
+                query = urlencode(sorted(request.query_params.multi_items()))
+                return f"responses:{await self._get_generation()}:{request.url.path}?{query}"
+
+        async def get(self, key):
+                entry = self.local.get(key)
+                if entry is not None:
+                        return entry
+
+                if self.backend is not None:
+                        entry = await self.backend.get(key)
+                        if entry is not None:
+                                self.backend_hits += 1
+                                self.local.set(key, entry)
+                                return entry
+
+                self.misses += 1
+                return None
+
+        async def store(self, request: Request, key, response: BaseModel):
+                # Same output as the route's response_model, unset (projected out) fields are left out
+                body = response.model_dump(mode="json", exclude_unset=True)
+                entry = {"etag": compute_etag(body), "body": body}
+                self.local.set(key, entry)
+                if self.backend is not None:
+                        await self.backend.set(key, entry, self.ttl)
+                return self.respond(request, entry)
+
+        def respond(self, request: Request, entry):
+                headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+                if_none_match = request.headers.get("if-none-match")
+                if if_none_match:
+                        etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+                        if "*" in etags or entry["etag"] in etags:
+                                self.not_modified += 1
+                                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+                return ORJSONResponse(entry["body"], headers=headers)
+
+        async def invalidate(self):
+                self._generation += 1
+                self.local.clear()
+                if self.backend is not None:
+                        await self.backend.incr(GENERATION_KEY)
+
+        def stats(self):
+                return {
+                        "local": self.local.stats(),
+                        "shared_backend": type(self.backend).__name__ if self.backend is not None else None,
+                        "invalidations": self._generation,
+                        "local_hits": self.local.hits,
+                        "backend_hits": self.backend_hits,
+                        "misses": self.misses,
+                        "not_modified": self.not_modified,
+                }
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_SIZE, settings.RESPONSE_CACHE_TTL_SECONDS, cache_backend)
@@ -0,0 +1,495 @@
+import asyncio
+import fcntl
+import logging
+import math
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+
+from app.config import settings
+from app.utils.tag_model import tag_model_registry
+
+logger = logging.getLogger(__name__)
+
+BUILD_CHUNK_SIZE = 5000
+# Vectors of a segment being written are kept in memory up to this size, then staged on disk
+SEGMENT_SPOOL_SIZE = 16 * 1024 * 1024
+
+# Segment file layout: fixed size header, ids, deletion flags, then the float32 vectors aligned for the memory map.
+# The header holds the magic, format version, vector dimension, row count, updated_at watermark and tag model version.
+SEGMENT_MAGIC = b"CQSI"
+SEGMENT_FORMAT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sHIQ32s64s")
+SEGMENT_HEADER_SIZE = 128
+SEGMENT_ALIGNMENT = 64
+SEGMENT_SUFFIX = ".seg"
+ID_WIDTH = 36
+
+
+def get_search_text(name, description):
+        return f"{name or ''} {description or ''}".strip()
+
+
+def _vectors_offset(rows):
+        offset = SEGMENT_HEADER_SIZE + (ID_WIDTH + 1) * rows
+        return -(-offset // SEGMENT_ALIGNMENT) * SEGMENT_ALIGNMENT
+
+
+class IndexSegment:
+        """
+        One immutable segment file of the search index, memory mapped read-only so its pages live in the OS page cache
+        and are shared by every worker process instead of being copied into each of them.
+        """
+
+        def __init__(self, path):
+                with open(path, "rb") as file:
+                        magic, format_version, dim, rows, watermark, version = SEGMENT_HEADER.unpack(file.read(SEGMENT_HEADER.size))
+                if magic != SEGMENT_MAGIC or format_version != SEGMENT_FORMAT_VERSION:
+                        raise ValueError(f"Unsupported search index segment: {path}")
+                watermark = watermark.rstrip(b"\0").decode("ascii")
+                self.path = path
+                self.dim = dim
+                self.rows = rows
+                self.version = version.rstrip(b"\0").decode("ascii")
+                self.watermark = datetime.fromisoformat(watermark) if watermark else None
+                if rows:
+                        self.ids = np.memmap(path, dtype=f"S{ID_WIDTH}", mode="r", offset=SEGMENT_HEADER_SIZE, shape=(rows,))
+                        self.deleted = np.memmap(path, dtype=np.bool_, mode="r", offset=SEGMENT_HEADER_SIZE + ID_WIDTH * rows, shape=(rows,))
+                        self.vectors = np.memmap(path, dtype=np.float32, mode="r", offset=_vectors_offset(rows), shape=(rows, dim))
+                else:
+                        self.ids = np.zeros(0, dtype=f"S{ID_WIDTH}")
+                        self.deleted = np.zeros(0, dtype=np.bool_)
+                        self.vectors = np.zeros((0, dim), dtype=np.float32)
+
+
+class SegmentWriter:
+        """
+        Writes one segment from chunks of rows added one after the other. The ids come before the vectors in the file, so
+        the vectors are spooled until the row count is known and a build or a merge never holds all of them in memory.
+        """
+
+        def __init__(self, path, version, dim):
+                self.path = path
+                self.version = version
+                self.dim = dim
+                self.rows = 0
+                self._ids = []
+                self._deleted = []
+                self._vectors = tempfile.SpooledTemporaryFile(max_size=SEGMENT_SPOOL_SIZE, dir=os.path.dirname(path))
+
+        def add(self, ids, deleted, vectors):
+                self._ids.append(np.asarray(ids, dtype=f"S{ID_WIDTH}"))
+                self._deleted.append(np.asarray(deleted, dtype=np.bool_))
+                self._vectors.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                self.rows += len(self._ids[-1])
+
+        def commit(self, watermark=None):
+                header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_FORMAT_VERSION, self.dim, self.rows,
+                                             watermark.isoformat().encode("ascii") if watermark else b"", self.version.encode("ascii"))
+                temporary_path = f"{self.path}.tmp"
+                with open(temporary_path, "wb") as file:
+                        file.write(header.ljust(SEGMENT_HEADER_SIZE, b"\0"))
+                        for ids in self._ids:
+                                file.write(ids.tobytes())
+                        for deleted in self._deleted:
+                                file.write(deleted.tobytes())
+                        file.write(b"\0" * (_vectors_offset(self.rows) - file.tell()))
+                        self._vectors.seek(0)
+                        shutil.copyfileobj(self._vectors, file, 1024 * 1024)
+                        file.flush()
+                        os.fsync(file.fileno())
+                self.close()
+                # Readers only ever see complete segments
+                os.replace(temporary_path, self.path)
+
+        def close(self):
+                self._vectors.close()
+
+
+def segment_tier(rows, merge_factor):
+        # Segments of a tier hold between merge_factor ** tier and merge_factor ** (tier + 1) rows
+        return int(math.log(max(rows, 1), merge_factor))
+
+
+def plan_merge(sizes, dead_rows, merge_factor, max_segments):
+        """
+        Size-tiered merge policy. Returns the ``(start, stop)`` range of consecutive segments (in write order, ``sizes`` are
+        their row counts) to merge into one, or None.
+
+        ``merge_factor`` consecutive segments of the same tier are merged into one of the next tier, like the carry of a
+        counter, so a row is rewritten about log(rows) / log(merge_factor) times however the index grew, and a merge only
+        touches segments of similar size. Every segment is rewritten once the replaced and removed rows outnumber the live
+        ones, which they paid for, and the cheapest run is merged when there are more than ``max_segments`` segments.
+        """
+        if len(sizes) < 2:
+                return None
+        if dead_rows * 2 > sum(sizes):
+                return 0, len(sizes)
+
+        # Newest run of the same tier first, it holds the smallest segments
+        tiers = [segment_tier(rows, merge_factor) for rows in sizes]
+        stop = len(tiers)
+        while stop > 0:
+                start = stop - 1
+                while start > 0 and tiers[start - 1] == tiers[stop - 1]:
+                        start -= 1
+                if stop - start >= merge_factor:
+                        return stop - merge_factor, stop
+                stop = start
+
+        if len(sizes) > max_segments:
+                width = min(merge_factor, len(sizes))
+                start = min(range(len(sizes) - width + 1), key=lambda start: sum(sizes[start:start + width]))
+                return start, start + width
+        return None
+
+
+class CuisineSearchIndex:
+        """
+        On-disk vector index of the cuisines for ranked search, shared by the worker processes.
+
+        Each cuisine's name + description is embedded with the TF-IDF vectorizer of the tag model as one L2-normalised
+        float32 row. Rows are stored in append-only segment files under ``directory``, next to the tag model, and every
+        worker memory maps them read-only, so a cold start is a file open and the vectors are held once in the page cache
+        rather than once per worker. A write appends a small segment, a removal appends a tombstone, the newest copy of a
+        cuisine wins. Segments are merged by ``plan_merge`` on a background thread, never in the request that wrote them,
+        and a build or a sync writes a single segment. Segments are tagged with the tag model version and rebuilt from the
+        database when the model changes. Rows written by workers that had no index yet, or outside the app, are indexed by
+        ``sync`` using ``updated_at``.
+        """
+
+        def __init__(self, directory, sync_interval=10.0, max_segments=32, merge_factor=8):
+                self.directory = directory
+                self.sync_interval = sync_interval
+                self.max_segments = max_segments
+                self.merge_factor = merge_factor
+                self.merges = 0
+                self._merge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index-merge")
+                self._merge_scheduled = False
+                self._lock = threading.RLock()
+                self._build_lock = None
+                self._version = None
+                self._last_synced = 0.0
+                self._reset()
+
+        def _reset(self):
+                self._entries = []
+                self._segments = []
+                self._live = []
+                self._offsets = np.zeros(1, dtype=np.int64)
+                self._positions = {}
+
+        @property
+        def ready(self):
+                return self._version is not None and self._version == tag_model_registry.version
+
+        @property
+        def watermark(self):
+                return max((segment.watermark for segment in self._segments if segment.watermark is not None), default=None)
+
+        def embed(self, texts):
+                vectorizer = tag_model_registry.get()['vectorizer']
+                vectors = vectorizer.transform(texts).astype(np.float32).toarray()
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                return vectors / np.maximum(norms, 1e-12)
+
+        def _acquire_file_lock(self, name=".lock", blocking=True):
+                # ".lock" serialises segment writes between worker processes, so segment names follow the write order.
+                # ".merge.lock" serialises the merges, which only replace and remove segments and run alongside the writes
+                os.makedirs(self.directory, exist_ok=True)
+                lock_file = open(os.path.join(self.directory, name), "a")
+                try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                        lock_file.close()
+                        return None
+                return lock_file
+
+        @staticmethod
+        def _release_file_lock(lock_file):
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+        @contextmanager
+        def _file_lock(self):
+                lock_file = self._acquire_file_lock()
+                try:
+                        yield
+                finally:
+                        self._release_file_lock(lock_file)
+
+        @asynccontextmanager
+        async def _async_file_lock(self, name=".lock"):
+                # Held across the database reads of a build or sync, waiting for it does not block the event loop
+                lock_file = await run_in_threadpool(self._acquire_file_lock, name)
+                try:
+                        yield
+                finally:
+                        self._release_file_lock(lock_file)
+
+        def _scan(self):
+                try:
+                        with os.scandir(self.directory) as entries:
+                                return sorted((entry.name, entry.inode()) for entry in entries if entry.name.endswith(SEGMENT_SUFFIX))
+                except FileNotFoundError:
+                        return []
+
+        def refresh(self, version=None):
+                # Map the segments of the given tag model version written since the last refresh, by this or another worker
+                version = version or self._version
+                entries = self._scan()
+                with self._lock:
+                        if version == self._version and entries == self._entries:
+                                return
+                        if version != self._version or entries[:len(self._entries)] != self._entries:
+                                # Segments were merged or the model changed, start over from the files on disk
+                                self._reset()
+                        for entry in entries[len(self._entries):]:
+                                try:
+                                        segment = IndexSegment(os.path.join(self.directory, entry[0]))
+                                except (FileNotFoundError, ValueError):
+                                        # Removed by a concurrent merge, or written by an incompatible version of the app
+                                        continue
+                                if segment.version == version:
+                                        self._apply(segment)
+                        self._entries = entries
+                        self._version = version
+
+        def _apply(self, segment):
+                number = len(self._segments)
+                live = ~np.asarray(segment.deleted)
+                for row, cuisine_id in enumerate(segment.ids.tolist()):
+                        cuisine_id = cuisine_id.decode("ascii")
+                        # The newest copy of a cuisine hides the older ones
+                        previous = self._positions.pop(cuisine_id, None)
+                        if previous is not None:
+                                self._live[previous[0]][previous[1]] = False
+                        if live[row]:
+                                self._positions[cuisine_id] = (number, row)
+                self._segments.append(segment)
+                self._live.append(live)
+                self._offsets = np.append(self._offsets, self._offsets[-1] + segment.rows)
+
+        def _dim(self):
+                return len(tag_model_registry.get()['vectorizer'].vocabulary_)
+
+        def _new_segment(self):
+                path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}")
+                return SegmentWriter(path, self._version, self._dim())
+
+        def _append(self, ids, deleted, vectors):
+                # Caller holds the file lock. Only appends, merging is left to the background thread
+                writer = self._new_segment()
+                writer.add(ids, deleted, vectors)
+                writer.commit()
+                self.refresh()
+                self._schedule_merge()
+
+        def _plan_merge(self):
+                with self._lock:
+                        sizes = [segment.rows for segment in self._segments]
+                        dead_rows = int(self._offsets[-1]) - len(self._positions)
+                return plan_merge(sizes, dead_rows, self.merge_factor, self.max_segments)
+
+        def _schedule_merge(self):
+                if not self._merge_scheduled and self._plan_merge() is not None:
+                        self._merge_scheduled = True
+                        self._merge_executor.submit(self._merge)
+
+        def _merge(self):
+                try:
+                        # A worker already merging also merges the segments written by this one
+                        merge_lock = self._acquire_file_lock(".merge.lock", blocking=False)
+                        if merge_lock is None:
+                                return
+                        try:
+                                self.refresh()
+                                while self.ready and (plan := self._plan_merge()) is not None:
+                                        self._merge_segments(*plan)
+                        finally:
+                                self._release_file_lock(merge_lock)
+                except Exception:
+                        logger.exception("Merging the search index segments in %s failed", self.directory)
+                finally:
+                        self._merge_scheduled = False
+
+        def _merge_segments(self, start, stop):
+                # Caller holds the merge lock. The live rows of the segments start:stop are merged into one file which takes the
+                # place of the newest of them in the write order
+                with self._lock:
+                        segments = self._segments[start:stop]
+                        live = [mask.copy() for mask in self._live[start:stop]]
+                        indexed = set(self._positions)
+                writer = SegmentWriter(segments[-1].path, segments[-1].version, segments[-1].dim)
+                try:
+                        for segment, keep in zip(segments, live):
+                                if start > 0:
+                                        # Tombstones still hide older copies in the segments before the merged ones
+                                        for row in np.flatnonzero(segment.deleted):
+                                                keep[row] = segment.ids[row].decode("ascii") not in indexed
+                                rows = np.flatnonzero(keep)
+                                for chunk in range(0, len(rows), BUILD_CHUNK_SIZE):
+                                        chunk_rows = rows[chunk:chunk + BUILD_CHUNK_SIZE]
+                                        writer.add(segment.ids[chunk_rows], segment.deleted[chunk_rows], segment.vectors[chunk_rows])
+                        writer.commit(max((segment.watermark for segment in segments if segment.watermark is not None), default=None))
+                finally:
+                        writer.close()
+                for segment in segments[:-1]:
+                        try:
+                                os.remove(segment.path)
+                        except FileNotFoundError:
+                                pass
+                self.merges += 1
+                # Workers still mapping the removed files keep reading them until their next refresh
+                self.refresh()
+
+        def upsert_many(self, rows):
+                # rows: iterable of (cuisine_id, search_text)
+                rows = list(rows)
+                if not rows or not self.ready:
+                        return
+                vectors = self.embed([search_text for _, search_text in rows])
+                with self._file_lock():
+                        self._append([cuisine_id for cuisine_id, _ in rows], np.zeros(len(rows), dtype=np.bool_), vectors)
+
+        def upsert(self, cuisine_id, search_text):
+                self.upsert_many([(cuisine_id, search_text)])
+
+        def remove(self, cuisine_id):
+                if not self.ready:
+                        return
+                with self._file_lock():
+                        self._append([cuisine_id], np.ones(1, dtype=np.bool_), np.zeros((1, self._dim()), dtype=np.float32))
+
+        def search(self, query, k, candidate_ids=None):
+                query_vector = self.embed([query])[0]
+                with self._lock:
+                        if candidate_ids is None:
+                                if not self._segments:
+                                        return []
+                                # Score every segment straight from the memory map and mask out the rows replaced or removed since
+                                scores = np.concatenate([segment.vectors @ query_vector for segment in self._segments])
+                                scores[~np.concatenate(self._live)] = -np.inf
+                                positions = None
+                        else:
+                                positions = [self._positions[cuisine_id] for cuisine_id in candidate_ids if cuisine_id in self._positions]
+                                if not positions:
+                                        return []
+                                scores = np.array([self._segments[number].vectors[row] @ query_vector for number, row in positions], dtype=np.float32)
+
+                        # Partial sort: only the k best rows are ordered
+                        if len(scores) > k:
+                                top = np.argpartition(-scores, k)[:k]
+                        else:
+                                top = np.arange(len(scores))
+                        top = top[np.argsort(-scores[top], kind="stable")]
+
+                        matches = []
+                        for index in top:
+                                # Cuisines sharing no term with the query are not matches
+                                if scores[index] <= 0:
+                                        continue
+                                if positions is None:
+                                        number = int(np.searchsorted(self._offsets, index, side="right")) - 1
+                                        row = index - self._offsets[number]
+                                else:
+                                        number, row = positions[index]
+                                matches.append((self._segments[number].ids[row].decode("ascii"), float(scores[index])))
+                        return matches
+
+        async def _load_rows(self, db, model, since=None, always_write=False):
+                # Caller holds the file lock. The rows are written as one segment, oldest first so its watermark covers them all
+                query = select(model.id, model.name, model.description, model.updated_at).order_by(model.updated_at, model.id)
+                if since is not None:
+                        # Inclusive like TextSearchIndex: MySQL DATETIME keeps whole seconds, a row written later in the watermark's second
+                        # has the same updated_at. The rows of that second are indexed again, an upsert of an unchanged row is harmless
+                        query = query.filter(model.updated_at >= since)
+                writer = self._new_segment()
+                watermark = None
+                try:
+                        result = await db.stream(query.execution_options(yield_per=BUILD_CHUNK_SIZE))
+                        async for partition in result.partitions(BUILD_CHUNK_SIZE):
+                                vectors = await run_in_threadpool(self.embed, [get_search_text(row.name, row.description) for row in partition])
+                                await run_in_threadpool(writer.add, [row.id for row in partition], np.zeros(len(partition), dtype=np.bool_), vectors)
+                                watermark = max((row.updated_at for row in partition if row.updated_at is not None), default=watermark)
+                        if writer.rows or always_write:
+                                await run_in_threadpool(writer.commit, watermark)
+                finally:
+                        writer.close()
+                await run_in_threadpool(self.refresh)
+                self._schedule_merge()
+
+        def _remove_stale_segments(self, version):
+                for name, _ in self._scan():
+                        path = os.path.join(self.directory, name)
+                        try:
+                                if IndexSegment(path).version != version:
+                                        os.remove(path)
+                        except (FileNotFoundError, ValueError):
+                                pass
+
+        def open(self):
+                # Map the segments already on disk for the current tag model, the index stays not ready when there are none
+                self.refresh(tag_model_registry.version)
+                if not self._segments:
+                        self._version = None
+
+        async def build(self, db, model):
+                async with self._async_file_lock():
+                        # Another worker may have built the index while we were waiting for the lock
+                        await run_in_threadpool(self.open)
+                        if not self._segments:
+                                version = tag_model_registry.version
+                                # A merge still running on the segments of the previous model would put one of them back
+                                async with self._async_file_lock(".merge.lock"):
+                                        await run_in_threadpool(self._remove_stale_segments, version)
+                                with self._lock:
+                                        self._reset()
+                                        self._version = version
+                                try:
+                                        # Nothing is merged while building, the table is written as one segment. Even an empty
+                                        # one, it marks the index of an empty table as built for the other workers
+                                        await self._load_rows(db, model, always_write=True)
+                                except Exception:
+                                        self._version = None
+                                        raise
+                self._last_synced = time.monotonic()
+
+        async def sync(self, db, model):
+                async with self._async_file_lock():
+                        # Map the segments written by the other workers, then index the rows written since the watermark
+                        await run_in_threadpool(self.refresh)
+                        await self._load_rows(db, model, since=self.watermark)
+                self._last_synced = time.monotonic()
+
+        async def ensure_ready(self, db, model):
+                if self._build_lock is None:
+                        self._build_lock = asyncio.Lock()
+                async with self._build_lock:
+                        if not self.ready:
+                                # No index on disk yet, or the tag model was reloaded with a different vocabulary
+                                await self.build(db, model)
+                        elif time.monotonic() - self._last_synced >= self.sync_interval:
+                                await self.sync(db, model)
+
+        def stats(self):
+                with self._lock:
+                        watermark = self.watermark
+                        return {"ready": self.ready, "directory": self.directory, "rows": len(self._positions), "segments": len(self._segments),
+                                "segment_rows": int(self._offsets[-1]), "dim": self._segments[0].dim if self._segments else 0,
+                                "merges": self.merges, "merging": self._merge_scheduled, "watermark": watermark.isoformat() if watermark else None}
+
+
+cuisine_search_index = CuisineSearchIndex(settings.SEARCH_INDEX_DIR or os.path.join(os.path.dirname(settings.TAG_MODEL_PATH), "cuisine_search_index"),
+                                          settings.SEARCH_INDEX_SYNC_INTERVAL, settings.SEARCH_INDEX_MAX_SEGMENTS,
+                                          settings.SEARCH_INDEX_MERGE_FACTOR)
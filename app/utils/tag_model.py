@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.utils.cache import TTLCache, cache_backend
+from app.utils.metrics import tag_prediction_duration
+
+
+class TagModelRegistry:
+        """
+        Process wide holder of the tag generation artifact (TF-IDF vectorizer + one model per tag).
+
+        The artifact is loaded once, either eagerly through ``load()`` at startup or lazily on the first prediction, and
+        is shared read-only by every request. The file's mtime is checked at most once every ``reload_interval`` seconds
+        and the artifact is reloaded only when its content hash changes.
+        """
+
+        def __init__(self, path, reload_interval=5.0):
+                self.path = path
+                self.reload_interval = reload_interval
+                self._lock = threading.Lock()
+                self._artifact = None
+                self._mtime = None
+                self._version = None
+                self._last_checked = 0.0
+
+                # Stats
+                self.load_count = 0
+                self.last_load_seconds = None
+                self.loaded_at = None
+                self.batch_count = 0
+                self.prediction_count = 0
+                self.prediction_seconds_total = 0.0
+                self.last_prediction_seconds = None
+
+        @staticmethod
+        def _hash_file(path):
+                digest = hashlib.sha256()
+                with open(path, "rb") as file:
+                        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                                digest.update(chunk)
+                return digest.hexdigest()
+
+        def load(self):
+                with self._lock:
+                        return self._load()
+
+        def _load(self):
+                started = time.perf_counter()
+                mtime = os.stat(self.path).st_mtime
+                version = self._hash_file(self.path)
+                if self._artifact is None or version != self._version:
+                        # joblib (and scikit-learn through the pickle) is imported with the first artifact, not with the app
+                        import joblib
+
+                        self._artifact = joblib.load(self.path)
+                        self._version = version
+                        self.load_count += 1
+                        self.last_load_seconds = time.perf_counter() - started
+                        self.loaded_at = time.time()
+                self._mtime = mtime
+                self._last_checked = time.monotonic()
+                return self._artifact
+
+        def get(self):
+                # Fast path: artifact is loaded and the mtime check is not due yet
+                artifact = self._artifact
+                if artifact is not None and time.monotonic() - self._last_checked < self.reload_interval:
+                        return artifact
+
+                with self._lock:
+                        if self._artifact is None:
+                                return self._load()
+                        try:
+                                mtime = os.stat(self.path).st_mtime
+                        except FileNotFoundError:
+                                # Keep serving the artifact we already have if the file is being replaced
+                                self._last_checked = time.monotonic()
+                                return self._artifact
+                        if mtime != self._mtime:
+                                return self._load()
+                        self._last_checked = time.monotonic()
+                        return self._artifact
+
+        @property
+        def version(self):
+                if self._version is None:
+                        self.get()
+                return self._version
+
+        def predict(self, description: str):
+                return self.predict_batch([description])[0]
+
+        def predict_batch(self, descriptions):
+                if not descriptions:
+                        return []
+                artifact = self.get()
+                started = time.perf_counter()
+
+                # Convert all the descriptions to a single sparse TF-IDF matrix
+                tfidf_vectorizer = artifact['vectorizer']
+                models = artifact['models']
+                descriptions_tfidf = tfidf_vectorizer.transform(descriptions)
+
+                # Run each tag model once over the whole matrix
+                predictions_dict_list = [{} for _ in descriptions]
+                for tag, model in models.items():
+                        tag_predictions = model.predict(descriptions_tfidf)
+                        for predictions_dict, tag_prediction in zip(predictions_dict_list, tag_predictions):
+                                predictions_dict[tag] = tag_prediction
+
+                self._record_prediction(time.perf_counter() - started, len(descriptions))
+                return predictions_dict_list
+
+        def _record_prediction(self, elapsed, batch_size):
+                tag_prediction_duration.labels().observe(elapsed)
+                self.batch_count += 1
+                self.prediction_count += batch_size
+                self.prediction_seconds_total += elapsed
+                self.last_prediction_seconds = elapsed
+
+        def stats(self):
+                return {
+                        "path": self.path,
+                        "loaded": self._artifact is not None,
+                        "version": self._version,
+                        "load_count": self.load_count,
+                        "last_load_seconds": self.last_load_seconds,
+                        "loaded_at": self.loaded_at,
+                        "batch_count": self.batch_count,
+                        "prediction_count": self.prediction_count,
+                        "prediction_seconds_total": self.prediction_seconds_total,
+                        "batch_seconds_avg": self.prediction_seconds_total / self.batch_count if self.batch_count else None,
+                        "last_prediction_seconds": self.last_prediction_seconds,
+                }
+
+
+class TagPredictionBatcher:
+        """
+        Micro-batching queue in front of ``TagModelRegistry.predict_batch``.
+
+        Descriptions submitted from concurrent requests within ``max_wait_ms`` of each other are predicted together in a
+        single call, run in the thread pool so the event loop is not blocked. A batch is flushed early once it reaches
+        ``max_batch_size``.
+        """
+
+        def __init__(self, registry, max_batch_size=64, max_wait_ms=5.0):
+                self.registry = registry
+                self.max_batch_size = max_batch_size
+                self.max_wait = max_wait_ms / 1000
+                self._loop = None
+                self._pending = []
+                self._timer = None
+                self._tasks = set()
+
+        async def predict(self, description: str):
+                loop = asyncio.get_running_loop()
+                if loop is not self._loop:
+                        # Pending work belongs to the loop it was queued on, start over on a new loop
+                        self._loop = loop
+                        self._pending = []
+                        self._timer = None
+
+                future = loop.create_future()
+                self._pending.append((description, future))
+                if len(self._pending) >= self.max_batch_size:
+                        self._flush()
+                elif self._timer is None:
+                        self._timer = loop.call_later(self.max_wait, self._flush)
+                return await future
+
+        def _flush(self):
+                if self._timer is not None:
+                        self._timer.cancel()
+                        self._timer = None
+                batch, self._pending = self._pending, []
+                if batch:
+                        # Keep a reference so the task is not garbage collected while it runs
+                        task = self._loop.create_task(self._run(batch))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+
+        async def _run(self, batch):
+                try:
+                        results = await run_in_threadpool(self.registry.predict_batch, [description for description, _ in batch])
+                except Exception as error:
+                        for _, future in batch:
+                                if not future.done():
+                                        future.set_exception(error)
+                        return
+                for (_, future), result in zip(batch, results):
+                        if not future.done():
+                                future.set_result(result)
+
+
+class PromptTagCache:
+        """
+        Cache of predicted tags keyed on the normalised prompt text, in front of the tag prediction batcher.
+
+        Entries live in a bounded in-process LRU and, when a shared backend is configured, in the backend as well so
+        every worker benefits from a prediction made by any of them. Keys include the model artifact version, so a hot
+        reloaded model never serves tags predicted by the previous one.
+        """
+
+        def __init__(self, batcher, max_size=10000, ttl=3600, backend=None):
+                self.batcher = batcher
+                self.ttl = ttl
+                self.local = TTLCache(max_size=max_size, ttl=ttl)
+                self.backend = backend
+                self.backend_hits = 0
+                self.misses = 0
+
+        @staticmethod
+        def normalize(prompt: str):
+                return " ".join(prompt.lower().split())
+
+        def _key(self, prompt: str):
+                return f"tags:{self.batcher.registry.version}:{self.normalize(prompt)}"
+
+        async def get_tags(self, prompt: str):
+                key = self._key(prompt)
+                tags = self.local.get(key)
+                if tags is not None:
+                        return tags
+
+                if self.backend is not None:
+                        tags = await self.backend.get(key)
+                        if tags is not None:
+                                self.backend_hits += 1
+                                self.local.set(key, tags)
+                                return tags
+
+                self.misses += 1
+                tags = await self.batcher.predict(self.normalize(prompt))
+                self.local.set(key, tags)
+                if self.backend is not None:
+                        await self.backend.set(key, tags, self.ttl)
+                return tags
+
+        def clear(self):
+                self.local.clear()
+
+        def stats(self):
+                return {
+                        "local": self.local.stats(),
+                        "shared_backend": type(self.backend).__name__ if self.backend is not None else None,
+                        "local_hits": self.local.hits,
+                        "backend_hits": self.backend_hits,
+                        "misses": self.misses,
+                }
+
+
+tag_model_registry = TagModelRegistry(settings.TAG_MODEL_PATH, settings.TAG_MODEL_RELOAD_INTERVAL)
+tag_prediction_batcher = TagPredictionBatcher(tag_model_registry, settings.TAG_BATCH_MAX_SIZE, settings.TAG_BATCH_MAX_WAIT_MS)
+prompt_tag_cache = PromptTagCache(tag_prediction_batcher, settings.TAG_CACHE_MAX_SIZE, settings.TAG_CACHE_TTL_SECONDS, cache_backend)
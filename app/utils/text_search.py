@@ -0,0 +1,230 @@
+import asyncio
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+
+from app.config import settings
+
+BUILD_CHUNK_SIZE = 5000
+# Words from the name weigh more than the ones from the description, people mostly search restaurants by name
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+PREFIX_SCORE = 0.7
+TYPO_SCORE = 0.5
+# Most frequent completions kept per prefix, so a one or two letter prefix does not expand to the whole vocabulary
+MAX_PREFIX_EXPANSIONS = 50
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+        return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def trigrams(token):
+        padded = f"^{token}$"
+        return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def allowed_typos(term):
+        if len(term) < 4:
+                return 0
+        return 1 if len(term) < 8 else 2
+
+
+def edit_distance(source, target, max_distance):
+        # Optimal string alignment distance (adjacent transpositions count as one edit), gives up above max_distance
+        if abs(len(source) - len(target)) > max_distance:
+                return max_distance + 1
+        previous_previous, previous = None, list(range(len(target) + 1))
+        for i, source_char in enumerate(source, 1):
+                current = [i] + [0] * len(target)
+                for j, target_char in enumerate(target, 1):
+                        cost = source_char != target_char
+                        current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+                        if i > 1 and j > 1 and source_char == target[j - 2] and source[i - 2] == target_char:
+                                current[j] = min(current[j], previous_previous[j - 2] + 1)
+                if min(current) > max_distance:
+                        return max_distance + 1
+                previous_previous, previous = previous, current
+        return previous[-1]
+
+
+class CuisineTextIndex:
+        """
+        In-process inverted index over the cuisine name and description, used for ``q=`` search when the database has no
+        FULLTEXT support (SQLite in tests and local development). MySQL uses its FULLTEXT ngram index instead.
+
+        Every query word matches the indexed words that are equal to it, start with it, or are within one or two edits of
+        it (found through a trigram index of the vocabulary). A cuisine must match all the query words and is scored by
+        the inverse document frequency of the words it matched, weighted by field and by match quality. Rows written by
+        other worker processes are picked up by ``sync`` using ``updated_at``.
+        """
+
+        def __init__(self, sync_interval=10.0):
+                self.sync_interval = sync_interval
+                self._lock = threading.RLock()
+                self._build_lock = None
+                self._ready = False
+                self._postings = {}
+                self._documents = {}
+                self._vocabulary = []
+                self._trigrams = {}
+                self._watermark = None
+                self._last_synced = 0.0
+
+        @property
+        def ready(self):
+                return self._ready
+
+        def _add_token(self, token):
+                bisect.insort(self._vocabulary, token)
+                for trigram in trigrams(token):
+                        self._trigrams.setdefault(trigram, set()).add(token)
+
+        def _remove_token(self, token):
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+                for trigram in trigrams(token):
+                        tokens = self._trigrams[trigram]
+                        tokens.discard(token)
+                        if not tokens:
+                                del self._trigrams[trigram]
+
+        def _remove_document(self, cuisine_id):
+                for token in self._documents.pop(cuisine_id, ()):
+                        postings = self._postings[token]
+                        postings.pop(cuisine_id, None)
+                        if not postings:
+                                self._remove_token(token)
+
+        def upsert_many(self, rows):
+                # rows: iterable of (cuisine_id, name, description)
+                if not self._ready:
+                        return
+                with self._lock:
+                        for cuisine_id, name, description in rows:
+                                self._remove_document(cuisine_id)
+                                weights = dict.fromkeys(tokenize(description), DESCRIPTION_WEIGHT)
+                                weights.update(dict.fromkeys(tokenize(name), NAME_WEIGHT))
+                                for token, weight in weights.items():
+                                        if token not in self._postings:
+                                                self._postings[token] = {}
+                                                self._add_token(token)
+                                        self._postings[token][cuisine_id] = weight
+                                self._documents[cuisine_id] = set(weights)
+
+        def upsert(self, cuisine_id, name, description):
+                self.upsert_many([(cuisine_id, name, description)])
+
+        def remove(self, cuisine_id):
+                with self._lock:
+                        self._remove_document(cuisine_id)
+
+        def _expand(self, term):
+                # Indexed words matching the query word, with the quality of the match
+                expansions = {}
+                if term in self._postings:
+                        expansions[term] = 1.0
+
+                start = bisect.bisect_left(self._vocabulary, term)
+                end = bisect.bisect_left(self._vocabulary, term + "\uffff", start)
+                completions = heapq.nlargest(MAX_PREFIX_EXPANSIONS, self._vocabulary[start:end], key=lambda token: len(self._postings[token]))
+                for token in completions:
+                        expansions.setdefault(token, PREFIX_SCORE)
+
+                typos = allowed_typos(term)
+                if typos:
+                        # Words within `typos` edits share all but at most 3 trigrams per edit with the query word
+                        term_trigrams = trigrams(term)
+                        shared = Counter(token for trigram in term_trigrams for token in self._trigrams.get(trigram, ()))
+                        minimum = max(1, len(term_trigrams) - 3 * typos)
+                        for token, count in shared.items():
+                                if count >= minimum and token not in expansions:
+                                        distance = edit_distance(term, token, typos)
+                                        if distance <= typos:
+                                                expansions[token] = TYPO_SCORE / distance
+                return expansions
+
+        def search(self, query, k, candidate_ids=None):
+                terms = list(dict.fromkeys(tokenize(query)))
+                if not terms:
+                        return []
+                candidates = set(candidate_ids) if candidate_ids is not None else None
+                with self._lock:
+                        document_count = max(len(self._documents), 1)
+                        scores = None
+                        for term in terms:
+                                term_scores = {}
+                                for token, quality in self._expand(term).items():
+                                        postings = self._postings[token]
+                                        idf = math.log(1 + document_count / len(postings))
+                                        for cuisine_id, weight in postings.items():
+                                                if candidates is not None and cuisine_id not in candidates:
+                                                        continue
+                                                score = quality * weight * idf
+                                                if score > term_scores.get(cuisine_id, 0.0):
+                                                        term_scores[cuisine_id] = score
+
+                                # Every query word has to match
+                                if scores is None:
+                                        scores = term_scores
+                                else:
+                                        scores = {cuisine_id: score + term_scores[cuisine_id] for cuisine_id, score in scores.items() if cuisine_id in term_scores}
+                                if not scores:
+                                        return []
+                        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+        def _track_watermark(self, updated_at):
+                if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                        self._watermark = updated_at
+
+        async def _load_rows(self, db, model, since=None):
+                query = select(model.id, model.name, model.description, model.updated_at)
+                if since is not None:
+                        query = query.filter(model.updated_at >= since)
+                result = await db.stream(query.execution_options(yield_per=BUILD_CHUNK_SIZE))
+                async for partition in result.partitions(BUILD_CHUNK_SIZE):
+                        await run_in_threadpool(self.upsert_many, [(row.id, row.name, row.description) for row in partition])
+                        for row in partition:
+                                self._track_watermark(row.updated_at)
+
+        async def build(self, db, model):
+                with self._lock:
+                        self._postings, self._documents, self._vocabulary, self._trigrams = {}, {}, [], {}
+                        self._watermark = None
+                        self._ready = True
+                try:
+                        await self._load_rows(db, model)
+                except Exception:
+                        self._ready = False
+                        raise
+                self._last_synced = time.monotonic()
+
+        async def sync(self, db, model):
+                # Pick up rows written by other worker processes since the last build or sync
+                await self._load_rows(db, model, since=self._watermark)
+                self._last_synced = time.monotonic()
+
+        async def ensure_ready(self, db, model):
+                if self._build_lock is None:
+                        self._build_lock = asyncio.Lock()
+                async with self._build_lock:
+                        if not self._ready:
+                                await self.build(db, model)
+                        elif time.monotonic() - self._last_synced >= self.sync_interval:
+                                await self.sync(db, model)
+
+        def stats(self):
+                return {"ready": self._ready, "documents": len(self._documents), "words": len(self._vocabulary), "trigrams": len(self._trigrams),
+                        "watermark": self._watermark.isoformat() if self._watermark else None}
+
+
+cuisine_text_index = CuisineTextIndex(settings.SEARCH_INDEX_SYNC_INTERVAL)
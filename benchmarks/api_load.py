@@ -0,0 +1,420 @@
+"""
+Load test of the API hot paths. Seeds a database with synthetic users, cuisines and images, drives the routes
+concurrently through an in-process ASGI client and reports, per scenario, the latency percentiles, the throughput and
+the number of database statements per request.
+
+        reads:   latest page (cached), tag search, ranked search, text search, proximity search, cuisine details (cold
+                 and cached), my-cuisines, OTP QR code
+        writes:  add cuisine, add image, delete cuisine (the cuisines added by the run are deleted again)
+
+S3 is answered from memory behind the real boto3 client, and the tag model is replaced by a stand-in artifact with the
+same layout (a TF-IDF vectorizer and one classifier per tag), so only the API itself is measured. --real-tag-model uses
+the artifact at TAG_MODEL_PATH instead.
+
+Usage:
+        python -m benchmarks.api_load --rows 1000
+        python -m benchmarks.api_load --rows 1000 100000 1000000 --output results.json
+        python -m benchmarks.api_load --rows 1000 --update-baseline
+
+Every scale gets its own SQLite file in the temp directory, seeded once and reused while its row count matches and it has
+every table, column and index of the models (pass --database-url to run a single scale against MySQL). The results are
+compared against benchmarks/api_baseline.json and the exit status is 1 when a scenario is slower, or runs more queries,
+than its baseline beyond --tolerance. The first failed response of a scenario is printed with its error count.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "api_baseline.json")
+ADDED_NAME_PREFIX = "api load"
+DESCRIPTION_WORDS = [
+        "spicy", "mild", "smoky", "grilled", "fried", "steamed", "roasted", "tandoori", "curry", "noodles", "ramen", "sushi", "dumplings", "pasta", "pizza",
+        "risotto", "tacos", "burrito", "biryani", "kebab", "paneer", "tofu", "chicken", "lamb", "seafood", "prawns", "vegan", "vegetarian", "gluten-free",
+        "dessert", "chocolate", "coffee", "tea", "rooftop", "cozy", "family", "romantic", "buffet", "street", "brunch", "wine", "cocktails", "garden", "fusion",
+]
+SCENARIOS = ["latest page (cached)", "tag search", "ranked search", "text search", "proximity search", "cuisine details", "cuisine details (cached)",
+             "my-cuisines", "otp qr code", "add cuisine", "add image", "delete cuisine"]
+
+
+def describe(rng, index):
+        return " ".join(rng.sample(DESCRIPTION_WORDS, 8))
+
+
+def build_stub_tag_model(path):
+        # Same layout as the real artifact, the classifiers pick uniformly among the values seen in the seeded rows
+        import joblib
+        from sklearn.dummy import DummyClassifier
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        from benchmarks.query_plans import TAG_VALUES
+
+        vectorizer = TfidfVectorizer().fit(DESCRIPTION_WORDS)
+        models = {tag: DummyClassifier(strategy="uniform", random_state=0).fit(vectorizer.transform(DESCRIPTION_WORDS[:len(values)]), values)
+                  for tag, values in TAG_VALUES.items()}
+        joblib.dump({"vectorizer": vectorizer, "models": models}, path)
+
+
+class _ResponseBody(io.BytesIO):
+        def stream(self, **kwargs):
+                yield self.getvalue()
+
+
+class InMemoryS3:
+        """
+        Answers the S3 calls of a boto3 client from memory. The request is intercepted right before it would be sent, so
+        parameter validation, signing, response parsing and the S3 latency metrics all still run.
+        """
+
+        def __init__(self, latency_ms=0.0):
+                self.latency = latency_ms / 1000
+                self.objects = {}
+                self._lock = threading.Lock()
+
+        def install(self, client):
+                client.meta.events.register_first("before-send.s3", self.handle)
+
+        def handle(self, request, **kwargs):
+                from botocore.awsrequest import AWSResponse
+
+                if self.latency:
+                        time.sleep(self.latency)
+                url = urlsplit(request.url)
+                key = url.netloc + url.path
+                if request.method == "PUT":
+                        body = request.body.read() if hasattr(request.body, "read") else request.body
+                        with self._lock:
+                                self.objects[key] = (bytes(body or b""), request.headers.get("Content-Type", "binary/octet-stream"))
+                        return AWSResponse(request.url, 200, {"ETag": '"in-memory"'}, _ResponseBody())
+                if request.method == "DELETE":
+                        with self._lock:
+                                self.objects.pop(key, None)
+                        return AWSResponse(request.url, 204, {}, _ResponseBody())
+
+                stored = self.objects.get(key)
+                if stored is None:
+                        body = b"" if request.method == "HEAD" else b"<Error><Code>NoSuchKey</Code><Message>Not found</Message></Error>"
+                        return AWSResponse(request.url, 404, {}, _ResponseBody(body))
+                data, content_type = stored
+                status_code = 200
+                byte_range = request.headers.get("Range")
+                if byte_range:
+                        start, end = byte_range.removeprefix("bytes=").split("-")
+                        data, status_code = data[int(start):int(end) + 1], 206
+                headers = {"Content-Length": str(len(data)), "Content-Type": content_type}
+                return AWSResponse(request.url, status_code, headers, _ResponseBody(b"" if request.method == "HEAD" else data))
+
+
+def make_png():
+        from PIL import Image
+
+        output = io.BytesIO()
+        Image.new("RGB", (640, 480), (200, 80, 40)).save(output, "PNG")
+        return output.getvalue()
+
+
+def percentile(sorted_values, percent):
+        # Nearest rank
+        return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+def build_scenarios(context):
+        """
+        Maps every scenario to (method, route template, request factory). The route template is the label the metrics
+        middleware counts the queries of the scenario under, the factory returns the url and the httpx arguments.
+        """
+        cuisine_ids, phone_numbers = context["cuisine_ids"], context["phone_numbers"]
+        added_ids, image = context["added_ids"], context["image"]
+
+        def prompt(rng):
+                return " ".join(rng.sample(DESCRIPTION_WORDS, 3))
+
+        def add_cuisine(rng):
+                details = {"name": f"{ADDED_NAME_PREFIX} {rng.randrange(10 ** 9)}", "description": prompt(rng), "latitude": "19.0760", "longitude": "72.8777"}
+                return "/cuisine-crud/add-cuisine", {"data": {"cuisine_details": json.dumps(details)}, "files": {"images": ("dish.png", image, "image/png")}}
+
+        return {
+                "latest page (cached)": ("GET", "/cuisine-crud/", lambda rng: ("/cuisine-crud/", {"params": {"limit": 50}})),
+                "tag search": ("GET", "/cuisine-crud/", lambda rng: ("/cuisine-crud/", {"params": {"prompt": prompt(rng), "limit": 50}})),
+                "ranked search": ("GET", "/cuisine-crud/", lambda rng: ("/cuisine-crud/", {"params": {"prompt": prompt(rng), "mode": "ranked", "limit": 50}})),
+                "text search": ("GET", "/cuisine-crud/", lambda rng: ("/cuisine-crud/", {"params": {"q": " ".join(rng.sample(DESCRIPTION_WORDS, 2)), "limit": 50}})),
+                "proximity search": ("GET", "/cuisine-crud/", lambda rng: ("/cuisine-crud/", {"params": {"near": f"{rng.uniform(8, 32):.4f},{rng.uniform(68, 92):.4f}", "radius_km": 50,
+                                                                                                          "limit": 50}})),
+                "cuisine details": ("GET", "/cuisine-crud/{cuisine_id}", lambda rng: (f"/cuisine-crud/{rng.choice(cuisine_ids)}", {})),
+                "cuisine details (cached)": ("GET", "/cuisine-crud/{cuisine_id}", lambda rng: (f"/cuisine-crud/{cuisine_ids[0]}", {})),
+                "my-cuisines": ("GET", "/cuisine-crud/my-cuisines", lambda rng: ("/cuisine-crud/my-cuisines", {"params": {"limit": 50}})),
+                "otp qr code": ("GET", "/user-authentication/otp", lambda rng: ("/user-authentication/otp", {"params": {"phone_number": rng.choice(phone_numbers)}})),
+                "add cuisine": ("POST", "/cuisine-crud/add-cuisine", add_cuisine),
+                "add image": ("POST", "/cuisine-crud/add-images/{cuisine_id}", lambda rng: (f"/cuisine-crud/add-images/{rng.choice(added_ids)}",
+                                                                                           {"files": {"image": ("dish.png", image, "image/png")}})),
+                "delete cuisine": ("DELETE", "/cuisine-crud/delete-cuisine/{cuisine_id}", lambda rng: (f"/cuisine-crud/delete-cuisine/{added_ids.pop()}", {})),
+        }
+
+
+async def run_scenario(client, method, build_request, requests, concurrency, rng):
+        timings, errors, first_error = [], 0, None
+        remaining = iter(range(requests))
+
+        async def worker():
+                nonlocal errors, first_error
+                for _ in remaining:
+                        url, kwargs = build_request(rng)
+                        started = time.perf_counter()
+                        response = await client.request(method, url, **kwargs)
+                        timings.append(time.perf_counter() - started)
+                        if response.status_code >= 400:
+                                errors += 1
+                                first_error = first_error or f"{response.status_code} {method} {url}: {response.text[:200]}"
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return sorted(timings), errors, first_error, time.perf_counter() - started
+
+
+async def load_context(rows):
+        from sqlalchemy import delete, func, select
+
+        from app.database import AsyncSessionLocal
+        from app.models.cuisine_details import CuisineDetails
+        from app.models.users import Users
+
+        async with AsyncSessionLocal() as db:
+                # Cuisines left behind by an interrupted run
+                await db.execute(delete(CuisineDetails).where(CuisineDetails.name.startswith(ADDED_NAME_PREFIX)))
+                await db.commit()
+                cuisine_ids = (await db.execute(select(CuisineDetails.id).order_by(CuisineDetails.id).limit(1000))).scalars().all()
+                owner_id = (await db.execute(select(CuisineDetails.user_id).where(CuisineDetails.id == cuisine_ids[0]))).scalar_one()
+                owner = await Users.get_user_by_ID(db, owner_id)
+                phone_numbers = (await db.execute(select(Users.phone_number).order_by(func.random()).limit(1000))).scalars().all()
+                token = await Users.generate_access_token(db, owner.phone_number)
+        return {"cuisine_ids": cuisine_ids, "phone_numbers": phone_numbers, "token": token, "added_ids": [], "image": make_png()}
+
+
+async def load_added_ids(context):
+        from sqlalchemy import select
+
+        from app.database import AsyncSessionLocal
+        from app.models.cuisine_details import CuisineDetails
+
+        async with AsyncSessionLocal() as db:
+                context["added_ids"][:] = (await db.execute(select(CuisineDetails.id).where(CuisineDetails.name.startswith(ADDED_NAME_PREFIX)))).scalars().all()
+
+
+async def run_load(args, scenario_names):
+        import httpx
+
+        import main
+        from app.utils.helper_functions import get_s3_client
+        from app.utils.metrics import request_query_count
+
+        InMemoryS3(args.s3_latency_ms).install(get_s3_client())
+        context = await load_context(args.rows[0])
+        scenarios = build_scenarios(context)
+        rng = random.Random(args.seed)
+        results = {}
+
+        async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", headers={"token": context["token"]}, timeout=None) as client:
+                        for name in scenario_names:
+                                method, route, build_request = scenarios[name]
+                                if name == "add image" or name == "delete cuisine":
+                                        await load_added_ids(context)
+                                        if not context["added_ids"]:
+                                                continue
+                                # Every cuisine the run added is deleted, the other scenarios warm up first (search indexes, caches, pools)
+                                requests = len(context["added_ids"]) if name == "delete cuisine" else args.requests
+                                if name != "delete cuisine" and args.warmup:
+                                        await run_scenario(client, method, build_request, args.warmup, args.concurrency, rng)
+
+                                queries_before = request_query_count.labels(method, route).snapshot()
+                                timings, errors, first_error, elapsed = await run_scenario(client, method, build_request, requests, args.concurrency, rng)
+                                queries_after = request_query_count.labels(method, route).snapshot()
+                                counted = queries_after["count"] - queries_before["count"]
+                                results[name] = {
+                                        "requests": len(timings),
+                                        "errors": errors,
+                                        "first_error": first_error,
+                                        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+                                        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+                                        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+                                        "throughput_rps": round(len(timings) / elapsed, 1),
+                                        "queries_per_request": round((queries_after["sum"] - queries_before["sum"]) / counted, 2) if counted else None,
+                                }
+        return results
+
+
+def configure_environment(args):
+        # app.config reads the environment when first imported, everything below imports the app only after this
+        rows = args.rows[0]
+        work_dir = os.path.join(tempfile.gettempdir(), "cuisineiq_api_load")
+        os.makedirs(work_dir, exist_ok=True)
+        database_url = args.database_url or f"sqlite:///{os.path.join(work_dir, f'cuisines_{rows}.db')}"
+        os.environ["DATABASE_URL"] = database_url
+        os.environ["SEARCH_INDEX_DIR"] = os.path.join(work_dir, f"search_index_{rows}")
+        for key in ("S3_BUCKET", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+                os.environ.setdefault(key, "benchmark")
+        os.environ.setdefault("SECRET_KEY", "BENCHMARKBENCHMARKBENCHMARKBENCHMARK")
+        if not args.real_tag_model:
+                os.environ["TAG_MODEL_PATH"] = os.path.join(work_dir, "stub_tag_model.joblib")
+                build_stub_tag_model(os.environ["TAG_MODEL_PATH"])
+        return database_url
+
+
+def missing_schema(connection):
+        # Tables, columns and indexes of the models that a database seeded by an older version of the app lacks
+        from sqlalchemy import inspect
+
+        from app.database import Base
+
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+        missing = []
+        for table in Base.metadata.sorted_tables:
+                if table.name not in tables:
+                        missing.append(table.name)
+                        continue
+                columns = {column["name"] for column in inspector.get_columns(table.name)}
+                indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+                missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+                missing += [f"{table.name}.{index.name}" for index in table.indexes if index.name not in indexes]
+        return missing
+
+
+def seed_database(args, database_url):
+        from sqlalchemy import create_engine, func, select
+
+        from app.models.cuisine_details import CuisineDetails
+        from benchmarks.query_plans import create_secondary_indexes, seed
+
+        rows = args.rows[0]
+        engine = create_engine(database_url)
+        with engine.connect() as connection:
+                missing = missing_schema(connection)
+                existing_rows = connection.execute(select(func.count()).select_from(CuisineDetails.__table__)).scalar_one() if "cuisine_details" not in missing else None
+        if missing and existing_rows is not None:
+                print(f"reseeding, the database predates the current schema (missing {', '.join(missing)})", file=sys.stderr)
+        if args.reseed or missing or existing_rows != rows:
+                # The search index on disk belongs to the previous data
+                shutil.rmtree(os.environ["SEARCH_INDEX_DIR"], ignore_errors=True)
+                seed(engine, rows, args.images_per_cuisine, min(args.users, rows), describe=describe)
+                create_secondary_indexes(engine)
+        engine.dispose()
+        return engine.dialect.name
+
+
+def run_scale(args):
+        database_url = configure_environment(args)
+        dialect = seed_database(args, database_url)
+        scenario_names = [name for name in SCENARIOS if not args.scenarios or name in args.scenarios]
+        scenarios = asyncio.run(run_load(args, scenario_names))
+        return {"database": dialect, "concurrency": args.concurrency, "scenarios": scenarios}
+
+
+def run_scales_in_subprocesses(args):
+        # The app binds its engines to DATABASE_URL on import, so each scale runs in a fresh interpreter
+        results = {}
+        forwarded = ["--requests", str(args.requests), "--concurrency", str(args.concurrency), "--warmup", str(args.warmup), "--images-per-cuisine", str(args.images_per_cuisine),
+                     "--users", str(args.users), "--s3-latency-ms", str(args.s3_latency_ms), "--seed", str(args.seed), "--no-compare"]
+        forwarded += ["--real-tag-model"] * args.real_tag_model + ["--reseed"] * args.reseed
+        if args.scenarios:
+                forwarded += ["--scenarios", *args.scenarios]
+        for rows in args.rows:
+                with tempfile.NamedTemporaryFile(suffix=".json") as output:
+                        subprocess.run([sys.executable, "-m", "benchmarks.api_load", "--rows", str(rows), "--output", output.name, *forwarded], check=True)
+                        results.update(json.load(open(output.name))["scales"])
+        return results
+
+
+def print_scale(rows, result):
+        print(f"\n{rows} cuisines, {result['database']}, concurrency {result['concurrency']}")
+        print(f"  {'scenario':<26} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'queries':>8} {'errors':>7}")
+        for name, scenario in result["scenarios"].items():
+                queries = "-" if scenario["queries_per_request"] is None else f"{scenario['queries_per_request']:.2f}"
+                print(f"  {name:<26} {scenario['p50_ms']:>9.2f} {scenario['p95_ms']:>9.2f} {scenario['p99_ms']:>9.2f} {scenario['throughput_rps']:>9.1f} {queries:>8} {scenario['errors']:>7}")
+                if scenario.get("first_error"):
+                        print(f"  {'':<26} first error: {scenario['first_error']}")
+
+
+def compare(results, baseline, tolerance):
+        """
+        Lists the regressions against the baseline: a p95 latency or a throughput worse than the baseline by more than
+        ``tolerance``, at least one more query in every other request than the baseline (scenarios partly served from the
+        caches do not run a fixed number), or errors where the baseline had none.
+        """
+        regressions = []
+        for rows, result in results.items():
+                for name, scenario in result["scenarios"].items():
+                        expected = baseline.get(rows, {}).get("scenarios", {}).get(name)
+                        if expected is None:
+                                continue
+                        label = f"{rows} cuisines, {name}"
+                        if scenario["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+                                regressions.append(f"{label}: p95 {scenario['p95_ms']:.2f} ms, baseline {expected['p95_ms']:.2f} ms")
+                        if scenario["throughput_rps"] < expected["throughput_rps"] * (1 - tolerance):
+                                regressions.append(f"{label}: {scenario['throughput_rps']:.1f} req/s, baseline {expected['throughput_rps']:.1f} req/s")
+                        if (scenario["queries_per_request"] or 0) - (expected["queries_per_request"] or 0) >= 0.5:
+                                regressions.append(f"{label}: {scenario['queries_per_request']} queries per request, baseline {expected['queries_per_request']}")
+                        if scenario["errors"] and not expected["errors"]:
+                                regressions.append(f"{label}: {scenario['errors']} errors, baseline none")
+        return regressions
+
+
+def main():
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("--rows", type=int, nargs="+", default=[1000], help="one or more scales, in cuisines")
+        parser.add_argument("--database-url", help="sync SQLAlchemy URL, a SQLite file per scale in the temp directory by default")
+        parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario before measuring")
+        parser.add_argument("--images-per-cuisine", type=int, default=2)
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--s3-latency-ms", type=float, default=0.0, help="added to every in-memory S3 call")
+        parser.add_argument("--real-tag-model", action="store_true", help="use the artifact at TAG_MODEL_PATH instead of the stand-in model")
+        parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, metavar="SCENARIO", help=f"subset of: {', '.join(SCENARIOS)}")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--reseed", action="store_true")
+        parser.add_argument("--output", help="write the results as JSON to this file")
+        parser.add_argument("--baseline", default=BASELINE_PATH)
+        parser.add_argument("--update-baseline", action="store_true", help="store the results of the measured scales as the baseline")
+        parser.add_argument("--no-compare", action="store_true")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative change of p95 latency and throughput")
+        args = parser.parse_args()
+        if args.database_url and len(args.rows) > 1:
+                parser.error("--database-url takes a single --rows value")
+
+        if len(args.rows) > 1:
+                # Every subprocess prints its own scale
+                results = run_scales_in_subprocesses(args)
+        else:
+                results = {str(args.rows[0]): run_scale(args)}
+                print_scale(args.rows[0], results[str(args.rows[0])])
+        if args.output:
+                with open(args.output, "w") as file:
+                        json.dump({"scales": results}, file, indent=2)
+
+        baseline = json.load(open(args.baseline))["scales"] if os.path.exists(args.baseline) else {}
+        if args.update_baseline:
+                with open(args.baseline, "w") as file:
+                        json.dump({"scales": {**baseline, **results}}, file, indent=2)
+                        file.write("\n")
+                print(f"\nbaseline updated: {args.baseline}")
+        elif not args.no_compare and baseline:
+                regressions = compare(results, baseline, args.tolerance)
+                print(f"\n{len(regressions)} regressions against {args.baseline}" + "".join(f"\n  {regression}" for regression in regressions))
+                return 1 if regressions else 0
+        return 0
+
+
+if __name__ == "__main__":
+        sys.exit(main())
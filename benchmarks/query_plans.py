@@ -0,0 +1,159 @@
+"""
+Seeds a database with synthetic users, cuisines and images, then prints the query plan and the latency of the lookups
+behind the API hot paths (tag search, my-cuisines, image loading, phone number lookup, proximity search).
+
+Usage:
+        python -m benchmarks.query_plans --rows 1000000
+        python -m benchmarks.query_plans --rows 1000000 --without-indexes    # same data, secondary indexes dropped
+
+The database defaults to a SQLite file in the temp directory, pass --database-url to run it against MySQL. Tables are
+recreated and reseeded only when the row count differs from --rows (or with --reseed).
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# app.config requires these settings, none of them are used by the benchmark
+for key in ("DATABASE_URL", "S3_BUCKET", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "SECRET_KEY"):
+        os.environ.setdefault(key, "sqlite://" if key == "DATABASE_URL" else "benchmark")
+
+from sqlalchemy import create_engine, func, insert, select, text, or_  # noqa: E402
+
+from app.database import Base  # noqa: E402
+from app.models.cuisine_details import CuisineDetails  # noqa: E402
+from app.models.cuisine_images import CuisineImages  # noqa: E402
+from app.models.users import Users  # noqa: E402
+from app.utils.geo import bounding_box, coordinate_columns, geohash_cover  # noqa: E402
+
+TAG_VALUES = {
+        "cuisine": ["american", "chinese", "french", "fusion", "indian", "italian", "japanese", "mexican", "thai"],
+        "budget": ["high", "low", "medium"],
+        "ambience": ["casual", "contemporary", "formal"],
+        "dietary_options": ["gluten-free", "non-vegetarian", "vegetarian"],
+}
+CHUNK_SIZE = 10000
+PAGE_SIZE = 50
+
+
+def seed(engine, rows, images_per_cuisine, users, describe=None):
+        # describe(rng, index) gives the description of each cuisine, every row gets the same one by default
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        rng = random.Random(42)
+        started_at = datetime(2024, 1, 1)
+
+        user_rows = [{"id": str(uuid.uuid4()), "name": f"user {index}", "phone_number": f"9{index:09d}", "otp_secret": "BENCHMARK", "created_at": started_at} for index in range(users)]
+        with engine.begin() as connection:
+                for start in range(0, len(user_rows), CHUNK_SIZE):
+                        connection.execute(insert(Users.__table__), user_rows[start:start + CHUNK_SIZE])
+
+        for start in range(0, rows, CHUNK_SIZE):
+                cuisine_rows, image_rows = [], []
+                for index in range(start, min(start + CHUNK_SIZE, rows)):
+                        lat, lng = rng.uniform(8.0, 32.0), rng.uniform(68.0, 92.0)
+                        created_at = started_at + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+                        cuisine_row = {
+                                "id": str(uuid.uuid4()), "user_id": rng.choice(user_rows)["id"], "name": f"restaurant {index}", "description": describe(rng, index) if describe else "synthetic benchmark row",
+                                "latitude": str(lat), "longitude": str(lng), **coordinate_columns(lat, lng), "created_at": created_at, "updated_at": created_at,
+                                **{tag: rng.choice(values) for tag, values in TAG_VALUES.items()},
+                        }
+                        cuisine_rows.append(cuisine_row)
+                        image_rows.extend({"id": str(uuid.uuid4()), "cuisine_id": cuisine_row["id"], "image_url": f"https://bucket.s3.amazonaws.com/{uuid.uuid4()}.jpg",
+                                           "created_at": created_at} for _ in range(images_per_cuisine))
+                with engine.begin() as connection:
+                        connection.execute(insert(CuisineDetails.__table__), cuisine_rows)
+                        if image_rows:
+                                connection.execute(insert(CuisineImages.__table__), image_rows)
+                print(f"seeded {min(start + CHUNK_SIZE, rows)}/{rows} cuisines", end="\r", flush=True)
+        print()
+
+
+def drop_secondary_indexes(engine):
+        with engine.begin() as connection:
+                for table in (CuisineDetails.__table__, CuisineImages.__table__, Users.__table__):
+                        for index in table.indexes:
+                                index.drop(connection, checkfirst=True)
+
+
+def create_secondary_indexes(engine):
+        with engine.begin() as connection:
+                for table in (CuisineDetails.__table__, CuisineImages.__table__, Users.__table__):
+                        for index in table.indexes:
+                                index.create(connection, checkfirst=True)
+
+
+def build_queries(engine):
+        with engine.connect() as connection:
+                sample = connection.execute(select(CuisineDetails.id, CuisineDetails.user_id).limit(PAGE_SIZE)).all()
+                phone_number = connection.execute(select(Users.phone_number).limit(1)).scalar_one()
+        cuisine_ids = [row.id for row in sample]
+        (min_lat, max_lat), lng_ranges = bounding_box(19.07, 72.87, 5)
+        order = (CuisineDetails.created_at.desc(), CuisineDetails.id.desc())
+        return {
+                "tag search page": select(CuisineDetails).filter(CuisineDetails.cuisine == "italian", CuisineDetails.budget == "low", CuisineDetails.ambience == "casual",
+                                                                CuisineDetails.dietary_options == "vegetarian").order_by(*order).limit(PAGE_SIZE + 1),
+                "latest page": select(CuisineDetails).order_by(*order).limit(PAGE_SIZE + 1),
+                "my-cuisines page": select(CuisineDetails).filter(CuisineDetails.user_id == sample[0].user_id).order_by(*order).limit(PAGE_SIZE + 1),
+                "images of a page": select(CuisineImages).filter(CuisineImages.cuisine_id.in_(cuisine_ids)),
+                "user by phone number": select(Users).filter(Users.phone_number == phone_number),
+                "proximity candidates": select(CuisineDetails.id, CuisineDetails.lat, CuisineDetails.lng).filter(
+                        CuisineDetails.lat.between(min_lat, max_lat), or_(*(CuisineDetails.lng.between(low, high) for low, high in lng_ranges)),
+                        CuisineDetails.geohash_filter(geohash_cover((min_lat, max_lat), lng_ranges))),
+        }
+
+
+def explain(connection, statement):
+        sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+        prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+        return [" | ".join(str(value) for value in row) for row in connection.execute(text(prefix + sql))]
+
+
+def measure(connection, statement, repeat):
+        timings = []
+        for _ in range(repeat):
+                started = time.perf_counter()
+                connection.execute(statement).all()
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def main():
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("--database-url", default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'cuisineiq_query_plans.db')}")
+        parser.add_argument("--rows", type=int, default=1000000)
+        parser.add_argument("--images-per-cuisine", type=int, default=1)
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--reseed", action="store_true")
+        parser.add_argument("--without-indexes", action="store_true", help="drop the secondary indexes before measuring")
+        args = parser.parse_args()
+
+        engine = create_engine(args.database_url)
+        with engine.connect() as connection:
+                existing_rows = connection.execute(select(func.count()).select_from(CuisineDetails.__table__)).scalar_one() if engine.dialect.has_table(connection, "cuisine_details") else None
+        if args.reseed or existing_rows != args.rows:
+                seed(engine, args.rows, args.images_per_cuisine, args.users)
+
+        if args.without_indexes:
+                drop_secondary_indexes(engine)
+        else:
+                create_secondary_indexes(engine)
+
+        print(f"{args.rows} cuisines, secondary indexes {'dropped' if args.without_indexes else 'present'}, {engine.dialect.name}\n")
+        with engine.connect() as connection:
+                for name, statement in build_queries(engine).items():
+                        median, p95 = measure(connection, statement, args.repeat)
+                        print(f"{name}: median {median:.2f} ms, p95 {p95:.2f} ms")
+                        for line in explain(connection, statement):
+                                print(f"        {line}")
+                        print()
+
+
+if __name__ == "__main__":
+        main()
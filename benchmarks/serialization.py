@@ -0,0 +1,86 @@
+"""
+Compares the time to turn 1,000 cuisines (with their images) into a JSON response body, the way the listing routes used
+to do it and the way they do it now.
+
+        before:  {**cuisine.__dict__, "images": [...]} walked by jsonable_encoder, rendered by JSONResponse (json.dumps)
+        after:   serialize_cuisine, validated into the CuisineListOut response model, rendered by ORJSONResponse (orjson)
+
+Usage:
+        python -m benchmarks.serialization --cuisines 1000 --images 3 --repeat 50
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# app.config requires these settings, none of them are used by the benchmark
+for key in ("DATABASE_URL", "S3_BUCKET", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "SECRET_KEY"):
+        os.environ.setdefault(key, "sqlite://" if key == "DATABASE_URL" else "benchmark")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+
+from app.models.cuisine_details import CuisineDetails  # noqa: E402
+from app.models.cuisine_images import CuisineImages  # noqa: E402
+from app.schemas.cuisine_details import CuisineListOut  # noqa: E402
+from app.utils.helper_functions import serialize_cuisine  # noqa: E402
+
+
+def make_cuisines(count, images_per_cuisine):
+        created_at = datetime(2024, 1, 1)
+        cuisines = []
+        for index in range(count):
+                cuisine = CuisineDetails(user_id="benchmark-user", name=f"restaurant {index}", description="synthetic benchmark row with a description of typical length",
+                                         latitude="28.6139", longitude="77.2090", cuisine="indian", budget="medium", ambience="casual", dietary_options="vegetarian",
+                                         created_at=created_at + timedelta(seconds=index), updated_at=created_at + timedelta(seconds=index))
+                cuisine.images = [CuisineImages(image_url=f"https://bucket.s3.amazonaws.com/{index}-{image}.jpg", thumbnail_url=f"https://bucket.s3.amazonaws.com/{index}-{image}_thumb.webp")
+                                  for image in range(images_per_cuisine)]
+                cuisines.append(cuisine)
+        return cuisines
+
+
+def render_before(cuisines):
+        cuisines_arr = [{**cuisine.__dict__, "images": [image.image_url for image in cuisine.images]} for cuisine in cuisines]
+        return JSONResponse(jsonable_encoder({"message": "Cuisines fetched successfully", "cuisines": cuisines_arr})).body
+
+
+def render_after(cuisines, fields=None):
+        cuisines_arr = [serialize_cuisine(cuisine, fields, thumbnails=True) for cuisine in cuisines]
+        response = CuisineListOut.model_validate({"message": "Cuisines fetched successfully", "cuisines": cuisines_arr, "next_cursor": None})
+        return ORJSONResponse(response.model_dump(mode="json", exclude_unset=True)).body
+
+
+def measure(render, repeat):
+        timings = []
+        for _ in range(repeat):
+                started = time.perf_counter()
+                body = render()
+                timings.append(time.perf_counter() - started)
+        return statistics.median(timings), len(body)
+
+
+def main():
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("--cuisines", type=int, default=1000)
+        parser.add_argument("--images", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=50)
+        args = parser.parse_args()
+
+        cuisines = make_cuisines(args.cuisines, args.images)
+        scenarios = {
+                "before (__dict__ + jsonable_encoder + json)": lambda: render_before(cuisines),
+                "after (response model + orjson)": lambda: render_after(cuisines),
+                "after, fields=id,name,images": lambda: render_after(cuisines, ["id", "name", "images"]),
+        }
+
+        print(f"{args.cuisines} cuisines, {args.images} images each, median of {args.repeat} runs")
+        baseline = None
+        for name, render in scenarios.items():
+                seconds, size = measure(render, args.repeat)
+                baseline = baseline or seconds
+                print(f"  {name:<46} {seconds * 1000:8.2f} ms  {size / 1024:8.1f} KiB  x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+        main()
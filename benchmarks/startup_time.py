@@ -0,0 +1,113 @@
+"""
+Measures the start up of a worker: the time to import the app and to run its lifespan start up (tag model, search
+index) until the first request could be served, plus a `python -X importtime` breakdown of the import by package and
+by module.
+
+Usage:
+        python -m benchmarks.startup_time
+        python -m benchmarks.startup_time --module app.cli --top 15
+        python -m benchmarks.startup_time --output startup.json
+        python -m benchmarks.startup_time --baseline startup.json    # adds the change of every package against an earlier run
+
+Every measurement runs in a fresh interpreter, the wall times are the median of --repeat runs without -X importtime
+(which slows the import down), the breakdown comes from one extra run with it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imports the module, then runs the lifespan start up of main.app when asked to, and prints the timings as JSON
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=["_"])
+imported = time.perf_counter()
+timings = {"import_seconds": imported - started}
+if sys.argv[2] == "lifespan":
+        async def start():
+                async with module.lifespan(module.app):
+                        timings["lifespan_seconds"] = time.perf_counter() - imported
+        asyncio.run(start())
+print(json.dumps(timings))
+"""
+
+
+def startup_environment():
+        # app.config requires these settings, nothing is connected to during the start up
+        environment = dict(os.environ)
+        for key in ("S3_BUCKET", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "SECRET_KEY"):
+                environment.setdefault(key, "benchmark")
+        environment.setdefault("DATABASE_URL", "sqlite://")
+        environment.setdefault("SEARCH_INDEX_DIR", os.path.join(tempfile.gettempdir(), "cuisineiq_startup_search_index"))
+        return environment
+
+
+def measure_startup(module, lifespan, repeat):
+        runs = []
+        for _ in range(repeat):
+                completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, module, "lifespan" if lifespan else "import"], cwd=PROJECT_DIR,
+                                           env=startup_environment(), capture_output=True, text=True, check=True)
+                runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def import_breakdown(module):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=PROJECT_DIR, env=startup_environment(),
+                                   capture_output=True, text=True, check=True)
+        modules = []
+        for line in completed.stderr.splitlines():
+                if not line.startswith("import time:") or "imported package" in line:
+                        continue
+                self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+                modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+
+        # The self times of the modules of a package add up to what importing the package costs, wherever it was imported from
+        packages = defaultdict(float)
+        for entry in modules:
+                packages[entry["module"].split(".")[0]] += entry["self_ms"]
+        return modules, dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+
+def main():
+        parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("--module", default="main", help="module to import, the lifespan start up is measured for main only")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--top", type=int, default=20)
+        parser.add_argument("--output", help="write the results as JSON to this file")
+        parser.add_argument("--baseline", help="results of an earlier run (--output) to compare the packages against")
+        args = parser.parse_args()
+
+        timings = measure_startup(args.module, args.module == "main", args.repeat)
+        modules, packages = import_breakdown(args.module)
+        baseline = json.load(open(args.baseline))["packages"] if args.baseline else {}
+
+        print(f"import {args.module}: {timings['import_seconds'] * 1000:.0f} ms (median of {args.repeat})")
+        if "lifespan_seconds" in timings:
+                print(f"lifespan start up: {timings['lifespan_seconds'] * 1000:.0f} ms, ready after {(timings['import_seconds'] + timings['lifespan_seconds']) * 1000:.0f} ms")
+
+        print(f"\nslowest packages to import (-X importtime, sum of self times){', change against ' + args.baseline if baseline else ''}")
+        for package, self_ms in list(packages.items())[:args.top]:
+                change = f"  {self_ms - baseline.get(package, 0):+9.1f} ms" if baseline else ""
+                print(f"  {package:<32} {self_ms:9.1f} ms{change}")
+        if baseline:
+                for package in sorted(set(baseline) - set(packages), key=baseline.get, reverse=True)[:args.top]:
+                        print(f"  {package:<32} {'not imported':>12}  {-baseline[package]:+9.1f} ms")
+
+        print("\nslowest modules (self time)")
+        for entry in sorted(modules, key=lambda entry: entry["self_ms"], reverse=True)[:args.top]:
+                print(f"  {entry['module']:<48} {entry['self_ms']:9.1f} ms  (cumulative {entry['cumulative_ms']:.1f} ms)")
+
+        if args.output:
+                with open(args.output, "w") as file:
+                        json.dump({"module": args.module, **timings, "packages": packages, "modules": modules}, file, indent=2)
+
+
+if __name__ == "__main__":
+        main()
@@ -1,12 +1,38 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
+from app.config import settings
 from app.routes.cusine_crud import router as cuisine_crud_router
+from app.routes.diagnostics import router as diagnostics_router
+from app.routes.metrics import router as metrics_router
 from app.routes.user_authentication import router as user_authentication_router
 
-from app.utils.dependencies import validate_token
+from app.utils.dependencies import validate_token, validate_admin_token
+from app.utils.helper_functions import get_s3_client, shutdown_image_process_pool
+from app.utils.metrics import MetricsMiddleware
+from app.utils.search_index import cuisine_search_index
+from app.utils.tag_model import tag_model_registry
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+        # Load the tag generation model once per worker before serving requests
+        await run_in_threadpool(tag_model_registry.load)
+        # Map the search index segments already on disk, it is built on the first ranked search otherwise
+        await run_in_threadpool(cuisine_search_index.open)
+        # The S3 client is built in the background, the worker starts serving without waiting for boto3
+        s3_warmup = asyncio.get_running_loop().run_in_executor(None, get_s3_client)
+        yield
+        await s3_warmup
+        shutdown_image_process_pool()
+
 
-app = FastAPI(title="Cuisine API", description="API for cuisine details", version="1.0.0")
+app = FastAPI(title="Cuisine API", description="API for cuisine details", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [
         "http://localhost:3000",
@@ -20,5 +46,19 @@ app.add_middleware(
         allow_headers=["*"],
 )
 
+# Sampling profiler, installed only when enabled so requests do not pay for it otherwise
+if settings.PROFILER_ADMIN_TOKEN or settings.PROFILER_SAMPLE_RATE > 0:
+        from app.utils.profiling import ProfilerMiddleware
+
+        app.add_middleware(ProfilerMiddleware, admin_token=settings.PROFILER_ADMIN_TOKEN, sample_rate=settings.PROFILER_SAMPLE_RATE,
+                           interval_ms=settings.PROFILER_INTERVAL_MS, output_dir=settings.PROFILER_OUTPUT_DIR)
+
+# Latency, database statements per request and the opt-in slow request log
+app.add_middleware(MetricsMiddleware, slow_request_seconds=settings.SLOW_REQUEST_LOG_SECONDS, slow_statements=settings.SLOW_REQUEST_LOG_STATEMENTS)
+
 app.include_router(user_authentication_router, tags=["User Authentication"], prefix="/user-authentication")
 app.include_router(cuisine_crud_router, tags=["Cuisine CRUD"], prefix="/cuisine-crud", dependencies=[Depends(validate_token)])
+# The diagnostics and metrics expose the internals of the workers, they are only served to operators holding ADMIN_TOKEN
+if settings.ADMIN_TOKEN:
+        app.include_router(diagnostics_router, tags=["Diagnostics"], prefix="/diagnostics", dependencies=[Depends(validate_admin_token)])
+        app.include_router(metrics_router, tags=["Diagnostics"], dependencies=[Depends(validate_admin_token)])
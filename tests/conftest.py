@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+# app.config reads the settings when the app is imported, the tests run against a throwaway SQLite database
+TEST_DIR = tempfile.mkdtemp(prefix="cuisineiq_tests_")
+os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+        "SEARCH_INDEX_DIR": os.path.join(TEST_DIR, "search_index"),
+        "S3_BUCKET": "cuisineiq-test-bucket",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "SECRET_KEY": "JBSWY3DPEHPK3PXP",
+})
+
+from datetime import datetime, timedelta
+
+import boto3
+import jwt
+import pytest
+from moto import mock_aws
+
+from app.config import settings
+from app.database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine
+from app.models.cuisine_details import CuisineDetails
+from app.models.cuisine_images import CuisineImages  # noqa: F401, registers the table on Base
+from app.models.users import Users
+from app.utils import helper_functions
+
+
+@pytest.fixture
+def anyio_backend():
+        return "asyncio"
+
+
+@pytest.fixture
+async def db():
+        async with async_engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+        async with AsyncSessionLocal() as session:
+                yield session
+        async with async_engine.begin() as connection:
+                await connection.run_sync(Base.metadata.drop_all)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+        with mock_aws():
+                # The app builds its client lazily, the one built here talks to the mocked S3
+                monkeypatch.setattr(helper_functions, "s3_client", None)
+                client = boto3.client("s3", region_name="ap-south-1")
+                client.create_bucket(Bucket=settings.S3_BUCKET, CreateBucketConfiguration={"LocationConstraint": "ap-south-1"})
+                yield client
+
+
+@pytest.fixture
+def owner():
+        Base.metadata.create_all(engine)
+        with SessionLocal() as db:
+                user = Users(name="owner", phone_number="9000000001", otp_secret="JBSWY3DPEHPK3PXP")
+                db.add(user)
+                db.flush()
+                cuisine = CuisineDetails(user_id=user.id, name="green curry", description="spicy", latitude="12.97", longitude="77.59",
+                                         cuisine="thai", budget="low", ambience="casual", dietary_options="vegetarian")
+                db.add(cuisine)
+                db.commit()
+                token = jwt.encode({"user_id": user.id, "name": user.name, "email": None, "exp": datetime.utcnow() + timedelta(minutes=5)},
+                                   settings.SECRET_KEY, algorithm="HS256")
+                yield {"cuisine_id": cuisine.id, "headers": {"token": token}}
+        Base.metadata.drop_all(engine)
@@ -0,0 +1,48 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import main
+from app.config import settings
+from app.routes.diagnostics import router as diagnostics_router
+from app.routes.metrics import router as metrics_router
+from app.utils.dependencies import validate_admin_token
+
+
+def test_operator_routes_are_not_served_without_admin_token():
+        assert settings.ADMIN_TOKEN is None
+        paths = {route.path for route in main.app.routes}
+        assert not any(path.startswith("/diagnostics") for path in paths)
+        assert "/metrics" not in paths
+
+
+@pytest.fixture
+def operator_client(monkeypatch):
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", "operator-secret")
+        app = FastAPI()
+        app.include_router(diagnostics_router, prefix="/diagnostics", dependencies=[Depends(validate_admin_token)])
+        app.include_router(metrics_router, dependencies=[Depends(validate_admin_token)])
+        return TestClient(app)
+
+
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer wrong"}, {"Authorization": "operator-secret"}, {"token": "operator-secret"}])
+@pytest.mark.parametrize("path", ["/diagnostics/response-cache", "/metrics"])
+def test_operator_routes_reject_missing_or_wrong_admin_token(operator_client, headers, path):
+        response = operator_client.get(path, headers=headers)
+
+        assert response.status_code == 401
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_operator_routes_accept_admin_token(operator_client):
+        response = operator_client.get("/diagnostics/response-cache", headers={"Authorization": "Bearer operator-secret"})
+
+        assert response.status_code == 200
+        assert "response_cache" in response.json()
+
+
+def test_metrics_accept_admin_token(operator_client):
+        response = operator_client.get("/metrics", headers={"Authorization": "Bearer operator-secret"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
@@ -0,0 +1,86 @@
+import math
+import random
+import sqlite3
+import unicodedata
+
+import pytest
+
+from app.models.cuisine_details import CuisineDetails
+from app.utils.geo import EARTH_RADIUS_KM, GEOHASH_ALPHABET, bounding_box, encode_geohash, geohash_cover, geohash_range, haversine_km
+
+
+def point_at(lat, lng, distance_km, bearing):
+        # Destination point at a distance and bearing from (lat, lng) on the sphere
+        angular, lat1, lng1 = distance_km / EARTH_RADIUS_KM, math.radians(lat), math.radians(lng)
+        lat2 = math.asin(math.sin(lat1) * math.cos(angular) + math.cos(lat1) * math.sin(angular) * math.cos(bearing))
+        lng2 = lng1 + math.atan2(math.sin(bearing) * math.sin(angular) * math.cos(lat1), math.cos(angular) - math.sin(lat1) * math.sin(lat2))
+        return math.degrees(lat2), (math.degrees(lng2) + 540.0) % 360.0 - 180.0
+
+
+def test_encode_geohash():
+        assert encode_geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+        assert encode_geohash(-25.382708, -49.265506, 8) == "6gkzwgjz"
+
+
+def mysql_0900_ai_ci(left, right):
+        # Order of MySQL 8's default utf8mb4_0900_ai_ci for ASCII: punctuation, then digits, then letters without case
+        def weight(character):
+                return (0 if unicodedata.category(character)[0] in "PS" else 1 if character.isdigit() else 2, character.lower())
+
+        left_key, right_key = [weight(character) for character in left], [weight(character) for character in right]
+        return (left_key > right_key) - (left_key < right_key)
+
+
+@pytest.mark.parametrize("cell", ["t", "tdr1", "tdrz", "tzzz", "zz", "0", "b"])
+def test_geohash_range_holds_under_mysql_collation(cell):
+        connection = sqlite3.connect(":memory:")
+        connection.create_collation("mysql_0900_ai_ci", mysql_0900_ai_ci)
+        connection.execute("CREATE TABLE cells (geohash VARCHAR(12) COLLATE mysql_0900_ai_ci)")
+        rng = random.Random(cell)
+        geohashes = {"".join(rng.choice(GEOHASH_ALPHABET) for _ in range(6)) for _ in range(2000)}
+        geohashes |= {cell + "".join(rng.choice(GEOHASH_ALPHABET) for _ in range(6 - len(cell))) for _ in range(200)}
+        connection.executemany("INSERT INTO cells VALUES (?)", [(geohash,) for geohash in geohashes])
+
+        low, high = geohash_range(cell)
+        if high is None:
+                matched = connection.execute("SELECT geohash FROM cells WHERE geohash >= ?", (low,)).fetchall()
+        else:
+                matched = connection.execute("SELECT geohash FROM cells WHERE geohash >= ? AND geohash < ?", (low, high)).fetchall()
+        assert {geohash for geohash, in matched} == {geohash for geohash in geohashes if geohash.startswith(cell)}
+
+        # A bound made of the cell and a character sorting last in byte order matches nothing under this collation
+        assert connection.execute("SELECT COUNT(*) FROM cells WHERE geohash >= ? AND geohash < ?", (cell + "0", cell + "~")).fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("radius_km", [0.5, 5, 50, 500])
+def test_bounding_box_and_geohash_cover_contain_the_circle(radius_km):
+        rng = random.Random(radius_km)
+        for _ in range(300):
+                lat, lng = rng.uniform(-89.0, 89.0), rng.uniform(-180.0, 180.0)
+                (min_lat, max_lat), lng_ranges = bounding_box(lat, lng, radius_km)
+                cells = geohash_cover((min_lat, max_lat), lng_ranges)
+                assert cells is None or len(cells) <= 16
+                for bearing in range(0, 360, 15):
+                        point_lat, point_lng = point_at(lat, lng, radius_km * 0.999, math.radians(bearing))
+                        assert min_lat <= point_lat <= max_lat
+                        assert any(low <= point_lng <= high for low, high in lng_ranges)
+                        if cells is not None:
+                                assert encode_geohash(point_lat, point_lng).startswith(tuple(cells))
+
+
+@pytest.mark.anyio
+async def test_cuisines_near_across_geohash_cells(db):
+        # Around the antimeridian and the equator the neighbouring geohash cells share no prefix at all
+        centre = (0.0005, 179.9995)
+        for number, (distance_km, bearing) in enumerate([(0.2, 0), (1.5, 90), (2.5, 200), (3.5, 300), (8, 45)]):
+                lat, lng = point_at(*centre, distance_km, math.radians(bearing))
+                db.add(CuisineDetails(user_id="owner", name=f"cuisine {number}", description="spicy", latitude=str(lat), longitude=str(lng),
+                                      cuisine="thai", budget="low", ambience="casual", dietary_options="vegetarian"))
+        await db.commit()
+
+        nearest = await CuisineDetails.get_cuisines_near(db, *centre, radius_km=5)
+
+        assert [cuisine.name for cuisine, _ in nearest] == ["cuisine 0", "cuisine 1", "cuisine 2", "cuisine 3"]
+        assert [round(distance, 1) for _, distance in nearest] == [0.2, 1.5, 2.5, 3.5]
+        assert all(cuisine.geohash == encode_geohash(cuisine.lat, cuisine.lng) for cuisine, _ in nearest)
+        assert haversine_km(*centre, [nearest[-1][0].lat], [nearest[-1][0].lng])[0] <= 5
@@ -0,0 +1,106 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from app.config import settings
+from app.database import AsyncSessionLocal, SessionLocal
+from app.models.cuisine_images import CuisineImages
+
+CUISINE = {"name": "red curry", "description": "spicy coconut curry", "latitude": "12.97", "longitude": "77.59"}
+
+
+def jpeg_bytes(color):
+        image = io.BytesIO()
+        Image.new("RGB", (64, 48), color).save(image, "JPEG")
+        return image.getvalue()
+
+
+def stored_keys(s3):
+        return {item["Key"] for item in s3.list_objects_v2(Bucket=settings.S3_BUCKET).get("Contents", [])}
+
+
+def add_cuisine(client, owner, *images):
+        return client.post("/cuisine-crud/add-cuisine", data={"cuisine_details": json.dumps(CUISINE)}, headers=owner["headers"],
+                           files=[("images", (f"image{number}.jpg", data, "image/jpeg")) for number, data in enumerate(images)])
+
+
+@pytest.fixture
+def client():
+        with TestClient(main.app) as client:
+                yield client
+
+
+def test_add_cuisine_stores_images_once_per_content(s3, owner, client):
+        assert add_cuisine(client, owner, jpeg_bytes((10, 20, 30))).status_code == 201
+        keys = stored_keys(s3)
+        assert add_cuisine(client, owner, jpeg_bytes((10, 20, 30))).status_code == 201
+
+        # The second cuisine reuses the original and its variants
+        assert len(keys) == 3 and stored_keys(s3) == keys
+
+
+def test_add_cuisine_removes_its_uploads_when_saving_fails(s3, owner, client, monkeypatch):
+        assert add_cuisine(client, owner, jpeg_bytes((10, 20, 30))).status_code == 201
+        reused_keys = stored_keys(s3)
+
+        async def failing_insert(*args, **kwargs):
+                raise RuntimeError("database is gone")
+
+        monkeypatch.setattr(CuisineImages, "add_cuisine_images_bulk", failing_insert)
+        response = add_cuisine(client, owner, jpeg_bytes((10, 20, 30)), jpeg_bytes((200, 100, 0)))
+
+        assert response.status_code == 500
+        # The new image is removed, the reused objects still belong to the first cuisine
+        assert stored_keys(s3) == reused_keys
+        with SessionLocal() as db:
+                assert db.query(CuisineImages).count() == 1
+
+
+def image_ids(cuisine_id=None):
+        with SessionLocal() as db:
+                query = db.query(CuisineImages)
+                if cuisine_id is not None:
+                        query = query.filter(CuisineImages.cuisine_id == cuisine_id)
+                return [image.id for image in query.order_by(CuisineImages.created_at)]
+
+
+def test_delete_image_keeps_objects_shared_with_other_images(s3, owner, client):
+        for _ in range(2):
+                assert client.post(f"/cuisine-crud/add-images/{owner['cuisine_id']}", files={"image": ("a.jpg", jpeg_bytes((1, 2, 3)), "image/jpeg")},
+                                   headers=owner["headers"]).status_code == 201
+        keys = stored_keys(s3)
+        first, second = image_ids()
+
+        assert client.delete(f"/cuisine-crud/delete_image/{first}", headers=owner["headers"]).status_code == 200
+        assert stored_keys(s3) == keys
+        assert client.delete(f"/cuisine-crud/delete_image/{second}", headers=owner["headers"]).status_code == 200
+        assert stored_keys(s3) == set()
+
+
+def test_upload_reusing_objects_deleted_before_its_row_is_saved_stores_them_again(s3, owner, client, monkeypatch):
+        assert client.post(f"/cuisine-crud/add-images/{owner['cuisine_id']}", files={"image": ("a.jpg", jpeg_bytes((1, 2, 3)), "image/jpeg")},
+                           headers=owner["headers"]).status_code == 201
+        keys = stored_keys(s3)
+        (existing,) = image_ids()
+
+        # The last image of the content is deleted after the second upload found its objects, but before that upload inserts its row
+        original_add_cuisine_images = CuisineImages.add_cuisine_images
+
+        async def add_after_concurrent_delete(db, cuisine_id, image_url, **variants):
+                monkeypatch.setattr(CuisineImages, "add_cuisine_images", original_add_cuisine_images)
+                async with AsyncSessionLocal() as other_db:
+                        await CuisineImages.delete_image(other_db, existing, settings.S3_BUCKET)
+                assert stored_keys(s3) == set()
+                return await original_add_cuisine_images(db, cuisine_id, image_url, **variants)
+
+        monkeypatch.setattr(CuisineImages, "add_cuisine_images", add_after_concurrent_delete)
+        response = client.post(f"/cuisine-crud/add-images/{owner['cuisine_id']}", files={"image": ("b.jpg", jpeg_bytes((1, 2, 3)), "image/jpeg")},
+                               headers=owner["headers"])
+
+        assert response.status_code == 201
+        assert len(image_ids()) == 1
+        assert stored_keys(s3) == keys
@@ -0,0 +1,50 @@
+import io
+
+import requests
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from app.config import settings
+from app.database import SessionLocal
+from app.models.cuisine_details import CuisineDetails
+
+
+def png_bytes():
+        image = io.BytesIO()
+        Image.new("RGB", (64, 48), (200, 60, 30)).save(image, "PNG")
+        return image.getvalue()
+
+
+def upload(client, owner, data, content_type="image/png"):
+        # Presign, then POST the object straight to S3 with the returned form fields as a browser would
+        response = client.post(f"/cuisine-crud/upload-url/{owner['cuisine_id']}", json={"content_type": content_type, "content_length": len(data)}, headers=owner["headers"])
+        assert response.status_code == 201, response.text
+        presigned = response.json()
+        s3_response = requests.post(presigned["post"]["url"], data=presigned["post"]["fields"], files={"file": ("upload", data, content_type)})
+        assert s3_response.status_code in (200, 201, 204), s3_response.text
+        return presigned["object_key"]
+
+
+def test_presigned_upload_round_trip(s3, owner):
+        client = TestClient(main.app)
+        object_key = upload(client, owner, png_bytes())
+
+        response = client.post(f"/cuisine-crud/confirm-upload/{owner['cuisine_id']}", json={"object_key": object_key}, headers=owner["headers"])
+
+        assert response.status_code == 201, response.text
+        assert response.json()["image_url"].endswith(object_key)
+        assert s3.head_object(Bucket=settings.S3_BUCKET, Key=object_key)["ContentLength"] > 0
+        with SessionLocal() as db:
+                cuisine = db.get(CuisineDetails, owner["cuisine_id"])
+                assert [image.image_url for image in cuisine.images] == [response.json()["image_url"]]
+
+
+def test_confirm_rejects_and_deletes_non_image(s3, owner):
+        client = TestClient(main.app)
+        object_key = upload(client, owner, b"#!/bin/sh\necho this is not an image\n")
+
+        response = client.post(f"/cuisine-crud/confirm-upload/{owner['cuisine_id']}", json={"object_key": object_key}, headers=owner["headers"])
+
+        assert response.status_code == 400
+        assert s3.list_objects_v2(Bucket=settings.S3_BUCKET, Prefix=object_key).get("KeyCount") == 0
@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app.models.cuisine_details import CuisineDetails
+from app.models.cuisine_images import CuisineImages
+from app.models.users import Users
+from app.utils.metrics import RequestMetrics, current_request_metrics
+from app.utils.pagination import build_page
+
+pytestmark = pytest.mark.anyio
+
+CUISINES = 12
+IMAGES_PER_CUISINE = 3
+
+
+@pytest.fixture
+async def user_with_cuisines(db):
+        user = Users(name="owner", phone_number="9000000000", otp_secret="JBSWY3DPEHPK3PXP")
+        db.add(user)
+        await db.flush()
+        for number in range(CUISINES):
+                cuisine = CuisineDetails(user_id=user.id, name=f"cuisine {number}", description="spicy noodles", latitude="12.97", longitude="77.59",
+                                         cuisine="thai", budget="low", ambience="casual", dietary_options="vegetarian")
+                db.add(cuisine)
+                await db.flush()
+                db.add_all(CuisineImages(cuisine_id=cuisine.id, image_url=f"https://images.example/{cuisine.id}/{image}.jpg") for image in range(IMAGES_PER_CUISINE))
+        await db.commit()
+        db.expunge_all()
+        return user
+
+
+async def count_statements(call):
+        # instrument_engine counts every statement against the RequestMetrics of the current context
+        request_metrics = RequestMetrics()
+        token = current_request_metrics.set(request_metrics)
+        try:
+                result = await call
+        finally:
+                current_request_metrics.reset(token)
+        return result, request_metrics.query_count
+
+
+@pytest.mark.parametrize("limit", [None, 5])
+async def test_listing_loads_images_in_one_statement(db, user_with_cuisines, limit):
+        cuisines, statements = await count_statements(CuisineDetails.get_all_cuisines(db, tags={"cuisine": "thai"}, limit=limit))
+
+        # keyset_paginate fetches one row past the page to tell whether there is a next one
+        assert len(cuisines) == (limit + 1 if limit else CUISINES)
+        assert all(len(cuisine.images) == IMAGES_PER_CUISINE for cuisine in cuisines)
+        # One select of the cuisines and one select of the images of all of them, however many cuisines are listed
+        assert statements == 2
+
+
+async def test_my_cuisines_loads_images_in_one_statement(db, user_with_cuisines):
+        cuisines, statements = await count_statements(CuisineDetails.get_cuisine_by_user_ID(db, user_with_cuisines.id))
+
+        assert len(cuisines) == CUISINES
+        assert sum(len(cuisine.images) for cuisine in cuisines) == CUISINES * IMAGES_PER_CUISINE
+        assert statements == 2
+
+
+async def test_listing_without_images_is_one_statement(db, user_with_cuisines):
+        cuisines, statements = await count_statements(CuisineDetails.get_all_cuisines(db, tags={"cuisine": "thai"}, fields={"name"}))
+
+        assert len(cuisines) == CUISINES
+        assert statements == 1
+
+
+async def test_keyset_pages_cover_every_cuisine_once(db, user_with_cuisines):
+        # The fixture's cuisines are created within the same clock tick on fast machines, the id breaks the ties on created_at
+        seen, cursor = [], None
+        while True:
+                rows, cursor = build_page(await CuisineDetails.get_all_cuisines(db, tags={"cuisine": "thai"}, limit=5, cursor=cursor), 5)
+                seen.extend(cuisine.id for cuisine in rows)
+                if cursor is None:
+                        break
+
+        assert sorted(seen) == sorted(set(seen)) and len(seen) == CUISINES
+
+
+async def test_cuisine_created_at_is_required(db, user_with_cuisines):
+        # A NULL created_at could not be encoded in the pagination cursor, bulk inserts skip the ORM default
+        with pytest.raises(IntegrityError):
+                await db.execute(insert(CuisineDetails.__table__).values(id="undated", user_id=user_with_cuisines.id, name="undated", description="spicy noodles",
+                                                                         latitude="12.97", longitude="77.59", cuisine="thai", budget="low", ambience="casual",
+                                                                         dietary_options="vegetarian", created_at=None))